@@ -1,17 +1,80 @@
 '''
 rest_framework reverse 补丁
 '''
+import re
+
+from django.conf import settings
+from django.urls import NoReverseMatch, get_script_prefix, get_urlconf, reverse as django_reverse
 from rest_framework import relations
+from rest_framework.reverse import preserve_builtin_query_params
 
 
 original_reverse = relations.reverse
-def hack_reverse(alias, **kwargs):
-    namespace = kwargs['request'].resolver_match.namespace
+
+def namespaced(alias, request):
+    '''
+    加上当前请求的命名空间(PatchedViewSet.rewrite_app_name 可改写)
+    '''
+    namespace = request.resolver_match.namespace
     if bool(namespace):
-        name = "%s:%s" % (namespace, alias)
-        return original_reverse(name, **kwargs)
+        return "%s:%s" % (namespace, alias)
+    return alias
+
+def slow_reverse(alias, **kwargs):
+    '''
+    每次完整 reverse()(用于对比, 见 hyperlink_benchmark)
+    '''
+    return original_reverse(namespaced(alias, kwargs['request']), **kwargs)
+
+# (urlconf, 脚本前缀, 视图名, 参数名) -> URL 模板(str.format), None 表示不能使用模板
+url_templates = {}
+# 可直接代入模板的参数值(与 reverse() 的结果相同, 无需转义)
+re_url_value = re.compile(r'^[\w-]+$', re.ASCII)
+
+def url_value(value):
+    if isinstance(value, bool):
+        return False
+    return isinstance(value, int) or (isinstance(value, str) and re_url_value.match(value) is not None)
+
+def url_template(name, kwargs):
+    '''
+    视图的 URL 模板: 以占位值 reverse() 一次, 占位值替换为参数名;
+    首次生成时与实际参数的 reverse() 结果比较, 不一致(如: URL 规则不接受占位值)时不使用模板
+    '''
+    key = (get_urlconf() or settings.ROOT_URLCONF, get_script_prefix(), name, tuple(sorted(kwargs)))
+    try:
+        return url_templates[key]
+    except KeyError:
+        pass
+    placeholders = dict((arg, 'urltemplate{0}x'.format(idx)) for idx, arg in enumerate(sorted(kwargs)))
+    url = django_reverse(name, kwargs=kwargs)
+    try:
+        template = django_reverse(name, kwargs=placeholders).replace('{', '{{').replace('}', '}}')
+    except NoReverseMatch:
+        template = None
     else:
-        return original_reverse(alias, **kwargs)
+        for arg, placeholder in placeholders.items():
+            template = template.replace(placeholder, '{%s}' % arg)
+        if template.format(**kwargs) != url:
+            template = None
+    url_templates[key] = template
+    return template
+
+def hack_reverse(alias, args=None, kwargs=None, request=None, format=None, **extra):
+    name = namespaced(alias, request)
+    values = dict(kwargs or {})
+    if format is not None:
+        values['format'] = format
+    if not args and not extra and getattr(request, 'versioning_scheme', None) is None \
+            and all(url_value(value) for value in values.values()):
+        template = url_template(name, values)
+        if template is not None:
+            # 模板为已转义的绝对路径, 拼接请求的 scheme://host 即可(每个请求只计算一次)
+            base = getattr(request, '_url_base', None)
+            if base is None:
+                base = request._url_base = request.build_absolute_uri('/')[:-1]
+            return preserve_builtin_query_params(base + template.format(**values), request)
+    return original_reverse(name, args=args, kwargs=kwargs, request=request, format=format, **extra)
 relations.reverse = hack_reverse
 
 
@@ -23,4 +86,4 @@ def hack_resolve(path, urlconf=None):
         if match.view_name.startswith(preffix):
             match.view_name = match.view_name[len(preffix):]
     return match
-relations.resolve = hack_resolve
\ No newline at end of file
+relations.resolve = hack_resolve
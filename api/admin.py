@@ -2,7 +2,6 @@ from django.contrib import admin
 
 # Register your models here.
 from .models import Organization, OrganizationContact, OrganizationDemand, Team, TeamContact
-from .cache_helper import clear_by_prefix
 
 class OrganizationContactInlineAdmin(admin.StackedInline):
     model = OrganizationContact
@@ -23,11 +22,6 @@ class OrganizationAdmin(admin.ModelAdmin):
     readonly_fields = ['add_time',]
     inlines = (OrganizationContactInlineAdmin, OrganizationDemandInlineAdmin,)
 
-    def save_model(self, request, obj, form, change):
-        # print(form.changed_data)
-        super(OrganizationAdmin, self).save_model(request, obj, form, change)
-        clear_by_prefix('organization')
-
 admin.site.register(Organization, OrganizationAdmin)
 
 # -----------------------------------------------------------------------------------------
@@ -44,9 +38,4 @@ class TeamAdmin(admin.ModelAdmin):
     readonly_fields = ['add_time',]
     inlines = (TeamContactInlineAdmin,)
 
-    def save_model(self, request, obj, form, change):
-        # print(form.changed_data)
-        super(TeamAdmin, self).save_model(request, obj, form, change)
-        clear_by_prefix('team')
-
 admin.site.register(Team, TeamAdmin)
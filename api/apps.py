@@ -4,3 +4,14 @@ from django.apps import AppConfig
 class ApiConfig(AppConfig):
     name = 'api'
     verbose_name = 'API(数据接口)'
+
+    def ready(self):
+        from . import search
+        from .cache_invalidation import connect_signals, register_models
+
+        # 模型写入后失效依赖它的缓存(见 api.cache_invalidation)
+        register_models()
+        connect_signals()
+        # 模型写入后更新搜索索引(见 api.search)
+        search.register_models()
+        search.connect_signals()
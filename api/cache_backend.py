@@ -0,0 +1,307 @@
+'''
+diskcache.DjangoCache 扩展
+
+cache_page 写入的缓存条目(页面 及 header 列表)按资源前缀(key_prefix)打上 diskcache 标签(tag),
+按前缀清除缓存时通过标签索引(tag_index)删除, 而不需要遍历全部缓存键
+
+cache_page 条目及资源代数另有进程内 LRU 缓存(按字节数限制大小), 命中时不读磁盘;
+清除操作更新共享的 epoch 标记, 其它进程每 LOCAL_CHECK_INTERVAL 秒检查一次, 发现变化即清空本进程的 LRU
+
+读写次数、耗时及 DATABASE_TIMEOUT 失败次数记录在 cache_metrics 中
+'''
+import pickle
+import sqlite3
+import threading
+import time
+import uuid
+from collections import OrderedDict
+
+from django.core.cache.backends.base import BaseCache, DEFAULT_TIMEOUT
+from diskcache import DjangoCache, FanoutCache, Timeout
+
+from .cache_metrics import get_metrics
+
+
+cache_page_fixed = 'views.decorators.cache.cache_page'
+cache_header_fixed = 'views.decorators.cache.cache_header'
+cache_generation_fixed = 'cache_generation'
+# 进程内缓存失效标记(不经过 make_key)
+local_epoch_key = 'cache_local_epoch'
+
+def resource_tag(key):
+    '''
+    由 cache_page 生成的缓存键取出资源前缀, 非 cache_page 缓存键返回 None
+
+    缓存键格式:
+    - views.decorators.cache.cache_page.<key_prefix>.<method>.<url md5>.<headers md5>...
+    - views.decorators.cache.cache_header.<key_prefix>.<url md5>...
+    '''
+    for fixed in (cache_page_fixed, cache_header_fixed):
+        if key.startswith(fixed):
+            return key[len(fixed) + 1:].split('.', 1)[0]
+    return None
+
+def metrics_prefix(key):
+    '''
+    缓存键的统计前缀: cache_page 条目为资源前缀, 其余为第一段(如: cache_generation)
+
+    key 可以带有版本(:1:...)
+    '''
+    if key.startswith(':'):
+        key = key.split(':', 2)[-1]
+    tag = resource_tag(key)
+    if tag is not None:
+        return tag
+    return key.split('.', 1)[0]
+
+class LocalCache(object):
+    """In-process LRU cache of pickled values, bounded by total bytes"""
+
+    def __init__(self, size_limit):
+        self.size_limit = size_limit
+        self.size = 0
+        self.clears = 0  # 清空次数, 读磁盘期间发生过清空的值不再写入
+        self.epoch = None  # 最近一次看到的共享 epoch 标记
+        self.checked = 0  # 最近一次检查 epoch 的时间
+        self._data = OrderedDict()  # key -> (pickled value, expire time)
+        self._lock = threading.Lock()
+
+    def get(self, key):
+        with self._lock:
+            item = self._data.get(key, None)
+            if item is None:
+                return None
+            if item[1] is not None and item[1] <= time.time():
+                self._pop(key)
+                return None
+            self._data.move_to_end(key)
+            return item[0]
+
+    def set(self, key, data, expire_time, clears=None):
+        # 单个条目不超过总大小的 1/8, 避免大页面挤出全部热点条目
+        if len(data) > self.size_limit // 8:
+            self.discard(key)
+            return
+        with self._lock:
+            if clears is not None and clears != self.clears:
+                return
+            self._pop(key)
+            self._data[key] = (data, expire_time)
+            self.size += len(data)
+            while self.size > self.size_limit:
+                self._pop(next(iter(self._data)))
+
+    def discard(self, key):
+        with self._lock:
+            self._pop(key)
+
+    def clear(self):
+        with self._lock:
+            self._data.clear()
+            self.size = 0
+            self.clears += 1
+
+    def _pop(self, key):
+        item = self._data.pop(key, None)
+        if item is not None:
+            self.size -= len(item[0])
+
+    def __len__(self):
+        return len(self._data)
+
+# 进程内 LRU(按缓存目录共享): django 的 caches[alias] 每个线程各有一个后端实例
+local_caches = {}
+local_caches_lock = threading.Lock()
+
+def get_local_cache(directory, size_limit):
+    with local_caches_lock:
+        local = local_caches.get(directory, None)
+        if local is None or local.size_limit != size_limit:
+            local = local_caches[directory] = LocalCache(size_limit)
+        return local
+
+class MeteredFanoutCache(FanoutCache):
+    """FanoutCache counting operations failed silently by DATABASE_TIMEOUT"""
+
+    metrics = None
+
+    def timeout(self, key):
+        if self.metrics is not None:
+            self.metrics.incr(metrics_prefix(key), 'timeouts')
+
+    def shard(self, key):
+        return self._shards[self._hash(key) % self._count]
+
+    def get(self, key, default=None, read=False, expire_time=False, tag=False, retry=False):
+        try:
+            return self.shard(key).get(key, default, read, expire_time, tag, retry)
+        except (Timeout, sqlite3.OperationalError):
+            self.timeout(key)
+            return default
+
+    def set(self, key, value, expire=None, read=False, tag=None, retry=False):
+        try:
+            return self.shard(key).set(key, value, expire, read, tag, retry)
+        except Timeout:
+            self.timeout(key)
+            return False
+
+    def add(self, key, value, expire=None, read=False, tag=None, retry=False):
+        try:
+            return self.shard(key).add(key, value, expire, read, tag, retry)
+        except Timeout:
+            self.timeout(key)
+            return False
+
+    def incr(self, key, delta=1, default=0, retry=False):
+        try:
+            return self.shard(key).incr(key, delta, default, retry)
+        except Timeout:
+            self.timeout(key)
+            return None
+
+    def delete(self, key, retry=False):
+        try:
+            return self.shard(key).delete(key, retry)
+        except Timeout:
+            self.timeout(key)
+            return False
+
+class TaggedDjangoCache(DjangoCache):
+    """diskcache.DjangoCache with cache_page entries tagged by resource prefix and an in-process LRU tier"""
+
+    def __init__(self, directory, params):
+        # 同 DjangoCache.__init__(), 使用 MeteredFanoutCache
+        BaseCache.__init__(self, params)
+        shards = params.get('SHARDS', 8)
+        timeout = params.get('DATABASE_TIMEOUT', 0.010)
+        options = params.get('OPTIONS', {})
+        self._cache = MeteredFanoutCache(directory, shards, timeout, **options)
+        self.metrics = get_metrics(self.directory, params.get('METRICS_FLUSH_INTERVAL', 10))
+        if self.metrics.store is None:
+            self.metrics.store = self._cache.cache('metrics')
+        self._cache.metrics = self.metrics
+        size_limit = params.get('LOCAL_SIZE_LIMIT', 0)
+        self._local = get_local_cache(self.directory, size_limit) if size_limit else None
+        self._local_check_interval = params.get('LOCAL_CHECK_INTERVAL', 1)
+
+    def is_local(self, key):
+        '''
+        是否进入进程内缓存: cache_page 条目 及 资源代数
+        '''
+        return self._local is not None and (resource_tag(key) is not None or key.startswith(cache_generation_fixed))
+
+    def check_local(self):
+        '''
+        其它进程清除过缓存时, 清空本进程的 LRU
+        '''
+        now = time.time()
+        if now - self._local.checked < self._local_check_interval:
+            return
+        self._local.checked = now
+        epoch = self._cache.get(local_epoch_key, retry=True)
+        if epoch != self._local.epoch:
+            self._local.clear()
+            self._local.epoch = epoch
+
+    def invalidate_local(self):
+        '''
+        清空本进程的 LRU, 并通知其它进程
+        '''
+        if self._local is not None:
+            self._local.clear()
+            self._local.epoch = uuid.uuid4().hex
+            self._cache.set(local_epoch_key, self._local.epoch, retry=True)
+
+    def set_local(self, key, value, timeout, version=None):
+        timeout = self.get_backend_timeout(timeout)
+        expire_time = None if timeout is None else time.time() + timeout
+        data = pickle.dumps(value, pickle.HIGHEST_PROTOCOL)
+        self._local.set(self.make_key(key, version=version), data, expire_time)
+
+    def get(self, key, default=None, version=None, read=False, expire_time=False, tag=False, retry=False):
+        if read or expire_time or tag:
+            return super(TaggedDjangoCache, self).get(key, default=default, version=version, read=read, expire_time=expire_time, tag=tag, retry=retry)
+        prefix = metrics_prefix(key)
+        start = time.perf_counter()
+        if not self.is_local(key):
+            value = super(TaggedDjangoCache, self).get(key, default=default, version=version, retry=retry)
+        else:
+            self.check_local()
+            full_key = self.make_key(key, version=version)
+            data = self._local.get(full_key)
+            if data is not None:
+                self.metrics.incr(prefix, 'local_hits')
+                return pickle.loads(data)
+            clears = self._local.clears
+            value, disk_expire_time = self._cache.get(full_key, default=default, expire_time=True, retry=retry)
+            if disk_expire_time is not None or value is not default:
+                self._local.set(full_key, pickle.dumps(value, pickle.HIGHEST_PROTOCOL), disk_expire_time, clears=clears)
+        self.metrics.observe(prefix, 'get', time.perf_counter() - start)
+        self.metrics.incr(prefix, 'misses' if value is default else 'hits')
+        return value
+
+    def set(self, key, value, timeout=DEFAULT_TIMEOUT, version=None, read=False, tag=None, retry=True):
+        if tag is None:
+            tag = resource_tag(key)
+        start = time.perf_counter()
+        result = super(TaggedDjangoCache, self).set(key, value, timeout=timeout, version=version, read=read, tag=tag, retry=retry)
+        prefix = metrics_prefix(key)
+        self.metrics.observe(prefix, 'set', time.perf_counter() - start)
+        self.metrics.incr(prefix, 'sets')
+        if result and not read and self.is_local(key):
+            self.set_local(key, value, timeout, version=version)
+        return result
+
+    def add(self, key, value, timeout=DEFAULT_TIMEOUT, version=None, read=False, tag=None, retry=True):
+        if tag is None:
+            tag = resource_tag(key)
+        result = super(TaggedDjangoCache, self).add(key, value, timeout=timeout, version=version, read=read, tag=tag, retry=retry)
+        if result and not read and self.is_local(key):
+            self.set_local(key, value, timeout, version=version)
+        return result
+
+    def incr(self, key, delta=1, version=None, default=None, retry=True):
+        value = super(TaggedDjangoCache, self).incr(key, delta=delta, version=version, default=default, retry=retry)
+        if self.is_local(key):
+            self.invalidate_local()
+        return value
+
+    def delete(self, key, version=None, retry=True):
+        result = super(TaggedDjangoCache, self).delete(key, version=version, retry=retry)
+        if self.is_local(key):
+            self.invalidate_local()
+        return result
+
+    def delete_many(self, keys, version=None):
+        keys = list(keys)
+        for key in keys:
+            super(TaggedDjangoCache, self).delete(key, version=version)
+        if any(self.is_local(key) for key in keys):
+            self.invalidate_local()
+
+    def clear(self):
+        result = super(TaggedDjangoCache, self).clear()
+        self.invalidate_local()
+        return result
+
+    def evict_by_tags(self, tags):
+        '''
+        按标签删除缓存条目, 返回删除的条目数
+        '''
+        count = 0
+        for tag in tags:
+            evicted = self._cache.evict(tag, retry=True)
+            self.metrics.incr(tag, 'evictions', evicted)
+            count += evicted
+        self.invalidate_local()
+        return count
+
+    def shard_stats(self):
+        '''
+        各分片的条目数、占用字节数及大小上限
+        '''
+        return [
+            {'count': len(shard), 'volume': shard.volume(), 'size_limit': int(shard.size_limit)}
+            for shard in self._cache._shards
+        ]
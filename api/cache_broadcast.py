@@ -0,0 +1,118 @@
+'''
+多节点缓存失效广播
+
+各节点使用本地 diskcache 时, clear_by_prefix()/evict_object() 写入共享的失效日志, 其它节点拉取后在本地执行
+(见 cache_helper.sync_invalidations()), 延迟不超过 CACHE_BROADCAST['INTERVAL'] 秒(加上进程内 LRU 的检查间隔)
+
+配置(settings.CACHE_BROADCAST), None 表示单节点:
+    CACHE_BROADCAST = {
+        'BACKEND': 'api.cache_broadcast.SQLiteJournal',
+        'LOCATION': '/mnt/shared/cache-journal.sqlite3',  # 各节点共享的路径
+        'INTERVAL': 1,  # 拉取间隔(秒)
+        'RETENTION': 60 * 60 * 24,  # 日志保留时长(秒)
+    }
+'''
+import sqlite3
+import threading
+import time
+from collections import namedtuple
+
+from django.conf import settings
+from django.core.signals import setting_changed
+from django.utils.module_loading import import_string
+
+
+# op: clear(清除资源前缀) / evict(逐出对象)
+Event = namedtuple('Event', ['id', 'node', 'op', 'prefix', 'object_id'])
+
+class InvalidationBroadcast(object):
+    """Base class of invalidation transports shared by all nodes"""
+
+    def __init__(self, params):
+        self.interval = params.get('INTERVAL', 1)
+        self.retention = params.get('RETENTION', 60 * 60 * 24)
+        self.synced = 0  # 本进程最近一次拉取的时间
+
+    def publish(self, node, op, prefix, object_id=None):
+        raise NotImplementedError('subclasses of InvalidationBroadcast must provide a publish() method')
+
+    def events(self, after_id):
+        '''
+        返回 (id 大于 after_id 的事件, 是否有缺失(已被清理)); after_id 为 None 时返回 ([], True)
+        '''
+        raise NotImplementedError('subclasses of InvalidationBroadcast must provide an events() method')
+
+class SQLiteJournal(InvalidationBroadcast):
+    """Invalidation journal in a SQLite file on storage shared by all nodes"""
+
+    def __init__(self, params):
+        super(SQLiteJournal, self).__init__(params)
+        self.location = params['LOCATION']
+        self.timeout = params.get('DATABASE_TIMEOUT', 5)
+        self._local = threading.local()
+        self._pruned = 0
+
+    def connection(self):
+        con = getattr(self._local, 'con', None)
+        if con is None:
+            # 共享存储(如 NFS)上不使用 WAL
+            con = self._local.con = sqlite3.connect(self.location, timeout=self.timeout, isolation_level=None)
+            con.execute(
+                'CREATE TABLE IF NOT EXISTS journal ('
+                'id INTEGER PRIMARY KEY AUTOINCREMENT, time REAL, node TEXT, op TEXT, prefix TEXT, object_id TEXT)'
+            )
+        return con
+
+    def publish(self, node, op, prefix, object_id=None):
+        con = self.connection()
+        now = time.time()
+        con.execute(
+            'INSERT INTO journal (time, node, op, prefix, object_id) VALUES (?, ?, ?, ?, ?)',
+            (now, node, op, prefix, None if object_id is None else str(object_id))
+        )
+        if now - self._pruned > 60:
+            self._pruned = now
+            con.execute('DELETE FROM journal WHERE time < ?', (now - self.retention,))
+
+    def events(self, after_id):
+        if after_id is None:
+            return [], True
+        con = self.connection()
+        rows = con.execute(
+            'SELECT id, node, op, prefix, object_id FROM journal WHERE id > ? ORDER BY id', (after_id,)
+        ).fetchall()
+        events = [Event(*row) for row in rows]
+        # AUTOINCREMENT 的 id 不重复使用, 下一条不连续即为已被清理
+        if events:
+            gap = events[0].id > after_id + 1
+        else:
+            gap = self.last_id() > after_id
+        return events, gap
+
+    def last_id(self):
+        row = self.connection().execute("SELECT seq FROM sqlite_sequence WHERE name = 'journal'").fetchone()
+        return row[0] if row else 0
+
+_broadcast = None
+_broadcast_lock = threading.Lock()
+
+def get_broadcast():
+    '''
+    当前配置的失效广播, 未配置时为 None
+    '''
+    global _broadcast
+    params = getattr(settings, 'CACHE_BROADCAST', None)
+    if not params:
+        return None
+    if _broadcast is None:
+        with _broadcast_lock:
+            if _broadcast is None:
+                _broadcast = import_string(params['BACKEND'])(params)
+    return _broadcast
+
+def reset_broadcast(**kwargs):
+    global _broadcast
+    if kwargs['setting'] in ('CACHE_BROADCAST', 'CACHES'):
+        _broadcast = None
+
+setting_changed.connect(reset_broadcast)
@@ -1,18 +1,607 @@
+import gzip
+import hashlib
 import os
+import re
+import time
+import uuid
 import warnings
 
-from django.core.cache import cache
+from django.conf import settings
+from django.core.cache import cache, caches
+from django.core.exceptions import EmptyResultSet
+from django.http import HttpResponse
+from django.middleware.cache import CacheMiddleware
+from django.utils.cache import (
+    get_cache_key, get_max_age, has_vary_header, learn_cache_key, patch_response_headers, patch_vary_headers
+)
+from django.utils.decorators import decorator_from_middleware_with_args
+from django.utils.encoding import iri_to_uri
+from django.utils.text import compress_string
 from diskcache.fanout import FanoutCache
 
+from .cache_backend import cache_page_fixed, cache_header_fixed, cache_generation_fixed, TaggedDjangoCache
+from .cache_broadcast import get_broadcast
+from .cache_metrics import counter_names, latency_buckets, percentile
+
 
-cache_page_fixed = 'views.decorators.cache.cache_page'
-cache_header_fixed = 'views.decorators.cache.cache_header'
 is_support = isinstance(cache._cache, FanoutCache)
+# 缓存条目是否按资源前缀打了标签(可按标签索引清除)
+is_tagged = isinstance(caches['default'], TaggedDjangoCache)
+# 已登记的 cache_page 资源前缀
+resource_prefixes = set()
 
 def not_support_warn(func_name):
     message = 'function {0}() only is support diskcache.DjangoCache as cache backend'.format(func_name)
     warnings.warn(message, FutureWarning)
 
+def node_id():
+    '''
+    本节点(缓存目录)的id, 同一缓存目录的进程共用
+    '''
+    node = cache.get('cache_node_id')
+    if node is None:
+        cache.add('cache_node_id', uuid.uuid4().hex, timeout=None)
+        node = cache.get('cache_node_id')
+    return node
+
+def broadcast_state():
+    '''
+    本节点已执行的失效日志位置(diskcache 子缓存)
+    '''
+    backend = caches['default']
+    state = getattr(backend, '_broadcast_state', None)
+    if state is None:
+        state = backend._broadcast_state = backend._cache.cache('broadcast')
+    return state
+
+def publish_invalidation(op, prefix, object_id=None):
+    broadcast = get_broadcast()
+    if broadcast is not None and is_support:
+        broadcast.publish(node_id(), op, prefix, object_id)
+
+def sync_invalidations(force=False):
+    '''
+    执行其它节点广播的失效(每个进程最多每 INTERVAL 秒拉取一次), 同一节点的多个进程中只有一个执行每条日志
+
+    本节点的日志位置缺失或日志已被清理时, 清除全部资源
+    '''
+    broadcast = get_broadcast()
+    if broadcast is None or not is_support:
+        return
+    now = time.time()
+    if not force and now - broadcast.synced < broadcast.interval:
+        return
+    broadcast.synced = now
+    state = broadcast_state()
+    node = node_id()
+    # 先执行再推进日志位置(清除/逐出可以重复执行): 执行中断(进程退出、diskcache Timeout)时位置不变, 下次重新执行;
+    # 执行期间持有事务, 同一节点的其它进程等待后不再重复执行
+    with state.transact(retry=True):
+        applied = state.get('applied', None)
+        events, gap = broadcast.events(applied)
+        if gap:
+            for prefix in sorted(resource_prefixes):
+                clear_by_prefix(prefix, broadcast=False)
+        for event in events:
+            if event.node == node:
+                continue
+            if event.op == 'clear':
+                clear_by_prefix(event.prefix, broadcast=False)
+            elif event.op == 'evict':
+                evict_object(event.prefix, event.object_id, broadcast=False)
+        if events:
+            state.set('applied', events[-1].id)
+        elif applied is None:
+            state.set('applied', broadcast.last_id())
+
+def generation_key(prefix):
+    return '{0}.{1}'.format(cache_generation_fixed, prefix)
+
+def get_generation(prefix):
+    '''
+    资源前缀当前的代数(generation)
+    '''
+    sync_invalidations()
+    key = generation_key(prefix)
+    generation = cache.get(key)
+    if generation is None:
+        # 初始值取当前时间(毫秒), 代数被淘汰后重建的值仍大于之前的值, 旧条目不会重新可达
+        cache.add(key, int(time.time() * 1000), timeout=None)
+        generation = cache.get(key)
+    return generation
+
+def bump_generation(prefix):
+    '''
+    递增资源前缀的代数, 返回新的代数
+    '''
+    key = generation_key(prefix)
+    try:
+        return cache.incr(key)
+    except ValueError:
+        get_generation(prefix)
+        return cache.incr(key)
+
+def modified_key(prefix):
+    return 'cache_modified.{0}'.format(prefix)
+
+def get_modified(prefix):
+    '''
+    资源前缀的最后修改时间(时间戳), 用于 ETag / Last-Modified
+    '''
+    sync_invalidations()
+    key = modified_key(prefix)
+    modified = cache.get(key)
+    if modified is None:
+        # 被淘汰后取当前时间, 客户端持有的 ETag 全部失效(多返回一次 200), 不会误判为未修改
+        cache.add(key, time.time(), timeout=None)
+        modified = cache.get(key)
+    return modified
+
+def touch_modified(prefix):
+    '''
+    更新资源前缀的最后修改时间(须在数据写入之后调用)
+    '''
+    cache.set(modified_key(prefix), time.time(), timeout=None)
+
+def object_index():
+    '''
+    对象反向索引(diskcache 子缓存), 非 diskcache 后端时为 None
+    '''
+    if not is_support:
+        return None
+    backend = caches['default']
+    index = getattr(backend, '_object_index', None)
+    if index is None:
+        index = backend._object_index = backend._cache.cache('object-index', timeout=1)
+    return index
+
+def evicted_key(prefix):
+    return 'cache_evicted.{0}'.format(prefix)
+
+def response_object_ids(response):
+    '''
+    DRF 响应(详情 或 分页列表)中的对象id
+    '''
+    data = getattr(response, 'data', None)
+    if isinstance(data, dict):
+        rows = data['results'] if isinstance(data.get('results', None), list) else [data]
+    elif isinstance(data, list):
+        rows = data
+    else:
+        rows = []
+    return [row['id'] for row in rows if isinstance(row, dict) and row.get('id', None) is not None]
+
+def index_objects(key_prefix, object_ids, cache_key, timeout):
+    '''
+    登记页面缓存键包含的对象
+    '''
+    index = object_index()
+    if index is None or not object_ids:
+        return
+    with index.transact(retry=True):
+        for object_id in object_ids:
+            key = '{0}.{1}'.format(key_prefix, object_id)
+            keys = index.get(key, default=set())
+            keys.add(cache_key)
+            index.set(key, keys, expire=timeout)
+
+def fragment_version_key(prefix, object_id):
+    return 'cache_fragment_version.{0}.{1}'.format(prefix, object_id)
+
+def fragment_versions(prefix, object_ids):
+    '''
+    对象片段的版本: 对象最后一次被逐出的时间, 缺失(或已过期)时取当前时间
+    '''
+    keys = [fragment_version_key(prefix, object_id) for object_id in object_ids]
+    versions = cache.get_many(keys)
+    timeout = getattr(settings, 'CACHE_FRAGMENT_TIMEOUT', 60 * 60 * 2)
+    for key in keys:
+        if key not in versions:
+            cache.add(key, time.time(), timeout=timeout)
+            versions[key] = cache.get(key, time.time())
+    return [versions[key] for key in keys]
+
+def request_generation_prefix(prefix, request=None):
+    '''
+    <资源前缀>.<代数>: cache_page 未命中时沿用请求开始时取得的代数, 否则取当前代数
+
+    在读取数据之前取定代数, 读取期间的写入使代数递增, 写入缓存的旧结果不可达
+    '''
+    generation_prefix = getattr(request, '_cache_generation_prefix', '')
+    if not generation_prefix.startswith(prefix + '.'):
+        generation_prefix = '{0}.{1}'.format(prefix, get_generation(prefix))
+    return generation_prefix
+
+def fragment_keys(prefix, request, context, object_ids, variant=''):
+    '''
+    对象片段的缓存键 及 是否可以写入, 按对象顺序返回 [(key, storable), ...]
+
+    缓存键: cache_fragment.<资源前缀>.<代数>.<对象id>.<对象版本>.<变体>, 变体由 超链接的根URL、命名空间、format 后缀
+    及 variant(如: 返回的字段)确定;
+    请求开始之后被逐出的对象(对象版本不早于请求开始时间)可能读到了旧数据, 不写入
+    '''
+    generation_prefix = request_generation_prefix(prefix, request)
+    resolver_match = getattr(request, 'resolver_match', None)
+    info = '{0}|{1}|{2}|{3}'.format(
+        request.build_absolute_uri('/'), resolver_match and resolver_match.namespace, context.get('format', None), variant
+    )
+    variant = hashlib.md5(info.encode('utf-8')).hexdigest()
+    start = getattr(request, '_cache_start', None)
+    keys = []
+    for object_id, version in zip(object_ids, fragment_versions(prefix, object_ids)):
+        key = 'cache_fragment.{0}.{1}.{2}.{3}'.format(generation_prefix, object_id, version, variant)
+        keys.append((key, start is not None and version < start))
+    return keys
+
+def count_key(prefix, queryset, request=None):
+    '''
+    查询结果数量的缓存键: cache_count.<资源前缀>.<代数>.<md5(数据库, 去除排序的查询SQL 及 参数)>
+
+    查询SQL由筛选条件生成, 与请求参数的顺序、返回的字段、分页及格式参数无关
+    '''
+    sql, params = queryset.order_by().values('pk').query.sql_with_params()
+    info = '{0}|{1}|{2}'.format(queryset.db, sql, params)
+    return 'cache_count.{0}.{1}'.format(request_generation_prefix(prefix, request), hashlib.md5(info.encode('utf-8')).hexdigest())
+
+def cached_count(prefix, queryset, request=None):
+    '''
+    查询结果数量(缓存 CACHE_COUNT_TIMEOUT 秒), 资源前缀的代数递增(写入)后重新计数
+    '''
+    if not is_support:
+        return queryset.count()
+    try:
+        key = count_key(prefix, queryset, request)
+    except EmptyResultSet:
+        return 0
+    count = cache.get(key)
+    if count is None:
+        count = queryset.count()
+        cache.set(key, count, getattr(settings, 'CACHE_COUNT_TIMEOUT', 60 * 60 * 2))
+    return count
+
+def evict_object(prefix, object_id, broadcast=True):
+    '''
+    仅删除包含该对象的缓存页面(详情页 及 包含它的列表页), 及该对象的序列化片段
+
+    只适用于不改变列表成员及排序的写操作(如: 机构联系人/需求的变更), 其余情况使用 clear_by_prefix()
+
+    broadcast: 是否广播到其它节点(见 cache_broadcast)
+    '''
+    index = object_index()
+    if index is None:
+        clear_by_prefix(prefix, broadcast=broadcast)
+        return
+    if broadcast:
+        publish_invalidation('evict', prefix, object_id)
+    # 先记录逐出时间, 此前开始且尚未写入缓存的请求将放弃写入
+    now = time.time()
+    cache.set(evicted_key(prefix), now, timeout=None)
+    # 对象片段换用新版本
+    cache.set(fragment_version_key(prefix, object_id), now, timeout=getattr(settings, 'CACHE_FRAGMENT_TIMEOUT', 60 * 60 * 2))
+    key = '{0}.{1}.{2}'.format(prefix, get_generation(prefix), object_id)
+    with index.transact(retry=True):
+        keys = index.pop(key, default=set())
+    if keys:
+        cache.delete_many(keys)
+        record_metric(prefix, 'evictions', len(keys))
+    touch_modified(prefix)
+
+def incr_counter(key, delta=1):
+    try:
+        return cache.incr(key, delta)
+    except ValueError:
+        cache.add(key, 0, timeout=None)
+        return cache.incr(key, delta)
+
+def is_html_request(request):
+    '''
+    是否请求可浏览API(BrowsableAPIRenderer), 与 DRF 内容协商一致: format 参数/后缀优先, 其次 Accept 请求头
+    '''
+    format = request.GET.get('format', None)
+    if format is None:
+        match = re.search(r'\.(\w+)/?$', request.path)
+        format = match and match.group(1)
+    if format:
+        return format == 'api'
+    return 'text/html' in request.META.get('HTTP_ACCEPT', '')
+
+def cache_variant(request):
+    '''
+    缓存变体(附加在缓存键前缀之后)
+
+    - 公开数据(匿名用户, 或未指定 mine=true 的登录用户): 共享同一缓存条目
+    - 可浏览API页面: 含有用户名及 csrf token, 按 Cookie 区分
+    - mine=true 且带有登录凭据(session 或 Authorization): 按凭据区分
+    '''
+    if is_html_request(request):
+        return '.html'
+    if request.GET.get('mine', 'false') == 'true':
+        session = request.COOKIES.get(settings.SESSION_COOKIE_NAME, '')
+        authorization = request.META.get('HTTP_AUTHORIZATION', '')
+        if session or authorization:
+            credential = '{0}|{1}'.format(session, authorization)
+            return '.user-{0}'.format(hashlib.md5(credential.encode('utf-8')).hexdigest())
+    return ''
+
+def record_metric(prefix, name, delta=1):
+    '''
+    记录缓存指标(仅 TaggedDjangoCache)
+    '''
+    metrics = getattr(caches['default'], 'metrics', None)
+    if metrics is not None:
+        metrics.incr(prefix, name, delta)
+
+re_accepts_gzip = re.compile(r'\bgzip\b')
+
+def accepts_gzip(request):
+    return bool(re_accepts_gzip.search(request.META.get('HTTP_ACCEPT_ENCODING', '')))
+
+def copy_response(response, content):
+    copied = HttpResponse(content, status=response.status_code)
+    for header, value in response.items():
+        copied[header] = value
+    copied.cookies = response.cookies
+    copied['Content-Length'] = str(len(content))
+    return copied
+
+def compress_response(response):
+    '''
+    gzip 压缩的响应副本(写入缓存), 不需要压缩时返回 None
+
+    与 django GZipMiddleware 一致: 压缩后的 ETag 改为弱 ETag
+    '''
+    if response.streaming or response.has_header('Content-Encoding'):
+        return None
+    if len(response.content) < getattr(settings, 'CACHE_COMPRESS_MIN_LENGTH', 200):
+        return None
+    content = compress_string(response.content)
+    if len(content) >= len(response.content):
+        return None
+    compressed = copy_response(response, content)
+    compressed['Content-Encoding'] = 'gzip'
+    etag = compressed.get('ETag', '')
+    if etag.startswith('"'):
+        compressed['ETag'] = 'W/' + etag
+    return compressed
+
+def decompress_response(response):
+    '''
+    缓存中的压缩响应, 解压后发给不支持 gzip 的客户端
+    '''
+    if response.get('Content-Encoding', None) != 'gzip':
+        return response
+    plain = copy_response(response, gzip.decompress(response.content))
+    del plain['Content-Encoding']
+    etag = plain.get('ETag', '')
+    if etag.startswith('W/'):
+        plain['ETag'] = etag[2:]
+    return plain
+
+def stampede_key(prefix, name):
+    return 'cache_stampede.{0}.{1}'.format(prefix, name)
+
+def stampede_stats():
+    '''
+    各资源前缀 等待其它请求重建缓存(waited) 及 使用过期副本(stale) 的请求数
+    '''
+    stats = {}
+    for prefix in sorted(resource_prefixes):
+        stats[prefix] = dict((name, cache.get(stampede_key(prefix, name), 0)) for name in ('waited', 'stale'))
+    return stats
+
+def cache_stats():
+    '''
+    缓存指标汇总: 各前缀的计数及读写耗时(毫秒), 各分片大小, 及相关配置
+    '''
+    backend = caches['default']
+    metrics = getattr(backend, 'metrics', None)
+    prefixes = metrics.collect() if metrics is not None else {}
+    for prefix, stats in stampede_stats().items():
+        prefixes.setdefault(prefix, dict((name, 0) for name in counter_names)).update(stats)
+    for stats in prefixes.values():
+        for histogram in stats.get('latency', {}).values():
+            histogram['mean'] = histogram['sum'] / histogram['count'] if histogram['count'] else None
+            histogram['p50'] = percentile(histogram, 0.5)
+            histogram['p99'] = percentile(histogram, 0.99)
+    params = settings.CACHES['default']
+    return {
+        'prefixes': prefixes,
+        'latency_buckets': list(latency_buckets[:-1]),
+        'shards': backend.shard_stats() if is_tagged else [],
+        'settings': {
+            'TIMEOUT': params.get('TIMEOUT', 300),
+            'SHARDS': params.get('SHARDS', 8),
+            'DATABASE_TIMEOUT': params.get('DATABASE_TIMEOUT', 0.010),
+            'size_limit': params.get('OPTIONS', {}).get('size_limit', None),
+            'LOCAL_SIZE_LIMIT': params.get('LOCAL_SIZE_LIMIT', 0),
+        },
+    }
+
+def reset_cache_stats():
+    '''
+    清零缓存指标(含防击穿计数)
+    '''
+    metrics = getattr(caches['default'], 'metrics', None)
+    if metrics is not None:
+        metrics.reset()
+    for prefix in resource_prefixes:
+        cache.delete_many([stampede_key(prefix, name) for name in ('waited', 'stale')])
+
+class ResourceCacheMiddleware(CacheMiddleware):
+    '''
+    cache_page 中间件: 缓存键前缀为 <资源前缀>.<代数>
+
+    代数在请求开始时取定, 响应写入缓存时使用同一个代数, 渲染期间发生的写操作不会让旧数据写入新代数
+
+    公开数据的缓存条目为所有读者共享, 仅 mine=true 及可浏览API页面按用户区分(见 cache_variant())
+
+    未命中时同一页面同时只有一个请求(跨进程, 通过 diskcache 锁)重建缓存, 其余请求使用过期副本,
+    没有过期副本时等待重建完成. 过期副本(<资源前缀>.stale)比缓存多保留 CACHE_STALE_GRACE 秒
+
+    响应写入缓存时 gzip 压缩一次, 支持 gzip 的客户端直接使用缓存的压缩内容, 其余客户端解压后返回;
+    Accept-Encoding 不参与缓存键, 只添加到响应的 Vary 中
+    '''
+    @property
+    def cache(self):
+        # 每次从 caches 取得, 与 cache_helper 其它函数使用同一个后端(随 override_settings 切换)
+        return caches[self.cache_alias]
+
+    @cache.setter
+    def cache(self, value):
+        pass
+
+    def resource_key_prefix(self, request):
+        if getattr(request, '_cache_key_prefix', None) is None:
+            request._cache_start = time.time()
+            request._cache_variant = cache_variant(request)
+            request._cache_generation_prefix = '{0}.{1}'.format(self.key_prefix, get_generation(self.key_prefix))
+            request._cache_key_prefix = request._cache_generation_prefix + request._cache_variant
+        return request._cache_key_prefix
+
+    def stale_key_prefix(self, request):
+        self.resource_key_prefix(request)
+        return '{0}.stale{1}'.format(self.key_prefix, request._cache_variant)
+
+    def lock_key(self, request):
+        url = hashlib.md5(iri_to_uri(request.build_absolute_uri()).encode('ascii')).hexdigest()
+        return 'cache_lock.{0}.{1}'.format(self.resource_key_prefix(request), url)
+
+    def release_lock(self, request):
+        lock_key = getattr(request, '_cache_lock', None)
+        if lock_key is not None:
+            request._cache_lock = None
+            self.cache.delete(lock_key)
+
+    def fetch(self, request, key_prefix):
+        cache_key = get_cache_key(request, key_prefix, 'GET', cache=self.cache)
+        if cache_key is None:
+            return None
+        response = self.cache.get(cache_key)
+        if response is None and request.method == 'HEAD':
+            cache_key = get_cache_key(request, key_prefix, 'HEAD', cache=self.cache)
+            response = self.cache.get(cache_key)
+        if response is not None and not accepts_gzip(request):
+            response = decompress_response(response)
+        return response
+
+    def single_flight(self, request):
+        '''
+        未命中: 取得重建锁的请求返回 None(由其重建缓存), 其余请求返回过期副本 或 等待到的新缓存
+        '''
+        lock_key = self.lock_key(request)
+        if self.cache.add(lock_key, True, timeout=getattr(settings, 'CACHE_LOCK_EXPIRE', 30)):
+            request._cache_lock = lock_key
+            return None
+        response = self.fetch(request, self.stale_key_prefix(request))
+        if response is not None:
+            incr_counter(stampede_key(self.key_prefix, 'stale'))
+            return response
+        incr_counter(stampede_key(self.key_prefix, 'waited'))
+        deadline = time.time() + getattr(settings, 'CACHE_WAIT_TIMEOUT', 5)
+        while time.time() < deadline:
+            time.sleep(0.05)
+            response = self.fetch(request, self.resource_key_prefix(request))
+            if response is not None:
+                return response
+            if lock_key not in self.cache:
+                # 重建结束但未写入缓存(如: 非200响应), 自行处理
+                break
+        return None
+
+    def process_request(self, request):
+        if request.method not in ('GET', 'HEAD'):
+            request._cache_update_cache = False
+            return None
+        response = self.fetch(request, self.resource_key_prefix(request))
+        if response is None:
+            response = self.single_flight(request)
+        if response is None:
+            # 最后修改时间在读取数据之前取定, 与响应内容一致(见 PatchedViewSet.resource_modified())
+            if getattr(request, '_cache_modified', None) is None:
+                request._cache_modified = get_modified(self.key_prefix)
+            request._cache_update_cache = True
+            return None
+        request._cache_update_cache = False
+        return response
+
+    def store_response(self, request, cache_key, response, timeout):
+        '''
+        写入缓存, 返回发给本次请求的响应(客户端支持 gzip 时为压缩后的响应)
+        '''
+        try:
+            # 缓存键已确定, Accept-Encoding 只用于下游缓存
+            patch_vary_headers(response, ('Accept-Encoding',))
+            evicted = self.cache.get(evicted_key(self.key_prefix))
+            if evicted is not None and evicted >= request._cache_start:
+                # 请求处理期间有对象被逐出, 响应可能包含旧数据, 不写入缓存
+                return response
+            stored = compress_response(response) or response
+            self.cache.set(cache_key, stored, timeout)
+            index_objects(request._cache_generation_prefix, response_object_ids(response), cache_key, timeout)
+            grace = getattr(settings, 'CACHE_STALE_GRACE', 60)
+            if grace:
+                stale_key = learn_cache_key(request, response, timeout + grace, self.stale_key_prefix(request), cache=self.cache)
+                self.cache.set(stale_key, stored, timeout + grace)
+            return stored if accepts_gzip(request) else response
+        finally:
+            self.release_lock(request)
+
+    def update_cache(self, request, response):
+        '''
+        写入缓存(渲染后写入), 返回是否写入
+        '''
+        if not self._should_update_cache(request, response):
+            return False
+        if response.streaming or response.status_code not in (200, 304):
+            return False
+        # 与 django UpdateCacheMiddleware 一致: 不缓存 无cookie请求 却设置了用户cookie 的响应
+        if not request.COOKIES and response.cookies and has_vary_header(response, 'Cookie'):
+            return False
+        if 'private' in response.get('Cache-Control', ()):
+            return False
+        timeout = get_max_age(response)
+        if timeout is None:
+            timeout = self.cache_timeout
+        elif timeout == 0:
+            return False
+        patch_response_headers(response, timeout)
+        if not (timeout and response.status_code == 200):
+            return False
+        if request._cache_variant == '.html':
+            patch_vary_headers(response, ('Cookie',))
+        cache_key = learn_cache_key(request, response, timeout, self.resource_key_prefix(request), cache=self.cache)
+        if hasattr(response, 'render') and callable(response.render):
+            response.add_post_render_callback(
+                lambda r: self.store_response(request, cache_key, r, timeout)
+            )
+        else:
+            self.store_response(request, cache_key, response, timeout)
+        return True
+
+    def process_response(self, request, response):
+        if not self.update_cache(request, response):
+            self.release_lock(request)
+        return response
+
+    def process_exception(self, request, exception):
+        self.release_lock(request)
+        return None
+
+def cache_page(timeout, key_prefix):
+    '''
+    view 缓存装饰器(替代 django cache_page): 登记资源前缀, 缓存键附加资源代数
+    '''
+    resource_prefixes.add(key_prefix)
+    return decorator_from_middleware_with_args(ResourceCacheMiddleware)(cache_timeout=timeout, key_prefix=key_prefix)
+
+def tags_by_prefix(prefix):
+    '''
+    以 prefix 开头的资源前缀(标签), 与 keys_by_prefix() 的匹配规则一致
+    '''
+    tags = set(tag for tag in resource_prefixes if tag.startswith(prefix))
+    tags.add(prefix)
+    return tags
+
 def keys_by_prefix(prefix):
     version = cache.make_key('')
     version_len = len(version)
@@ -25,12 +614,32 @@ def keys_by_prefix(prefix):
         else:
             not_support_warn('keys_by_prefix')
 
-def clear_by_prefix(prefix):
-    if is_support:
+def clear_by_prefix(prefix, broadcast=True):
+    '''
+    递增前缀下各资源的代数, 旧缓存条目立即不可达, 之后随 diskcache 过期/淘汰回收, 耗时与缓存条目数无关
+
+    broadcast: 是否广播到其它节点(见 cache_broadcast)
+    '''
+    if broadcast:
+        publish_invalidation('clear', prefix)
+    for tag in tags_by_prefix(prefix):
+        bump_generation(tag)
+        touch_modified(tag)
+        record_metric(tag, 'clears')
+
+def evict_by_prefix(prefix):
+    '''
+    立即删除前缀下的缓存条目(回收磁盘空间)
+    '''
+    if is_tagged:
+        # 标签索引删除, 只涉及该前缀下的缓存条目
+        cache.evict_by_tags(tags_by_prefix(prefix))
+    elif is_support:
+        # 未打标签的缓存后端, 遍历全部缓存键
         for key in keys_by_prefix(prefix):
             cache.delete(key)
     else:
-        not_support_warn('clear_by_prefix')
+        not_support_warn('evict_by_prefix')
 
 def keys_iter():
     if is_support:
@@ -0,0 +1,144 @@
+'''
+缓存失效登记: 模型 -> 依赖它的缓存资源
+
+模型写入(save/delete, 含级联删除 及 admin 内联)通过信号登记待失效的资源, 在事务提交后统一失效,
+同一事务内每个资源(或对象)只失效一次; 未在事务中时随即失效
+
+不发送信号的批量操作(QuerySet.update()、bulk_create() 等)之后调用 invalidate_model();
+批量导入等大量逐行写入放在 deferred_invalidation() 中, 结束时统一失效
+'''
+import threading
+from contextlib import contextmanager
+
+from django.db import transaction
+from django.db.models.signals import post_delete, post_init, post_save
+
+from .cache_helper import clear_by_prefix, evict_object
+
+
+# 模型 -> [(资源前缀, 所属对象字段), ...]
+# - 所属对象字段为 None: 写入可能改变列表成员及排序, 清除整个资源(clear_by_prefix)
+# - 否则只逐出包含所属对象的缓存页面(evict_object)
+cache_dependencies = {}
+
+_local = threading.local()
+
+def register(model, *dependencies):
+    cache_dependencies[model] = list(dependencies)
+
+def pending():
+    '''
+    本线程待失效的资源前缀 及 (资源前缀, 对象id)
+    '''
+    state = getattr(_local, 'state', None)
+    if state is None:
+        state = _local.state = {'prefixes': set(), 'objects': set(), 'deferred': 0}
+    return state
+
+def invalidate(prefix, object_id=None):
+    '''
+    登记待失效的资源(object_id 不为 None 时为资源中的对象)
+    '''
+    state = pending()
+    if object_id is None:
+        state['prefixes'].add(prefix)
+    else:
+        state['objects'].add((prefix, object_id))
+    if not state['deferred']:
+        # 每次登记都注册回调(事务回滚时回调被丢弃), 第一个回调失效全部, 其余为空操作
+        transaction.on_commit(flush)
+
+def flush():
+    '''
+    失效本线程登记的全部资源
+    '''
+    state = pending()
+    prefixes, objects = state['prefixes'], state['objects']
+    state['prefixes'], state['objects'] = set(), set()
+    for prefix in sorted(prefixes):
+        clear_by_prefix(prefix)
+    for prefix, object_id in sorted(objects):
+        # clear_by_prefix() 按前缀匹配, 已清除的资源不再逐出
+        if any(prefix.startswith(cleared) for cleared in prefixes):
+            continue
+        evict_object(prefix, object_id)
+
+@contextmanager
+def deferred_invalidation():
+    '''
+    期间登记的失效延迟到结束时(所在事务提交后)统一处理
+    '''
+    state = pending()
+    state['deferred'] += 1
+    try:
+        yield
+    finally:
+        state['deferred'] -= 1
+        if not state['deferred']:
+            transaction.on_commit(flush)
+
+def invalidate_instance(model, instance):
+    for prefix, field in cache_dependencies.get(model, []):
+        if field is None:
+            invalidate(prefix)
+        else:
+            invalidate(prefix, getattr(instance, field))
+            # 所属对象变更时, 原所属对象的页面同样失效
+            old_value = getattr(instance, '_cache_old_values', {}).get(field, None)
+            if old_value is not None and old_value != getattr(instance, field):
+                invalidate(prefix, old_value)
+
+def invalidate_model(model, instances=None):
+    '''
+    不发送信号的批量操作之后调用: instances 为写入的对象, None 时失效模型的全部依赖资源
+    '''
+    if instances is None:
+        for prefix, field in cache_dependencies.get(model, []):
+            invalidate(prefix)
+        return
+    for instance in instances:
+        invalidate_instance(model, instance)
+
+def remember_values(sender, instance):
+    '''
+    记录所属对象字段的当前值(对象加载时的值 / 保存后的值), 更新时与之比较, 不另外查询
+    '''
+    fields = [field for prefix, field in cache_dependencies.get(sender, []) if field is not None]
+    if fields:
+        # 只读取已加载的列(only()/defer() 延迟加载的字段不触发查询)
+        instance._cache_old_values = dict((field, instance.__dict__.get(field, None)) for field in fields)
+
+def on_post_init(sender, instance, **kwargs):
+    remember_values(sender, instance)
+
+def on_write(sender, instance, **kwargs):
+    invalidate_instance(sender, instance)
+
+def on_post_save(sender, instance, **kwargs):
+    invalidate_instance(sender, instance)
+    remember_values(sender, instance)
+
+def connect_signals():
+    '''
+    连接已登记模型的信号(ApiConfig.ready() 中调用)
+    '''
+    for model in cache_dependencies:
+        uid = 'cache-invalidation-{0}'.format(model._meta.label_lower)
+        post_init.connect(on_post_init, sender=model, dispatch_uid=uid)
+        post_save.connect(on_post_save, sender=model, dispatch_uid=uid)
+        post_delete.connect(on_write, sender=model, dispatch_uid=uid)
+
+def register_models():
+    from filer.models.imagemodels import Image
+    from registration.models import User
+    from .models import Organization, OrganizationContact, OrganizationDemand, Team, TeamContact
+
+    register(Organization, ('organization', None))
+    register(OrganizationContact, ('organization-contact', None), ('organization', 'organization_id'))
+    register(OrganizationDemand, ('organization-demand', None), ('organization', 'organization_id'))
+    register(Team, ('team', None))
+    register(TeamContact, ('team-contact', None), ('team', 'team_id'))
+    # 删除图片时 Team.wechat_qrcode 置空(SET_NULL, 不发送信号)
+    register(Image, ('image', None), ('team', None))
+    # 图片、用户资源无 cache_page, 失效时更新最后修改时间(ETag)
+    register(User, ('user', None))
@@ -0,0 +1,161 @@
+'''
+缓存指标
+
+按缓存键前缀统计 命中(磁盘/进程内)、未命中、写入、清除、逐出 次数, 读写耗时直方图, 及 DATABASE_TIMEOUT 失败次数
+
+指标先在进程内累计, 每 METRICS_FLUSH_INTERVAL 秒写入 diskcache 子缓存 metrics(每个进程一个条目, 保存累计值),
+读取时汇总各进程的条目
+'''
+import atexit
+import os
+import socket
+import threading
+import time
+import uuid
+from collections import defaultdict
+
+from diskcache import Timeout
+
+
+# 耗时直方图各桶的上限(毫秒), 超出最后一个上限的计入最后一个桶(inf)
+latency_buckets = (0.1, 0.5, 1, 5, 10, 50, 100, 500, float('inf'))
+# 计数指标
+counter_names = ('hits', 'local_hits', 'misses', 'sets', 'clears', 'evictions', 'timeouts')
+# 子缓存中的重置标记(时间戳), 早于该时间开始累计的进程清零后重新累计
+reset_key = 'reset'
+
+def new_histogram():
+    return {'count': 0, 'sum': 0.0, 'buckets': [0] * len(latency_buckets)}
+
+def merge_histogram(total, histogram):
+    total['count'] += histogram['count']
+    total['sum'] += histogram['sum']
+    total['buckets'] = [a + b for a, b in zip(total['buckets'], histogram['buckets'])]
+
+def percentile(histogram, q):
+    '''
+    直方图的近似分位数(毫秒, 所在桶的上限, 落在最后一个桶时为最后一个有限上限), 没有样本时为 None
+    '''
+    if not histogram['count']:
+        return None
+    rank = histogram['count'] * q
+    seen = 0
+    for bound, count in zip(latency_buckets, histogram['buckets']):
+        seen += count
+        if seen >= rank:
+            break
+    return bound if bound != float('inf') else latency_buckets[-2]
+
+class CacheMetrics(object):
+    """Per-process cache counters and latency histograms, flushed to a diskcache sub-cache"""
+
+    def __init__(self, flush_interval):
+        self.flush_interval = flush_interval
+        self.key = '{0}.{1}.{2}'.format(socket.gethostname(), os.getpid(), uuid.uuid4().hex[:8])
+        self.store = None  # diskcache 子缓存, 由缓存后端设置
+        self._lock = threading.Lock()
+        self._flushed = time.time()
+        self._started = time.time()
+        self._counters = defaultdict(int)  # (prefix, name) -> count
+        self._latencies = {}  # (prefix, name) -> histogram
+
+    def incr(self, prefix, name, delta=1):
+        with self._lock:
+            self._counters[(prefix, name)] += delta
+        self.flush_due()
+
+    def observe(self, prefix, name, seconds):
+        ms = seconds * 1000
+        with self._lock:
+            histogram = self._latencies.get((prefix, name), None)
+            if histogram is None:
+                histogram = self._latencies[(prefix, name)] = new_histogram()
+            histogram['count'] += 1
+            histogram['sum'] += ms
+            for idx, bound in enumerate(latency_buckets):
+                if ms <= bound:
+                    histogram['buckets'][idx] += 1
+                    break
+        self.flush_due()
+
+    def snapshot(self):
+        '''
+        本进程的累计值: {'counters': {prefix: {name: count}}, 'latencies': {prefix: {name: histogram}}}
+        '''
+        counters = defaultdict(dict)
+        latencies = defaultdict(dict)
+        with self._lock:
+            for (prefix, name), count in self._counters.items():
+                counters[prefix][name] = count
+            for (prefix, name), histogram in self._latencies.items():
+                latencies[prefix][name] = dict(histogram, buckets=list(histogram['buckets']))
+        return {'counters': dict(counters), 'latencies': dict(latencies), 'time': time.time()}
+
+    def flush_due(self):
+        if self.flush_interval and time.time() - self._flushed >= self.flush_interval:
+            self.flush()
+
+    def flush(self):
+        '''
+        写入本进程的累计值(失败时忽略, 下次写入)
+        '''
+        self._flushed = time.time()
+        if self.store is None:
+            return
+        try:
+            reset = self.store.get(reset_key, 0)
+            if reset > self._started:
+                with self._lock:
+                    self._counters.clear()
+                    self._latencies.clear()
+                    self._started = reset
+            self.store.set(self.key, self.snapshot())
+        except Timeout:
+            pass
+
+    def reset(self):
+        '''
+        清零全部进程的指标(其它进程在下次写入时清零)
+        '''
+        with self._lock:
+            self._counters.clear()
+            self._latencies.clear()
+            self._started = time.time()
+        if self.store is not None:
+            self.store.clear(retry=True)
+            self.store.set(reset_key, self._started, retry=True)
+
+    def collect(self):
+        '''
+        汇总各进程的指标: {prefix: {name: count, ..., 'latency': {name: histogram}}}
+        '''
+        self.flush()
+        stats = {}
+        snapshots = [self.snapshot()] if self.store is None else [
+            self.store.get(key) for key in list(self.store) if key != reset_key
+        ]
+        for snapshot in snapshots:
+            if not snapshot:
+                continue
+            for prefix, counters in snapshot['counters'].items():
+                item = stats.setdefault(prefix, dict((name, 0) for name in counter_names))
+                for name, count in counters.items():
+                    item[name] = item.get(name, 0) + count
+            for prefix, latencies in snapshot['latencies'].items():
+                item = stats.setdefault(prefix, dict((name, 0) for name in counter_names))
+                for name, histogram in latencies.items():
+                    merge_histogram(item.setdefault('latency', {}).setdefault(name, new_histogram()), histogram)
+        return stats
+
+# 按缓存目录共享(同 cache_backend.local_caches)
+metrics_by_directory = {}
+metrics_lock = threading.Lock()
+
+def get_metrics(directory, flush_interval):
+    with metrics_lock:
+        metrics = metrics_by_directory.get(directory, None)
+        if metrics is None:
+            metrics = metrics_by_directory[directory] = CacheMetrics(flush_interval)
+            # 进程退出前写入(如: 管理命令)
+            atexit.register(metrics.flush)
+        return metrics
@@ -0,0 +1,88 @@
+'''
+重复数据合并(添加唯一约束的数据迁移使用, 见 api/migrations 0010、0011), 不丢弃数据:
+
+- 同一区分字段的多条数据合并为一条(保留的数据), 其空字段(None、'' 及字段默认值)由其余数据中最后添加的(id 最大)非空值补全
+- 机构/团体合并时, 其余数据的联系人/需求先按联系人/需求的区分字段与保留的数据的合并, 再移到保留的数据下
+合并的每一组写入报告(迁移时输出)
+'''
+from django.db.models import Count
+
+
+def is_empty(field, value):
+    return value is None or value == '' or (field.has_default() and value == field.get_default())
+
+def fill_empty(manager, keep, others, fields):
+    '''
+    补全 keep 的空字段(fields 为参与合并的字段名), 以 update() 写入(不修改 add_time); 返回补全的字段名
+    '''
+    values = {}
+    others = sorted(others, key=lambda item: item.pk, reverse=True)
+    for name in fields:
+        field = keep._meta.get_field(name)
+        if not is_empty(field, getattr(keep, field.attname)):
+            continue
+        for other in others:
+            value = getattr(other, field.attname)
+            if not is_empty(field, value):
+                values[field.attname] = value
+                setattr(keep, field.attname, value)
+                break
+    if values:
+        manager.filter(pk=keep.pk).update(**values)
+    return sorted(values)
+
+def duplicate_groups(queryset, key_fields):
+    '''
+    重复的区分字段: [{字段名: 值}, ...]
+    '''
+    groups = queryset.values(*key_fields).annotate(count=Count('id')).filter(count__gt=1).order_by(*key_fields)
+    return [dict((name, group[name]) for name in key_fields) for group in groups]
+
+def merge_rows(manager, key, rows, fields, report):
+    '''
+    rows 为区分字段 key 的全部数据, 第一条为保留的数据, 其余数据补全其空字段后删除; 返回删除的 id
+    '''
+    keep, others = rows[0], rows[1:]
+    filled = fill_empty(manager, keep, others, fields)
+    removed = [row.pk for row in others]
+    manager.filter(pk__in=removed).delete()
+    report.append('{0} {1}: 保留 id={2}, 删除 id={3}(已合并){4}'.format(
+        keep._meta.object_name, key, keep.pk, removed, ', 补全字段 {0}'.format(filled) if filled else '',
+    ))
+    return removed
+
+def merge_children(model, parent_field, key_field, fields, report, using, parent_ids=None):
+    '''
+    合并重复的联系人/需求(保留最后添加的):
+    parent_ids 为 None 时按 (所属对象, 区分字段) 合并全部; 否则合并这些所属对象下区分字段相同的(不论所属对象, 之后移到同一所属对象下)
+    '''
+    manager = model._default_manager.using(using)
+    if parent_ids is None:
+        queryset, key_fields = manager.all(), [parent_field, key_field]
+    else:
+        queryset, key_fields = manager.filter(**{'{0}__in'.format(parent_field): parent_ids}), [key_field]
+    for key in duplicate_groups(queryset, key_fields):
+        merge_rows(manager, key, list(queryset.filter(**key).order_by('-id')), fields, report)
+
+def merge_parents(model, key_fields, ordering, fields, children, report, using):
+    '''
+    合并重复的机构/团体: 每组按 ordering 保留第一条, 其余数据的联系人/需求合并后移到保留的数据下, 再合并、删除其余数据(不会级联删除)
+        children: [(关联模型, 所属对象字段, 区分字段, 合并的字段), ...]
+    返回 [(保留的数据, [删除的 id, ...]), ...]
+    '''
+    manager = model._default_manager.using(using)
+    merged = []
+    for key in duplicate_groups(manager.all(), key_fields):
+        rows = list(manager.filter(**key).order_by(*ordering))
+        ids = [row.pk for row in rows]
+        for child, parent_field, key_field, child_fields in children:
+            merge_children(child, parent_field, key_field, child_fields, report, using, parent_ids=ids)
+            child._default_manager.using(using).filter(**{'{0}__in'.format(parent_field): ids[1:]}).update(**{parent_field: rows[0].pk})
+        merged.append((rows[0], merge_rows(manager, key, rows, fields, report)))
+    return merged
+
+def print_report(title, report):
+    if report:
+        print('\n  {0}: 合并 {1} 组重复数据'.format(title, len(report)))
+        for line in report:
+            print('    ' + line)
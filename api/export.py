@@ -0,0 +1,110 @@
+'''
+全量导出(流式): JSON Lines / CSV
+
+按 id 分段读取(每段一次查询 WHERE id > 上一段末尾的 id, 不使用 OFFSET), 每段序列化后立即写出,
+内存占用与数据总数无关; 客户端接受 gzip 时边生成边压缩
+'''
+import csv
+import datetime
+import io
+import json
+import re
+import zlib
+
+from django.conf import settings
+from django.utils import timezone
+from django.utils.dateparse import parse_date, parse_datetime
+from rest_framework.exceptions import ValidationError
+
+from .renderers import FastJSONRenderer
+
+
+# 导出格式: 参数值 -> (Content-Type, 文件扩展名)
+export_formats = {
+    'jsonl': ('application/x-ndjson; charset=utf-8', 'jsonl'),
+    'csv': ('text/csv; charset=utf-8', 'csv'),
+}
+
+# 日期时间(含时分)与时区偏移(hh:mm / hhmm / hh)之间的空格
+re_offset_space = re.compile(r'^(.*[T ]\d{1,2}:\d{1,2}(?::\d{1,2}(?:[.,]\d+)?)?) (\d{2}(?::?\d{2})?)$')
+
+def parse_since(value):
+    '''
+    since 参数: ISO 8601 日期时间或日期(无时区时为 TIME_ZONE 的本地时间)
+    未编码的 + 在查询参数中解码为空格: 时区偏移前的空格还原为 +(如 2020-02-01T08:00:00 08:00)
+    '''
+    value = re_offset_space.sub(r'\1+\2', value.strip())
+    try:
+        since = parse_datetime(value)
+        if since is None:
+            date = parse_date(value)
+            since = None if date is None else datetime.datetime.combine(date, datetime.time())
+    except ValueError:
+        since = None
+    if since is None:
+        raise ValidationError({'since': 'Invalid datetime: {0}'.format(value)})
+    if settings.USE_TZ and timezone.is_naive(since):
+        since = timezone.make_aware(since)
+    return since
+
+def chunks(queryset, pk, chunk_size):
+    '''
+    按 id 正序分段读取, pk(item) 取得对象(或 values() 行)的 id
+    '''
+    queryset = queryset.order_by('pk')
+    last = None
+    while True:
+        items = list((queryset if last is None else queryset.filter(pk__gt=last))[:chunk_size])
+        if items:
+            yield items
+        if len(items) < chunk_size:
+            return
+        last = pk(items[-1])
+
+def jsonl_lines(names, chunk):
+    renderer = FastJSONRenderer()
+    return b''.join(renderer.render(data) + b'\n' for data in chunk)
+
+def csv_value(value):
+    '''
+    CSV 单元格: 嵌套的联系人/需求为 JSON, 布尔值为 true/false, null 为空
+    '''
+    if value is None:
+        return ''
+    if isinstance(value, bool):
+        return 'true' if value else 'false'
+    if isinstance(value, (list, dict)):
+        return json.dumps(value, ensure_ascii=False, separators=(',', ':'))
+    return value
+
+def csv_lines(names, chunk):
+    output = io.StringIO()
+    writer = csv.writer(output)
+    writer.writerows([csv_value(data.get(name, None)) for name in names] for data in chunk)
+    return output.getvalue().encode('utf-8')
+
+def csv_header(names):
+    output = io.StringIO()
+    csv.writer(output).writerow(names)
+    return output.getvalue().encode('utf-8')
+
+def stream(queryset, serializer, names, kind, chunk_size):
+    '''
+    导出内容(bytes)的生成器, serializer 为 FragmentListSerializer(values() 行或对象均可序列化)
+    '''
+    if kind == 'csv':
+        yield csv_header(names)
+    write = csv_lines if kind == 'csv' else jsonl_lines
+    for items in chunks(queryset, serializer.pk, chunk_size):
+        yield write(names, serializer.represent(items))
+
+def gzip_stream(pieces):
+    '''
+    逐段 gzip 压缩(每段之后 flush, 客户端可以边下载边解压)
+    '''
+    compressor = zlib.compressobj(6, zlib.DEFLATED, 16 + zlib.MAX_WBITS)
+    for piece in pieces:
+        data = compressor.compress(piece) + compressor.flush(zlib.Z_SYNC_FLUSH)
+        if data:
+            yield data
+    yield compressor.flush()
@@ -0,0 +1,76 @@
+import hashlib
+import shutil
+import tempfile
+import time
+
+from django.conf import settings
+from django.core.management.base import BaseCommand
+
+from api.cache_backend import cache_page_fixed, cache_header_fixed, TaggedDjangoCache
+
+
+# 模拟的资源前缀(与 api.views 中的 cache_key_prefix 一致)
+resource_prefixes = ['organization', 'organization-contact', 'organization-demand', 'team', 'team-contact']
+
+def page_keys(prefix, idx):
+    '''
+    模拟 cache_page 生成的 页面缓存键 和 header 缓存键
+    '''
+    url_md5 = hashlib.md5('/api/{0}s/?page={1}'.format(prefix, idx).encode()).hexdigest()
+    headers_md5 = hashlib.md5(str(idx).encode()).hexdigest()
+    suffix = '{0}.{1}'.format(settings.LANGUAGE_CODE, settings.TIME_ZONE)
+    return [
+        '{0}.{1}.GET.{2}.{3}.{4}'.format(cache_page_fixed, prefix, url_md5, headers_md5, suffix),
+        '{0}.{1}.{2}.{3}'.format(cache_header_fixed, prefix, url_md5, suffix),
+    ]
+
+def scan_clear(backend, prefix):
+    '''
+    原有方式: 遍历全部缓存键, 按前缀匹配删除
+    '''
+    version = backend.make_key('')
+    infos = ['{0}{1}.{2}'.format(version, fixed, prefix) for fixed in [cache_page_fixed, cache_header_fixed]]
+    keys = [key for key in backend._cache if key.startswith(infos[0]) or key.startswith(infos[1])]
+    for key in keys:
+        backend._cache.delete(key, retry=True)
+    return len(keys)
+
+class Command(BaseCommand):
+    help = 'Benchmark clear_by_prefix: full key scan vs tag index eviction'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--keys', type=int, nargs='+', default=[100000, 1000000], help='cached keys count (default: 100000 1000000)')
+        parser.add_argument('--prefix', type=str, default='organization', help='resource prefix to clear (default: organization)')
+
+    def handle(self, *args, **kwargs):
+        params = dict(settings.CACHES['default'])
+        options = dict(params.get('OPTIONS', {}))
+        options['tag_index'] = True
+        params['OPTIONS'] = options
+        prefix = kwargs['prefix']
+        self.stdout.write('{0:>10} {1:>10} {2:>12} {3:>12}'.format('keys', 'matched', 'scan(s)', 'tag(s)'))
+        for keys_count in kwargs['keys']:
+            directory = tempfile.mkdtemp(prefix='cache-benchmark-')
+            try:
+                backend = TaggedDjangoCache(directory, params)
+                target_keys = []
+                # 每个页面写入 页面 及 header 两个缓存键
+                for idx in range(keys_count // 2):
+                    key_prefix = resource_prefixes[idx % len(resource_prefixes)]
+                    for key in page_keys(key_prefix, idx):
+                        backend.set(key, b'', timeout=None)
+                        if key_prefix.startswith(prefix):
+                            target_keys.append(key)
+                start = time.perf_counter()
+                matched = scan_clear(backend, prefix)
+                scan_cost = time.perf_counter() - start
+                # 恢复被删除的条目, 再以标签方式删除
+                for key in target_keys:
+                    backend.set(key, b'', timeout=None)
+                start = time.perf_counter()
+                backend.evict_by_tags([tag for tag in resource_prefixes if tag.startswith(prefix)])
+                tag_cost = time.perf_counter() - start
+                self.stdout.write('{0:>10} {1:>10} {2:>12.4f} {3:>12.4f}'.format(keys_count, matched, scan_cost, tag_cost))
+                backend.close()
+            finally:
+                shutil.rmtree(directory, ignore_errors=True)
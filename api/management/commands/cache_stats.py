@@ -0,0 +1,49 @@
+import json
+
+from django.core.management.base import BaseCommand
+
+import api.views  # 登记 cache_page 资源前缀
+from api.cache_helper import cache_stats, reset_cache_stats
+
+
+class Command(BaseCommand):
+    help = 'Show cache metrics: hits/misses/sets/clears/evictions/timeouts and latency per key prefix, stampede counters, shard sizes'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--json', action='store_true', help='output raw metrics as json')
+        parser.add_argument('--reset', action='store_true', help='reset metrics of all processes')
+
+    def handle(self, *args, **kwargs):
+        if kwargs['reset']:
+            reset_cache_stats()
+            self.stdout.write('cache metrics reset')
+            return
+        stats = cache_stats()
+        if kwargs['json']:
+            self.stdout.write(json.dumps(stats, indent=2, ensure_ascii=False))
+            return
+
+        columns = ('hits', 'local_hits', 'misses', 'sets', 'clears', 'evictions', 'timeouts', 'waited', 'stale')
+        self.stdout.write('{0:<24} {1} {2:>7} {3:>9} {4:>9}'.format(
+            'prefix', ' '.join('{0:>10}'.format(name) for name in columns), 'hit%', 'get p50', 'get p99'
+        ))
+        for prefix, item in sorted(stats['prefixes'].items()):
+            reads = item['hits'] + item['local_hits'] + item['misses']
+            hit_rate = '{0:.1f}'.format((item['hits'] + item['local_hits']) * 100 / reads) if reads else '-'
+            latency = item.get('latency', {}).get('get', {})
+            self.stdout.write('{0:<24} {1} {2:>7} {3:>9} {4:>9}'.format(
+                prefix,
+                ' '.join('{0:>10}'.format(item.get(name, 0)) for name in columns),
+                hit_rate,
+                '-' if latency.get('p50') is None else '{0}ms'.format(latency['p50']),
+                '-' if latency.get('p99') is None else '{0}ms'.format(latency['p99']),
+            ))
+
+        self.stdout.write('')
+        self.stdout.write('{0:<6} {1:>10} {2:>14} {3:>14} {4:>7}'.format('shard', 'count', 'volume', 'size_limit', 'used%'))
+        for idx, shard in enumerate(stats['shards']):
+            self.stdout.write('{0:<6} {1:>10} {2:>14} {3:>14} {4:>7.1f}'.format(
+                idx, shard['count'], shard['volume'], shard['size_limit'], shard['volume'] * 100 / shard['size_limit']
+            ))
+        self.stdout.write('')
+        self.stdout.write(' '.join('{0}={1}'.format(name, value) for name, value in stats['settings'].items()))
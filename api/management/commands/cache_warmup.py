@@ -0,0 +1,74 @@
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+from django.conf import settings
+from django.core.handlers.base import BaseHandler
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connections
+from django.test.client import RequestFactory
+from django.urls import reverse
+from django.utils.http import urlencode
+
+
+# 预热的列表页: (url名称, 查询范围)
+warmup_views = [
+    ('api:organization-list', [None, 'wuhan', 'hubei', 'china']),
+    ('api:team-list', [None]),
+]
+# 页面中 jQuery $.get() 及 $.ajax(dataType: "json") 的 Accept 请求头
+default_accepts = ['*/*', 'application/json, text/javascript, */*; q=0.01']
+
+class Command(BaseCommand):
+    help = 'Warm up cache_page entries of organization/team list pages (each scope, first N pages, common formats)'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--host', type=str, default=getattr(settings, 'CACHE_WARMUP_HOST', None),
+                            help='Host header used by live traffic (part of the cache key, default: CACHE_WARMUP_HOST)')
+        parser.add_argument('--https', action='store_true', default=getattr(settings, 'CACHE_WARMUP_HTTPS', False),
+                            help='warm up https urls (default: CACHE_WARMUP_HTTPS)')
+        parser.add_argument('--pages', type=int, default=3, help='first N pages of each list (default: 3)')
+        parser.add_argument('--formats', type=str, nargs='+', default=['', 'json'], help="format query values, '' for none (default: '' json)")
+        parser.add_argument('--accept', type=str, nargs='+', default=default_accepts, help='Accept headers (part of the cache key)')
+        parser.add_argument('--workers', type=int, default=4, help='parallel workers (default: 4)')
+
+    def warmup_urls(self, pages, formats):
+        for view_name, scopes in warmup_views:
+            path = reverse(view_name)
+            for scope in scopes:
+                for page in range(1, pages + 1):
+                    for format in formats:
+                        params = []
+                        if scope is not None:
+                            params.append(('scope', scope))
+                        if page > 1:
+                            params.append(('page', page))
+                        if format:
+                            params.append(('format', format))
+                        yield '{0}?{1}'.format(path, urlencode(params)) if params else path
+
+    def handle(self, *args, **kwargs):
+        host = kwargs['host']
+        secure = kwargs['https']
+        if not host:
+            raise CommandError('Host header of live traffic is required: set CACHE_WARMUP_HOST or pass --host')
+        # 请求经过完整的中间件链(与 WSGI 服务器处理请求相同), 缓存键与线上请求一致
+        factory = RequestFactory()
+        handler = BaseHandler()
+        handler.load_middleware()
+
+        def warmup(url, accept):
+            try:
+                start = time.perf_counter()
+                request = factory.get(url, HTTP_HOST=host, HTTP_ACCEPT=accept, secure=secure)
+                response = handler.get_response(request)
+                response.close()
+                return url, accept, response.status_code, time.perf_counter() - start
+            finally:
+                connections.close_all()
+
+        tasks = [(url, accept) for url in self.warmup_urls(kwargs['pages'], kwargs['formats']) for accept in kwargs['accept']]
+        start = time.perf_counter()
+        with ThreadPoolExecutor(max_workers=kwargs['workers']) as executor:
+            for url, accept, status_code, cost in executor.map(lambda task: warmup(*task), tasks):
+                self.stdout.write('{0} {1:>8.1f}ms {2} [{3}]'.format(status_code, cost * 1000, url, accept))
+        self.stdout.write('{0} pages warmed up in {1:.2f}s'.format(len(tasks), time.perf_counter() - start))
@@ -0,0 +1,62 @@
+import time
+
+from django.conf import settings
+from django.core.management.base import BaseCommand
+from django.urls import resolve
+from rest_framework import relations
+from rest_framework.request import Request
+from rest_framework.test import APIRequestFactory
+
+import api
+from api.models import Organization, OrganizationContact, OrganizationDemand
+from api.serializers import OrganizationSerializer
+
+
+def build_organizations(count):
+    '''
+    内存中的机构(各含 2 个联系人及 2 个需求), 不读写数据库
+    '''
+    organizations = []
+    for idx in range(1, count + 1):
+        organization = Organization(id=idx, province='湖北省', city='武汉市', name='医院{0}'.format(idx), inspector_id=1)
+        contacts = [OrganizationContact(id=idx * 2 + item, organization=organization, name='联系人', phone='13000000000') for item in range(2)]
+        demands = [OrganizationDemand(id=idx * 2 + item, organization=organization, name='口罩') for item in range(2)]
+        organization._prefetched_objects_cache = {'organizationcontact_set': contacts, 'organizationdemand_set': demands}
+        organizations.append(organization)
+    return organizations
+
+class Command(BaseCommand):
+    help = 'Benchmark serializing organizations: full reverse() per hyperlink vs URL templates'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--count', type=int, default=1000, help='organizations to serialize (default: 1000)')
+        parser.add_argument('--repeat', type=int, default=3, help='runs per method, the best is reported (default: 3)')
+
+    def serialize(self, reverse, organizations, request):
+        relations.reverse = reverse
+        try:
+            # 不经过 FragmentListSerializer(片段缓存), 逐个序列化
+            serializer = OrganizationSerializer(context={'request': request})
+            start = time.perf_counter()
+            data = [serializer.to_representation(organization) for organization in organizations]
+            return time.perf_counter() - start, data
+        finally:
+            relations.reverse = api.hack_reverse
+
+    def handle(self, *args, **kwargs):
+        organizations = build_organizations(kwargs['count'])
+        host = next((host for host in settings.ALLOWED_HOSTS if host != '*' and not host.startswith('.')), 'localhost')
+        request = Request(APIRequestFactory().get('/api/organizations/', HTTP_HOST=host))
+        request.resolver_match = resolve('/api/organizations/')
+        results = {}
+        for label, reverse in (('reverse', api.slow_reverse), ('template', api.hack_reverse)):
+            runs = [self.serialize(reverse, organizations, request) for idx in range(kwargs['repeat'])]
+            results[label] = (min(seconds for seconds, data in runs), runs[0][1])
+        if results['reverse'][1] != results['template'][1]:
+            self.stderr.write('serialized data differs')
+        self.stdout.write('{0:>10} {1:>12}'.format('method', 'seconds'))
+        for label, (seconds, data) in results.items():
+            self.stdout.write('{0:>10} {1:>12.4f}'.format(label, seconds))
+        self.stdout.write('speedup: {0:.1f}x ({1} organizations, {2} hyperlinks each)'.format(
+            results['reverse'][0] / results['template'][0], kwargs['count'], 1 + 1 + 2 * 2 + 2 * 2
+        ))
@@ -0,0 +1,12 @@
+from django.core.management.base import BaseCommand
+
+from api import search
+
+
+class Command(BaseCommand):
+    help = 'Rebuild the full-text search index of organizations and teams (SQLite FTS5; MySQL maintains its own)'
+
+    def handle(self, *args, **kwargs):
+        for model in search.search_indexes:
+            count = search.index_model(model)
+            self.stdout.write('{0}: {1} indexed'.format(model._meta.label, count))
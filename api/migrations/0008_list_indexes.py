@@ -0,0 +1,57 @@
+# Generated by Django 2.2.28 on 2026-10-18 16:40
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('api', '0007_team_wechat_qrcode'),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name='organization',
+            index=models.Index(fields=['emergency', '-add_time'], name='org_order_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='organization',
+            index=models.Index(fields=['province', 'city', 'emergency', '-add_time'], name='org_region_order_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='organization',
+            index=models.Index(fields=['inspector', 'emergency', '-add_time'], name='org_inspector_order_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='organization',
+            index=models.Index(fields=['verified', 'emergency', '-add_time'], name='org_verified_order_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='organizationcontact',
+            index=models.Index(fields=['-add_time'], name='org_contact_time_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='organizationdemand',
+            index=models.Index(fields=['-add_time'], name='org_demand_time_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='team',
+            index=models.Index(fields=['-add_time'], name='team_time_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='team',
+            index=models.Index(fields=['inspector', '-add_time'], name='team_inspector_time_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='team',
+            index=models.Index(fields=['verified', '-add_time'], name='team_verified_time_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='team',
+            index=models.Index(fields=['type', '-add_time'], name='team_type_time_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='teamcontact',
+            index=models.Index(fields=['-add_time'], name='team_contact_time_idx'),
+        ),
+    ]
@@ -0,0 +1,93 @@
+# Generated by Django 2.2.28 on 2026-10-18 16:43
+
+import api.search
+from django.db import migrations, models, transaction
+from django.db.utils import OperationalError
+import django.db.models.deletion
+
+
+# (模型, 搜索索引表, 搜索字段)
+search_tables = [
+    ('Organization', 'api_organization_search', ['name', 'address']),
+    ('Team', 'api_team_search', ['name', 'address']),
+]
+
+def create_search_indexes(apps, schema_editor):
+    '''
+    SQLite: 创建 FTS5 表并写入已有数据; MySQL: 创建 ngram FULLTEXT 索引
+    '''
+    connection = schema_editor.connection
+    for model_name, table, fields in search_tables:
+        model = apps.get_model('api', model_name)
+        if connection.vendor == 'mysql':
+            for field in fields:
+                schema_editor.execute('ALTER TABLE {0} ADD FULLTEXT INDEX {1} ({2}) WITH PARSER ngram'.format(
+                    connection.ops.quote_name(model._meta.db_table),
+                    connection.ops.quote_name('{0}_{1}_ft'.format(model._meta.db_table, field)),
+                    connection.ops.quote_name(field),
+                ))
+        elif connection.vendor == 'sqlite':
+            try:
+                with transaction.atomic(using=connection.alias):
+                    schema_editor.execute('CREATE VIRTUAL TABLE {0} USING fts5({1})'.format(table, ', '.join(fields)))
+            except OperationalError:
+                # SQLite 未编译 FTS5, 搜索使用 icontains
+                continue
+            rows = [
+                [values[0]] + [api.search.bigrams(value) for value in values[1:]]
+                for values in model.objects.values_list('pk', *fields)
+            ]
+            with connection.cursor() as cursor:
+                cursor.executemany('INSERT INTO {0} (rowid, {1}) VALUES (%s, {2})'.format(
+                    table, ', '.join(fields), ', '.join(['%s'] * len(fields))
+                ), rows)
+
+def drop_search_indexes(apps, schema_editor):
+    connection = schema_editor.connection
+    for model_name, table, fields in search_tables:
+        model = apps.get_model('api', model_name)
+        if connection.vendor == 'mysql':
+            for field in fields:
+                schema_editor.execute('ALTER TABLE {0} DROP INDEX {1}'.format(
+                    connection.ops.quote_name(model._meta.db_table),
+                    connection.ops.quote_name('{0}_{1}_ft'.format(model._meta.db_table, field)),
+                ))
+        elif connection.vendor == 'sqlite':
+            schema_editor.execute('DROP TABLE IF EXISTS {0}'.format(table))
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('api', '0008_list_indexes'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='OrganizationSearch',
+            fields=[
+                ('organization', models.OneToOneField(db_column='rowid', on_delete=django.db.models.deletion.DO_NOTHING, primary_key=True, related_name='search', serialize=False, to='api.Organization')),
+                ('name', api.search.SearchField()),
+                ('address', api.search.SearchField()),
+                ('rank', models.FloatField()),
+            ],
+            options={
+                'db_table': 'api_organization_search',
+                'managed': False,
+            },
+        ),
+        migrations.CreateModel(
+            name='TeamSearch',
+            fields=[
+                ('team', models.OneToOneField(db_column='rowid', on_delete=django.db.models.deletion.DO_NOTHING, primary_key=True, related_name='search', serialize=False, to='api.Team')),
+                ('name', api.search.SearchField()),
+                ('address', api.search.SearchField()),
+                ('rank', models.FloatField()),
+            ],
+            options={
+                'db_table': 'api_team_search',
+                'managed': False,
+            },
+        ),
+        migrations.RunPython(create_search_indexes, drop_search_indexes),
+    ]
@@ -0,0 +1,46 @@
+# Generated by Django 2.2.28 on 2026-10-18 17:04
+
+from django.db import migrations, models
+
+from api.duplicates import merge_children, print_report
+
+
+# (模型, 所属对象字段, 区分字段, 合并的字段)
+unique_children = [
+    ('OrganizationContact', 'organization', 'phone', ['name']),
+    ('OrganizationDemand', 'organization', 'name', ['remark', 'amount', 'receive_amount']),
+    ('TeamContact', 'team', 'phone', ['name']),
+]
+
+def remove_duplicates(apps, schema_editor):
+    '''
+    添加唯一约束前合并重复的联系人/需求(见 api.duplicates): 每组保留最后添加的(id 最大), 其空字段由其余数据补全, 输出合并报告
+    '''
+    report = []
+    for model_name, parent_field, key_field, fields in unique_children:
+        model = apps.get_model('api', model_name)
+        merge_children(model, parent_field, key_field, fields, report, schema_editor.connection.alias)
+    print_report('联系人/需求', report)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('api', '0009_search_index'),
+    ]
+
+    operations = [
+        migrations.RunPython(remove_duplicates, migrations.RunPython.noop),
+        migrations.AddConstraint(
+            model_name='organizationcontact',
+            constraint=models.UniqueConstraint(fields=('organization', 'phone'), name='org_contact_phone_uniq'),
+        ),
+        migrations.AddConstraint(
+            model_name='organizationdemand',
+            constraint=models.UniqueConstraint(fields=('organization', 'name'), name='org_demand_name_uniq'),
+        ),
+        migrations.AddConstraint(
+            model_name='teamcontact',
+            constraint=models.UniqueConstraint(fields=('team', 'phone'), name='team_contact_phone_uniq'),
+        ),
+    ]
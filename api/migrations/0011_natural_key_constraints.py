@@ -0,0 +1,63 @@
+# Generated by Django 2.2.28 on 2026-10-18 18:20
+
+from django.db import migrations, models
+
+import api.search
+from api.duplicates import merge_parents, print_report
+
+
+# (模型, 区分字段, 保留顺序, 合并的字段, 搜索索引表(SQLite FTS5), 搜索字段, [(关联模型, 所属对象字段, 区分字段, 合并的字段), ...])
+unique_parents = [
+    ('Organization', ['province', 'city', 'name'], ['-is_manual', '-verified', '-id'], ['address', 'source', 'emergency'],
+     'api_organization_search', ['name', 'address'], [
+        ('OrganizationContact', 'organization', 'phone', ['name']),
+        ('OrganizationDemand', 'organization', 'name', ['remark', 'amount', 'receive_amount']),
+    ]),
+    ('Team', ['name'], ['-verified', '-id'], ['type', 'address', 'main_text', 'wechat_qrcode'],
+     'api_team_search', ['name', 'address'], [
+        ('TeamContact', 'team', 'phone', ['name']),
+    ]),
+]
+
+def remove_duplicates(apps, schema_editor):
+    '''
+    添加唯一约束前合并重复的机构/团体(见 api.duplicates), 每组保留优先级最高的: 人工添加 > 后台添加, 已核实 > 未核实, 最后添加的(id 最大);
+    其余数据的联系人/需求移到保留的数据下(与已有的按手机/物品名合并), 空字段由其余数据补全, 不丢弃数据; 输出合并报告
+    '''
+    connection = schema_editor.connection
+    report = []
+    for model_name, key_fields, ordering, fields, search_table, search_fields, children in unique_parents:
+        model = apps.get_model('api', model_name)
+        children = [(apps.get_model('api', name), parent_field, key_field, child_fields) for name, parent_field, key_field, child_fields in children]
+        merged = merge_parents(model, key_fields, ordering, fields, children, report, connection.alias)
+        if not merged:
+            continue
+        with connection.cursor() as cursor:
+            if connection.vendor == 'sqlite' and search_table in connection.introspection.table_names(cursor):
+                # 删除合并掉的数据的索引, 重建保留的数据的索引(地址可能已补全)
+                cursor.executemany('DELETE FROM {0} WHERE rowid = %s'.format(search_table), [
+                    [pk] for keep, removed in merged for pk in [keep.pk] + removed
+                ])
+                cursor.executemany('INSERT INTO {0} (rowid, {1}) VALUES (%s, {2})'.format(
+                    search_table, ', '.join(search_fields), ', '.join(['%s'] * len(search_fields))
+                ), [[keep.pk] + [api.search.bigrams(getattr(keep, field)) for field in search_fields] for keep, removed in merged])
+    print_report('机构/团体', report)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('api', '0010_child_unique_constraints'),
+    ]
+
+    operations = [
+        migrations.RunPython(remove_duplicates, migrations.RunPython.noop),
+        migrations.AddConstraint(
+            model_name='organization',
+            constraint=models.UniqueConstraint(fields=('province', 'city', 'name'), name='org_region_name_uniq'),
+        ),
+        migrations.AddConstraint(
+            model_name='team',
+            constraint=models.UniqueConstraint(fields=('name',), name='team_name_uniq'),
+        ),
+    ]
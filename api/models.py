@@ -5,6 +5,7 @@ from model_utils import Choices
 from filer.fields.image import FilerImageField
 
 from registration.models import User
+from .search import SearchField
 
 
 class Organization(models.Model):
@@ -29,6 +30,30 @@ class Organization(models.Model):
         verbose_name = '机构'
         verbose_name_plural = '机构'
         app_label = 'api'
+        # 列表的 筛选字段(等值) + 排序字段(紧急程度正序, 时间倒序), 无需全表扫描及排序
+        # (MySQL 8.0 起支持倒序索引, 更早的版本按正序创建, 仍可避免全表扫描)
+        indexes = [
+            models.Index(fields=['emergency', '-add_time'], name='org_order_idx'),
+            models.Index(fields=['province', 'city', 'emergency', '-add_time'], name='org_region_order_idx'),
+            models.Index(fields=['inspector', 'emergency', '-add_time'], name='org_inspector_order_idx'),
+            models.Index(fields=['verified', 'emergency', '-add_time'], name='org_verified_order_idx'),
+        ]
+        # 机构按 省 + 市 + 名称 区分(见 api.serializers)
+        constraints = [
+            models.UniqueConstraint(fields=['province', 'city', 'name'], name='org_region_name_uniq'),
+        ]
+
+class OrganizationSearch(models.Model):
+    """机构搜索索引(SQLite FTS5 虚拟表, 由 api.search 维护)"""
+    organization = models.OneToOneField(Organization, primary_key=True, db_column='rowid', related_name='search', on_delete=models.DO_NOTHING)
+    name = SearchField()
+    address = SearchField()
+    rank = models.FloatField() # FTS5 相关度(bm25, 越小越相关), 仅在 MATCH 查询中可用
+
+    class Meta:
+        managed = False
+        db_table = 'api_organization_search'
+        app_label = 'api'
 
 class OrganizationContact(models.Model):
     """docstring for OrganizationContact"""
@@ -45,6 +70,13 @@ class OrganizationContact(models.Model):
         verbose_name = '机构联系人'
         verbose_name_plural = '机构联系人'
         app_label = 'api'
+        indexes = [
+            models.Index(fields=['-add_time'], name='org_contact_time_idx'),
+        ]
+        # 同一机构的联系人按手机区分(见 api.upsert)
+        constraints = [
+            models.UniqueConstraint(fields=['organization', 'phone'], name='org_contact_phone_uniq'),
+        ]
 
 class OrganizationDemand(models.Model):
     """docstring for OrganizationDemand"""
@@ -63,6 +95,13 @@ class OrganizationDemand(models.Model):
         verbose_name = '机构需求'
         verbose_name_plural = '机构需求'
         app_label = 'api'
+        indexes = [
+            models.Index(fields=['-add_time'], name='org_demand_time_idx'),
+        ]
+        # 同一机构的需求按物品名区分(见 api.upsert)
+        constraints = [
+            models.UniqueConstraint(fields=['organization', 'name'], name='org_demand_name_uniq'),
+        ]
 
 # -----------------------------------------------
 
@@ -91,6 +130,29 @@ class Team(models.Model):
         verbose_name = '(爱心)团体'
         verbose_name_plural = '(爱心)团体'
         app_label = 'api'
+        # 列表的 筛选字段(等值) + 排序字段(时间倒序)
+        indexes = [
+            models.Index(fields=['-add_time'], name='team_time_idx'),
+            models.Index(fields=['inspector', '-add_time'], name='team_inspector_time_idx'),
+            models.Index(fields=['verified', '-add_time'], name='team_verified_time_idx'),
+            models.Index(fields=['type', '-add_time'], name='team_type_time_idx'),
+        ]
+        # 团体按名称区分(见 api.serializers)
+        constraints = [
+            models.UniqueConstraint(fields=['name'], name='team_name_uniq'),
+        ]
+
+class TeamSearch(models.Model):
+    """团体搜索索引(SQLite FTS5 虚拟表, 由 api.search 维护)"""
+    team = models.OneToOneField(Team, primary_key=True, db_column='rowid', related_name='search', on_delete=models.DO_NOTHING)
+    name = SearchField()
+    address = SearchField()
+    rank = models.FloatField() # FTS5 相关度(bm25, 越小越相关), 仅在 MATCH 查询中可用
+
+    class Meta:
+        managed = False
+        db_table = 'api_team_search'
+        app_label = 'api'
 
 class TeamContact(models.Model):
     """docstring for TeamContact"""
@@ -106,4 +168,11 @@ class TeamContact(models.Model):
     class Meta:
         verbose_name = '团体(捐赠)联系人'
         verbose_name_plural = '团体(捐赠)联系人'
-        app_label = 'api'
\ No newline at end of file
+        app_label = 'api'
+        indexes = [
+            models.Index(fields=['-add_time'], name='team_contact_time_idx'),
+        ]
+        # 同一团体的联系人按手机区分(见 api.upsert)
+        constraints = [
+            models.UniqueConstraint(fields=['team', 'phone'], name='team_contact_phone_uniq'),
+        ]
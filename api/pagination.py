@@ -0,0 +1,257 @@
+'''
+列表分页
+
+默认按页码分页(page), 结果数量(count)按筛选条件缓存(见 cache_helper.cached_count()), 响应中 count_exact 表示是否为精确值;
+count=estimate 时大表使用数据库的估算值(不执行 COUNT)
+
+请求带有 cursor 参数(首页为 cursor=)时使用游标分页:
+- 游标为上一页首/尾对象的排序字段值(base64 编码), 按视图集的 cursor_ordering 以 WHERE 条件定位, 不使用 COUNT 及 OFFSET,
+  各页查询耗时与页码无关
+- 翻页期间新增的数据不会使已读取的数据移到下一页(不重复、不遗漏)
+'''
+import base64
+import binascii
+import json
+from collections import OrderedDict
+from functools import partial
+from types import SimpleNamespace
+
+from django.conf import settings
+from django.core.exceptions import EmptyResultSet, ValidationError
+from django.core.paginator import EmptyPage, Page, PageNotAnInteger, Paginator
+from django.db import connections
+from django.db.models import Q
+from django.utils.functional import cached_property
+from django.utils.translation import gettext_lazy as _
+from rest_framework.exceptions import NotFound
+from rest_framework.pagination import PageNumberPagination
+from rest_framework.response import Response
+from rest_framework.utils.urls import remove_query_param, replace_query_param
+
+from .cache_helper import cached_count
+
+
+def estimate_count(queryset):
+    '''
+    数据库估算的结果数量, 无法估算时为 None
+    - MySQL: EXPLAIN 的 rows * filtered(单表查询)
+    - SQLite: 无筛选条件时取 ANALYZE 的统计(sqlite_stat1)
+    '''
+    connection = connections[queryset.db]
+    try:
+        sql, params = queryset.order_by().query.sql_with_params()
+    except EmptyResultSet:
+        return 0
+    with connection.cursor() as cursor:
+        if connection.vendor == 'mysql':
+            cursor.execute('EXPLAIN ' + sql, params)
+            rows = cursor.fetchall()
+            columns = [column[0] for column in cursor.description]
+            if len(rows) != 1 or 'rows' not in columns:
+                return None
+            row = dict(zip(columns, rows[0]))
+            return int((row['rows'] or 0) * float(row.get('filtered', None) or 100) / 100)
+        if connection.vendor == 'sqlite' and not queryset.query.where:
+            if 'sqlite_stat1' not in connection.introspection.table_names(cursor):
+                return None
+            cursor.execute('SELECT stat FROM sqlite_stat1 WHERE tbl = %s', [queryset.model._meta.db_table])
+            counts = [int(row[0].split()[0]) for row in cursor.fetchall() if row[0]]
+            return max(counts) if counts else None
+    return None
+
+class EstimatedPage(Page):
+    '''
+    数量为估算值时的页: 是否有下一页由多取的一个对象确定
+    '''
+    def __init__(self, object_list, number, paginator, has_more):
+        super(EstimatedPage, self).__init__(object_list, number, paginator)
+        self.has_more = has_more
+
+    def has_next(self):
+        return self.has_more
+
+class CountedPaginator(Paginator):
+    '''
+    count 由 counter(object_list) 取得: (数量, 是否精确)
+    数量为估算值时只用于响应的 count, 不限制页码: 每页多取一个对象判断是否有下一页(估算值偏小时仍可翻到全部数据)
+    '''
+    def __init__(self, object_list, per_page, counter=None, **kwargs):
+        super(CountedPaginator, self).__init__(object_list, per_page, **kwargs)
+        self.counter = counter
+        self.count_exact = True
+
+    @cached_property
+    def count(self):
+        if self.counter is None:
+            return Paginator.count.func(self)
+        count, self.count_exact = self.counter(self.object_list)
+        return count
+
+    def page(self, number):
+        count = self.count  # 取得数量后 count_exact 才确定
+        if self.count_exact:
+            return super(CountedPaginator, self).page(number)
+        try:
+            number = int(number)
+        except (TypeError, ValueError):
+            raise PageNotAnInteger(_('That page number is not an integer'))
+        if number < 1:
+            raise EmptyPage(_('That page number is less than 1'))
+        bottom = (number - 1) * self.per_page
+        items = list(self.object_list[bottom:bottom + self.per_page + 1])
+        if not items and number > 1:
+            raise EmptyPage(_('That page contains no results'))
+        # 估算值不小于已读取到的数量
+        self.count = max(count, bottom + len(items))
+        return EstimatedPage(items[:self.per_page], number, self, len(items) > self.per_page)
+
+class ListPagination(PageNumberPagination):
+    '''
+    页码分页, 视图集定义了 cursor_ordering(唯一的排序, 末尾为 id)时可选游标分页
+    '''
+    cursor_query_param = 'cursor'
+    count_query_param = 'count'
+    invalid_cursor_message = _('Invalid cursor')
+
+    def paginate_queryset(self, queryset, request, view=None):
+        self.ordering = getattr(view, 'cursor_ordering', None)
+        if self.ordering is None or self.cursor_query_param not in request.query_params:
+            self.ordering = None
+            self.django_paginator_class = partial(CountedPaginator, counter=partial(self.count, request=request, view=view))
+            return super(ListPagination, self).paginate_queryset(queryset, request, view=view)
+
+        self.template = 'rest_framework/pagination/previous_and_next.html'
+        self.request = request
+        self.base_url = remove_query_param(request.build_absolute_uri(), self.page_query_param)
+        self.display_page_controls = True
+        page_size = self.get_page_size(request)
+        self.opts = queryset.model._meta
+        values, position, reverse = self.decode_cursor(request, self.opts)
+
+        ordering = [self.invert(field) for field in self.ordering] if reverse else self.ordering
+        queryset = queryset.order_by(*ordering)
+        if position is None:
+            results = list(queryset[:page_size + 1])
+        else:
+            # 依次读取游标之后的各段, 每段为一个索引范围, 读满一页(多取一个)为止
+            results = []
+            for condition in self.after(ordering, position):
+                results.extend(queryset.filter(condition)[:page_size + 1 - len(results)])
+                if len(results) > page_size:
+                    break
+        has_more = len(results) > page_size
+        results = results[:page_size]
+        if reverse:
+            results.reverse()
+
+        # 向后翻页时: 之前有数据(有游标), 之后是否有数据由多取的一个对象确定; 向前翻页时相反
+        has_before, has_after = (has_more, position is not None) if reverse else (position is not None, has_more)
+        self.next_position = self.position(results[-1]) if results and has_after else None
+        self.previous_position = self.position(results[0]) if results and has_before else None
+        if not results and position is not None:
+            # 游标之后已没有数据, 仍可从游标处往回翻页
+            if reverse:
+                self.next_position = values
+            else:
+                self.previous_position = values
+        return results
+
+    def count(self, queryset, request, view):
+        '''
+        (结果数量, 是否精确): count=estimate 且估算值不小于 API_COUNT_ESTIMATE_MIN 时为估算值, 否则为(缓存的)精确值
+        '''
+        if request.query_params.get(self.count_query_param, None) == 'estimate':
+            estimate = estimate_count(queryset)
+            if estimate is not None and estimate >= getattr(settings, 'API_COUNT_ESTIMATE_MIN', 100000):
+                return estimate, False
+        prefix = getattr(view, 'cache_key_prefix', None)
+        if prefix is None:
+            return queryset.count(), True
+        return cached_count(prefix, queryset, request), True
+
+    def invert(self, field):
+        return field[1:] if field.startswith('-') else '-' + field
+
+    def after(self, ordering, position):
+        '''
+        排在游标之后的数据, 按排序先后分为互不重叠的各段(按各字段的排序方向):
+            (a = x AND b = y AND c > z), (a = x AND b < y), (a > x)
+        每段的条件为 索引前缀相等 + 下一字段的范围, 只读取索引中的连续范围
+        '''
+        conditions = []
+        for idx in range(len(ordering) - 1, -1, -1):
+            equal = dict((field.lstrip('-'), value) for field, value in zip(ordering[:idx], position[:idx]))
+            field = ordering[idx]
+            lookup = '{0}__{1}'.format(field.lstrip('-'), 'lt' if field.startswith('-') else 'gt')
+            conditions.append(Q(**equal) & Q(**{lookup: position[idx]}))
+        return conditions
+
+    def position(self, instance):
+        '''
+        对象(或 values() 行)的排序字段值(游标中保存的字符串形式)
+        '''
+        fields = [self.opts.get_field(field.lstrip('-')) for field in self.ordering]
+        if isinstance(instance, dict):
+            instance = SimpleNamespace(**dict((field.attname, instance[field.name]) for field in fields))
+        return [field.value_to_string(instance) for field in fields]
+
+    def encode_cursor(self, position, reverse):
+        data = {'p': position}
+        if reverse:
+            data['r'] = 1
+        cursor = base64.urlsafe_b64encode(json.dumps(data, separators=(',', ':')).encode('utf-8')).decode('ascii')
+        return replace_query_param(self.base_url, self.cursor_query_param, cursor)
+
+    def decode_cursor(self, request, opts):
+        '''
+        (游标中的排序字段值, 转换后的排序字段值, 是否向前翻页); 首页为 (None, None, False)
+        '''
+        cursor = request.query_params.get(self.cursor_query_param, '')
+        if not cursor:
+            return None, None, False
+        try:
+            data = json.loads(base64.urlsafe_b64decode(cursor.encode('ascii')).decode('utf-8'))
+            values = data['p']
+            if not isinstance(values, list) or len(values) != len(self.ordering):
+                raise ValueError(cursor)
+            position = [opts.get_field(field.lstrip('-')).to_python(value) for field, value in zip(self.ordering, values)]
+        except (TypeError, ValueError, KeyError, binascii.Error, ValidationError):
+            raise NotFound(self.invalid_cursor_message)
+        return values, position, bool(data.get('r', False))
+
+    def get_next_link(self):
+        if self.ordering is None:
+            return super(ListPagination, self).get_next_link()
+        if self.next_position is None:
+            return None
+        return self.encode_cursor(self.next_position, False)
+
+    def get_previous_link(self):
+        if self.ordering is None:
+            return super(ListPagination, self).get_previous_link()
+        if self.previous_position is None:
+            return None
+        return self.encode_cursor(self.previous_position, True)
+
+    def get_paginated_response(self, data):
+        if self.ordering is None:
+            return Response(OrderedDict([
+                ('count', self.page.paginator.count),
+                ('count_exact', self.page.paginator.count_exact),
+                ('next', self.get_next_link()),
+                ('previous', self.get_previous_link()),
+                ('results', data),
+            ]))
+        return Response(OrderedDict([
+            ('next', self.get_next_link()),
+            ('previous', self.get_previous_link()),
+            ('results', data),
+        ]))
+
+    def get_html_context(self):
+        if self.ordering is None:
+            return super(ListPagination, self).get_html_context()
+        return {
+            'previous_url': self.get_previous_link(),
+            'next_url': self.get_next_link(),
+        }
@@ -0,0 +1,28 @@
+'''
+JSON 响应: 安装了 orjson 时使用 orjson 编码(可选依赖), 输出与 rest_framework 的 JSONRenderer 逐字节相同
+'''
+from rest_framework import renderers
+
+try:
+    import orjson
+except ImportError:
+    orjson = None
+
+
+class FastJSONRenderer(renderers.JSONRenderer):
+    '''
+    紧凑、非 ASCII 转义(默认设置)的 JSON 由 orjson 编码, 其它情况(缩进、ensure_ascii 等)及 orjson 无法编码的数据使用 JSONRenderer;
+    日期时间等由 encoder_class 转换(与 JSONRenderer 一致), 科学计数法的浮点数写法可能不同(数值相同)
+    '''
+    def render(self, data, accepted_media_type=None, renderer_context=None):
+        if orjson is None or data is None or self.ensure_ascii or not self.compact:
+            return super(FastJSONRenderer, self).render(data, accepted_media_type, renderer_context)
+        if self.get_indent(accepted_media_type, renderer_context or {}) is not None:
+            return super(FastJSONRenderer, self).render(data, accepted_media_type, renderer_context)
+        option = orjson.OPT_NON_STR_KEYS | orjson.OPT_PASSTHROUGH_DATETIME | orjson.OPT_PASSTHROUGH_DATACLASS
+        try:
+            ret = orjson.dumps(data, default=self.encoder_class().default, option=option)
+        except (orjson.JSONEncodeError, TypeError):
+            return super(FastJSONRenderer, self).render(data, accepted_media_type, renderer_context)
+        # 与 JSONRenderer 相同, 转义 \u2028 及 \u2029
+        return ret.replace(b'\xe2\x80\xa8', b'\\u2028').replace(b'\xe2\x80\xa9', b'\\u2029')
@@ -0,0 +1,113 @@
+'''
+只读列表的快速序列化: 由 values() 行生成与 ModelSerializer 相同的数据(字段、顺序及格式一致)
+
+- 普通字段: 取列值, CharField/IntegerField/BooleanField 直接使用, 其它字段调用序列化器字段的 to_representation()
+- 关联字段(url、外键的超链接): 以 pk 调用字段的 to_representation()(URL 模板, 见 api.hack_reverse)
+- 嵌套的 many 序列化器(联系人/需求): 按外键一次查询全部子行(values()), 分组后同样序列化
+不创建模型对象及 OrderedDict, 字段在每个请求中只解析一次;
+包含不支持的字段(如 SerializerMethodField、文件字段、点号 source)时 compile() 返回 None, 使用常规序列化
+'''
+from functools import partial
+
+from rest_framework import relations, serializers
+
+
+# 数据库返回的值即为序列化结果的字段
+plain_field_classes = (serializers.CharField, serializers.IntegerField, serializers.BooleanField)
+
+def unique(names):
+    result = []
+    for name in names:
+        if name not in result:
+            result.append(name)
+    return result
+
+def related_link(field, value):
+    return field.to_representation(relations.PKOnlyObject(pk=value))
+
+class RowSerializer(object):
+    '''
+    序列化器(已按 fields/expand 裁剪字段)的 values() 行序列化
+        entries: [(字段名, 列名, 转换函数), ...], 嵌套字段的列名为 None
+        nested: {字段名: (子 RowSerializer, 反向关联)}
+    '''
+    def __init__(self, model, entries, nested):
+        self.model = model
+        self.pk_name = model._meta.pk.name
+        self.entries = entries
+        self.nested = nested
+        self.columns = unique([self.pk_name] + [column for name, column, convert in entries if column is not None])
+
+    @classmethod
+    def compile(cls, serializer):
+        '''
+        由序列化器实例生成, 不支持时为 None
+        '''
+        model = getattr(getattr(serializer, 'Meta', None), 'model', None)
+        if model is None:
+            return None
+        opts = model._meta
+        concrete = dict((field.name, field) for field in opts.concrete_fields)
+        accessors = dict((rel.get_accessor_name(), rel) for rel in opts.related_objects if rel.one_to_many)
+        entries = []
+        nested = {}
+        for name, field in serializer.fields.items():
+            if field.write_only:
+                continue
+            source = field.source
+            if isinstance(field, serializers.ListSerializer):
+                rel = accessors.get(source, None)
+                child = cls.compile(field.child) if rel is not None else None
+                if child is None:
+                    return None
+                entries.append((name, None, None))
+                nested[name] = (child, rel)
+            elif isinstance(field, relations.HyperlinkedIdentityField):
+                if field.lookup_field != 'pk':
+                    return None
+                entries.append((name, opts.pk.name, partial(related_link, field)))
+            elif isinstance(field, (relations.HyperlinkedRelatedField, relations.PrimaryKeyRelatedField)):
+                model_field = concrete.get(source, None)
+                if model_field is None or not model_field.many_to_one:
+                    return None
+                if getattr(field, 'lookup_field', 'pk') != 'pk' or getattr(field, 'pk_field', None) is not None:
+                    return None
+                entries.append((name, source, partial(related_link, field)))
+            elif isinstance(field, (serializers.Serializer, serializers.ModelField, serializers.SerializerMethodField,
+                                    serializers.FileField, relations.RelatedField, serializers.ManyRelatedField)):
+                return None
+            else:
+                model_field = concrete.get(source, None)
+                if model_field is None or model_field.is_relation:
+                    return None
+                entries.append((name, source, None if type(field) in plain_field_classes else field.to_representation))
+        return cls(model, entries, nested)
+
+    def children(self, pks):
+        '''
+        各嵌套字段的序列化结果: {字段名: {父对象id: [子数据, ...]}}
+        与预取的关联对象(prefetch_related)相同, 使用关联模型的默认管理器, 不另加排序
+        '''
+        result = {}
+        for name, (child, rel) in self.nested.items():
+            foreign_key = rel.field.name
+            queryset = child.model._default_manager.filter(**{'{0}__in'.format(foreign_key): pks})
+            rows = list(queryset.values(*unique([foreign_key] + child.columns)))
+            groups = result[name] = {}
+            for row, data in zip(rows, child.to_representation(rows)):
+                groups.setdefault(row[foreign_key], []).append(data)
+        return result
+
+    def to_representation(self, rows):
+        children = self.children([row[self.pk_name] for row in rows]) if self.nested and rows else {}
+        result = []
+        for row in rows:
+            data = {}
+            for name, column, convert in self.entries:
+                if column is None:
+                    data[name] = children[name].get(row[self.pk_name], [])
+                    continue
+                value = row[column]
+                data[name] = value if value is None or convert is None else convert(value)
+            result.append(data)
+        return result
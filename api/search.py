@@ -0,0 +1,198 @@
+'''
+全文搜索(fuzzy_name / fuzzy_address)
+
+按二元组(bigram)分词, 适用于中文的机构名、地址:
+- SQLite: FTS5 虚拟表 <表名>_search(rowid 为对象id), 写入的是已切分的二元组(见 bigrams()),
+  模型写入(save/delete)时通过信号在同一事务中更新; 不发送信号的批量操作之后调用 index_model()
+- MySQL: 模型表上 ngram 解析器的 FULLTEXT 索引(ngram_token_size 默认为 2), 由 MySQL 维护
+
+搜索结果按相关度排序(search_relevance 越大越相关); 不支持全文索引的数据库 或 没有可搜索字符的查询使用 icontains
+'''
+import re
+
+from django.db import connections, router
+from django.db.models import F, FloatField, Lookup, TextField, Value
+from django.db.models.expressions import RawSQL
+from django.db.models.signals import post_delete, post_save
+
+
+# 模型 -> (搜索索引模型(SQLite), [搜索字段, ...])
+search_indexes = {}
+
+# 分词单位: 连续的字母/数字/汉字(与 FTS5 unicode61 分词器的分隔规则一致)
+re_search_word = re.compile(r'[^\W_]+')
+
+# 已确认存在的 FTS5 表: 数据库别名 -> {表名, ...}
+_fts_tables = {}
+
+def register(model, search_model, fields):
+    search_indexes[model] = (search_model, list(fields))
+
+def words(text):
+    return re_search_word.findall((text or '').lower())
+
+def bigrams(text):
+    '''
+    索引文本: 各连续字符串的二元组, 及末尾的单字(单字查询按前缀匹配)
+        '武汉协和医院' -> '武汉 汉协 协和 和医 医院 院'
+    '''
+    tokens = []
+    for word in words(text):
+        tokens.extend(word[idx:idx + 2] for idx in range(len(word) - 1))
+        tokens.append(word[-1])
+    return ' '.join(tokens)
+
+def fts_query(text):
+    '''
+    FTS5 查询: 每个连续字符串为一个二元组短语(即子串匹配), 单字为前缀查询; 没有可搜索字符时为 None
+    '''
+    phrases = []
+    for word in words(text):
+        if len(word) == 1:
+            phrases.append('"{0}" *'.format(word))
+        else:
+            phrases.append('"{0}"'.format(' '.join(word[idx:idx + 2] for idx in range(len(word) - 1))))
+    return ' AND '.join(phrases) or None
+
+def boolean_query(text):
+    '''
+    MySQL 布尔模式查询: 每个连续字符串为必须出现的短语(ngram 解析器切分为二元组), 单字为前缀查询
+    '''
+    terms = ['+{0}*'.format(word) if len(word) == 1 else '+"{0}"'.format(word) for word in words(text)]
+    return ' '.join(terms) or None
+
+class Match(Lookup):
+    '''
+    FTS5 列查询: <列> MATCH <查询>
+    '''
+    lookup_name = 'match'
+
+    def as_sql(self, compiler, connection):
+        lhs, lhs_params = self.process_lhs(compiler, connection)
+        rhs, rhs_params = self.process_rhs(compiler, connection)
+        return '{0} MATCH {1}'.format(lhs, rhs), lhs_params + rhs_params
+
+class SearchField(TextField):
+    '''
+    FTS5 表的列(支持 match 查询)
+    '''
+
+SearchField.register_lookup(Match)
+
+def fts_table_exists(model, using):
+    '''
+    SQLite 的 FTS5 表是否存在(未编译 FTS5 的 SQLite 上迁移不创建该表)
+    '''
+    search_model = search_indexes[model][0]
+    tables = _fts_tables.get(using, None)
+    if tables is None:
+        connection = connections[using]
+        table_names = connection.introspection.table_names()
+        tables = _fts_tables[using] = set(
+            search_model._meta.db_table for search_model, fields in search_indexes.values() if search_model._meta.db_table in table_names
+        )
+    return search_model._meta.db_table in tables
+
+def backend(model, using):
+    '''
+    全文索引类型: 'fts5' / 'ngram' / None(不支持, 使用 icontains)
+    '''
+    if model not in search_indexes:
+        return None
+    vendor = connections[using].vendor
+    if vendor == 'mysql':
+        return 'ngram'
+    if vendor == 'sqlite' and fts_table_exists(model, using):
+        return 'fts5'
+    return None
+
+def search(queryset, terms):
+    '''
+    按 {字段: 查询文本} 搜索, 结果附加相关度 search_relevance(越大越相关)
+    '''
+    model = queryset.model
+    using = queryset.db
+    kind = backend(model, using)
+    relevance = []
+    for field, text in terms.items():
+        if kind == 'fts5' and fts_query(text) is not None:
+            queryset = queryset.filter(**{'search__{0}__match'.format(field): fts_query(text)})
+            # bm25 越小越相关, 多个字段的 MATCH 共用同一个 rank
+            relevance = [-F('search__rank')]
+        elif kind == 'ngram' and boolean_query(text) is not None:
+            ops = connections[using].ops
+            column = '{0}.{1}'.format(ops.quote_name(model._meta.db_table), ops.quote_name(model._meta.get_field(field).column))
+            alias = 'search_{0}'.format(field)
+            queryset = queryset.annotate(**{alias: RawSQL(
+                'MATCH ({0}) AGAINST (%s IN BOOLEAN MODE)'.format(column), [boolean_query(text)], output_field=FloatField()
+            )}).filter(**{'{0}__gt'.format(alias): 0})
+            relevance.append(F(alias))
+        else:
+            queryset = queryset.filter(**{'{0}__icontains'.format(field): text})
+    if not relevance:
+        return queryset.annotate(search_relevance=Value(0.0, output_field=FloatField()))
+    total = relevance[0]
+    for item in relevance[1:]:
+        total = total + item
+    return queryset.annotate(search_relevance=total)
+
+def index_instances(model, instances, using=None):
+    '''
+    更新对象的搜索索引(SQLite FTS5; MySQL 的 FULLTEXT 索引自动维护)
+    '''
+    using = using or router.db_for_write(model)
+    if backend(model, using) != 'fts5':
+        return
+    search_model, fields = search_indexes[model]
+    table = connections[using].ops.quote_name(search_model._meta.db_table)
+    rows = [[instance.pk] + [bigrams(getattr(instance, field)) for field in fields] for instance in instances]
+    with connections[using].cursor() as cursor:
+        cursor.executemany('DELETE FROM {0} WHERE rowid = %s'.format(table), [row[:1] for row in rows])
+        cursor.executemany('INSERT INTO {0} (rowid, {1}) VALUES (%s, {2})'.format(
+            table, ', '.join(fields), ', '.join(['%s'] * len(fields))
+        ), rows)
+
+def delete_instances(model, pks, using=None):
+    using = using or router.db_for_write(model)
+    if backend(model, using) != 'fts5':
+        return
+    table = connections[using].ops.quote_name(search_indexes[model][0]._meta.db_table)
+    with connections[using].cursor() as cursor:
+        cursor.executemany('DELETE FROM {0} WHERE rowid = %s'.format(table), [[pk] for pk in pks])
+
+def index_model(model, queryset=None, using=None):
+    '''
+    重建模型的搜索索引(queryset 为 None 时重建全部), 用于不发送信号的批量操作之后, 返回索引的对象数
+    '''
+    using = using or router.db_for_write(model)
+    if backend(model, using) != 'fts5':
+        return 0
+    search_model, fields = search_indexes[model]
+    if queryset is None:
+        with connections[using].cursor() as cursor:
+            cursor.execute('DELETE FROM {0}'.format(connections[using].ops.quote_name(search_model._meta.db_table)))
+        queryset = model._default_manager.using(using).all()
+    instances = list(queryset.only('pk', *fields))
+    index_instances(model, instances, using=using)
+    return len(instances)
+
+def on_save(sender, instance, using, **kwargs):
+    index_instances(sender, [instance], using=using)
+
+def on_delete(sender, instance, using, **kwargs):
+    delete_instances(sender, [instance.pk], using=using)
+
+def connect_signals():
+    '''
+    连接已登记模型的信号(ApiConfig.ready() 中调用)
+    '''
+    for model in search_indexes:
+        uid = 'search-index-{0}'.format(model._meta.label_lower)
+        post_save.connect(on_save, sender=model, dispatch_uid=uid)
+        post_delete.connect(on_delete, sender=model, dispatch_uid=uid)
+
+def register_models():
+    from .models import Organization, OrganizationSearch, Team, TeamSearch
+
+    register(Organization, OrganizationSearch, ['name', 'address'])
+    register(Team, TeamSearch, ['name', 'address'])
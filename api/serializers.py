@@ -21,13 +21,131 @@
     本人添加  未核实  删除, 创建
     他人添加  已核实  ?(暂未处理, 丢弃数据)
     他人添加  未核实  ?(暂未处理, 丢弃数据)
+
+区分字段由数据库唯一约束保证; 递交在一个事务中完成: 锁定或创建已存在数据(并发递交同一数据时依次处理, 见 api.upsert.lock_or_create()),
+"删除, 创建" 在已存在数据上重置字段、重建联系人/需求(id 不变)
 '''
+from django.conf import settings
+from django.core.cache import cache
+from django.db import IntegrityError, models, transaction
+from django.db.models import prefetch_related_objects
+from django.utils import timezone
 from rest_framework import serializers
+from rest_framework.permissions import SAFE_METHODS
 from filer.models.imagemodels import Image
 
 from .models import Organization, OrganizationContact, OrganizationDemand, Team, TeamContact
 from registration.models import User
-from .cache_helper import clear_by_prefix
+from . import search
+from .cache_helper import fragment_keys, is_support
+from .cache_invalidation import deferred_invalidation, invalidate_model
+from .row_serializer import RowSerializer
+from .upsert import clear_related, for_update, lock_or_create, reset, upsert_related
+
+
+def query_param_list(request, name):
+    '''
+    逗号分隔的查询参数, 参数不存在时为 None
+    '''
+    value = request.query_params.get(name, None)
+    if value is None:
+        return None
+    return [item.strip() for item in value.split(',') if item.strip()]
+
+class SparseFieldsMixin(object):
+    '''
+    读取(GET)时按查询参数返回部分字段:
+    - fields: 逗号分隔的字段名, 只返回这些字段(id 始终返回, 缓存按 id 失效)
+    - expand: 逗号分隔的嵌套字段名(Meta.expandable_fields), 未指定 fields 时默认全部嵌套, 否则默认不嵌套
+    未返回的字段不查询(见 sparse_queryset()), 未返回的嵌套字段不预取
+    '''
+    def __init__(self, *args, **kwargs):
+        super(SparseFieldsMixin, self).__init__(*args, **kwargs)
+        request = self._context.get('request', None)
+        if request is None or request.method not in SAFE_METHODS:
+            return
+        fields = query_param_list(request, 'fields')
+        expand = query_param_list(request, 'expand')
+        if fields is None and expand is None:
+            return
+        expandable = getattr(self.Meta, 'expandable_fields', {})
+        if fields is None:
+            keep = set(name for name in self.fields if name not in expandable)
+        else:
+            keep = set(fields) | set(['id'])
+        if expand is not None:
+            keep = (keep - set(expandable)) | (set(expand) & set(expandable))
+        for name in list(self.fields):
+            if name not in keep:
+                self.fields.pop(name)
+
+    @classmethod
+    def sparse_queryset(cls, queryset, request, extra=()):
+        '''
+        只查询返回的字段所需的列(extra 为另外需要的字段, 如游标分页的排序字段)
+        '''
+        serializer = cls(context={'request': request})
+        concrete = set(field.name for field in queryset.model._meta.concrete_fields)
+        names = set(field.source for field in serializer.fields.values() if field.source in concrete)
+        names.update(name.lstrip('-') for name in extra)
+        if len(names) >= len(concrete):
+            return queryset
+        return queryset.only(*names)
+
+class FragmentListSerializer(serializers.ListSerializer):
+    '''
+    列表序列化: 逐个对象缓存序列化结果(片段, 含嵌套的联系人/需求), 列表由片段组成, 只序列化有变化的对象
+
+    子序列化器的 Meta.cache_key_prefix 为资源前缀, 对象版本由 evict_object() 更新(见 cache_helper.fragment_keys());
+    Meta.expandable_fields 为嵌套字段及其关联对象, 只为需要序列化的对象一次性查询(查询数与列表长度无关)
+    列表项为 values() 行(dict, 见 PatchedViewSet.list())时由 row_serializer 序列化
+    '''
+    @property
+    def row_serializer(self):
+        '''
+        values() 行的序列化(按当前返回的字段), 不支持时为 None
+        '''
+        if not hasattr(self, '_row_serializer'):
+            self._row_serializer = RowSerializer.compile(self.child)
+        return self._row_serializer
+
+    def pk(self, item):
+        return item[self.row_serializer.pk_name] if isinstance(item, dict) else item.pk
+
+    def represent(self, items):
+        '''
+        序列化(未缓存的)对象
+        '''
+        if items and isinstance(items[0], dict):
+            return self.row_serializer.to_representation(items)
+        self.prefetch(items)
+        return [self.child.to_representation(item) for item in items]
+
+    def prefetch(self, items):
+        expandable = getattr(self.child.Meta, 'expandable_fields', {})
+        lookups = [lookup for name, lookup in expandable.items() if name in self.child.fields]
+        if items and lookups:
+            prefetch_related_objects(items, *lookups)
+
+    def to_representation(self, data):
+        prefix = getattr(self.child.Meta, 'cache_key_prefix', None)
+        request = self.context.get('request', None)
+        iterable = data.all() if isinstance(data, models.Manager) else data
+        items = list(iterable)
+        if prefix is None or request is None or not is_support:
+            return self.represent(items)
+
+        # 返回的字段不同(fields/expand)时片段不同
+        variant = ','.join(self.child.fields)
+        keys = fragment_keys(prefix, request, self.context, [self.pk(item) for item in items], variant=variant)
+        fragments = cache.get_many([key for key, storable in keys])
+        missing = [(item, key, storable) for item, (key, storable) in zip(items, keys) if key not in fragments]
+        timeout = getattr(settings, 'CACHE_FRAGMENT_TIMEOUT', 60 * 60 * 2)
+        for (item, key, storable), fragment in zip(missing, self.represent([item for item, key, storable in missing])):
+            fragments[key] = fragment
+            if storable:
+                cache.set(key, fragment, timeout)
+        return [fragments[key] for key, storable in keys]
 
 
 class ImageSerializer(serializers.HyperlinkedModelSerializer):
@@ -63,14 +181,6 @@ class OrganizationContactSerializer(serializers.HyperlinkedModelSerializer):
             'organization': {'required': False},
         }
 
-    def create(self, validated_data):
-        clear_by_prefix('organization')
-        return super(OrganizationContactSerializer, self).create(validated_data)
-
-    def update(self, instance, validated_data):
-        clear_by_prefix('organization')
-        return super(OrganizationContactSerializer, self).update(instance, validated_data)
-
 class OrganizationDemandSerializer(serializers.HyperlinkedModelSerializer):
     class Meta:
         model = OrganizationDemand
@@ -85,21 +195,137 @@ class OrganizationDemandSerializer(serializers.HyperlinkedModelSerializer):
             'receive_amount': {'required': False},
         }
 
-    def create(self, validated_data):
-        clear_by_prefix('organization')
-        return super(OrganizationDemandSerializer, self).create(validated_data)
-
-    def update(self, instance, validated_data):
-        clear_by_prefix('organization')
-        return super(OrganizationDemandSerializer, self).update(instance, validated_data)
+def submit_action(instance, user):
+    '''
+    已存在数据的递交请求处理方案(见模块说明): 'replace' 删除, 创建 / 'update' 更新 / 'discard' 丢弃数据
+    '''
+    if not getattr(instance, 'is_manual', True) or (instance.inspector_id == user.pk and not instance.verified):
+        # 后台添加 / 本人创建未验证
+        return 'replace'
+    if instance.inspector_id == user.pk:
+        # 本人创建已验证
+        return 'update'
+    # 他人创建
+    return 'discard'
+
+# 机构的区分字段
+organization_key_fields = ('province', 'city', 'name')
+
+def organization_key(data):
+    '''
+    机构的区分字段: (省, 市, 名称)
+    '''
+    if isinstance(data, dict):
+        return tuple(data.get(name, None) for name in organization_key_fields)
+    return tuple(getattr(data, name) for name in organization_key_fields)
+
+class OrganizationListSerializer(FragmentListSerializer):
+    '''
+    机构批量递交(POST organizations/bulk/): 处理方案与逐个递交(OrganizationSerializer.create())相同(见模块说明),
+    按批次锁定已存在数据, 以 bulk_create()/bulk_update() 写入, 在一个事务中完成, 提交后统一失效一次缓存
+
+    返回的机构与提交的顺序一致(丢弃的数据返回已存在数据)
+    '''
+    def validate(self, attrs):
+        keys = [organization_key(data) for data in attrs]
+        if len(set(keys)) != len(keys):
+            raise serializers.ValidationError('同一批次中的机构(省 + 市 + 名称)不能重复')
+        return attrs
+
+    def existing(self, keys):
+        '''
+        锁定已存在数据: {区分字段: 机构}
+        '''
+        keys = set(keys)
+        queryset = for_update(Organization.objects.filter(
+            province__in=set(key[0] for key in keys), city__in=set(key[1] for key in keys), name__in=set(key[2] for key in keys)
+        ).order_by('pk'))
+        return dict((organization_key(instance), instance) for instance in queryset if organization_key(instance) in keys)
 
-class OrganizationSerializer(serializers.HyperlinkedModelSerializer):
+    def create(self, validated_data):
+        # 新数据被并发的递交先插入时(违反唯一约束)整批回滚到保存点, 重新锁定已存在数据后处理一次
+        for attempt in range(2):
+            try:
+                with transaction.atomic():
+                    return self.submit(validated_data)
+            except IntegrityError:
+                if attempt:
+                    raise
+
+    def submit(self, validated_data):
+        user = self.context['request'].user
+        items = []
+        for data in validated_data:
+            data = dict(data)
+            contacts_data = data.pop('organizationcontact_set', [])
+            demands_data = data.pop('organizationdemand_set', [])
+            data.pop('inspector', None)
+            data.update(inspector=user, is_manual=True, verified=False)
+            items.append((data, contacts_data, demands_data))
+        keys = [organization_key(data) for data, contacts_data, demands_data in items]
+        existing = self.existing(keys)
+
+        results = [None] * len(items)
+        to_create, to_replace, to_update = [], [], []
+        for idx, key in enumerate(keys):
+            instance = results[idx] = existing.get(key, None)
+            if instance is None:
+                # 新数据
+                to_create.append(idx)
+                continue
+            action = submit_action(instance, user)
+            if action == 'replace':
+                to_replace.append(idx)
+            elif action == 'update':
+                to_update.append(idx)
+
+        now = timezone.now()
+        with deferred_invalidation():
+            if to_create:
+                Organization.objects.bulk_create([Organization(**items[idx][0]) for idx in to_create])
+                # bulk_create() 不一定返回id(如 SQLite、MySQL), 按区分字段读取新建的机构
+                created = self.existing([keys[idx] for idx in to_create])
+                for idx in to_create:
+                    results[idx] = created[keys[idx]]
+
+            fields = set(['add_time'])
+            for idx in to_replace:
+                # 删除, 创建: 重置字段(id 不变)
+                fields.update(reset(results[idx], items[idx][0], keep=organization_key_fields))
+            for idx in to_update:
+                # 更新: 合并提交的字段
+                for name, value in items[idx][0].items():
+                    if name not in organization_key_fields:
+                        setattr(results[idx], name, value)
+                        fields.add(name)
+            if to_replace or to_update:
+                for idx in to_replace + to_update:
+                    results[idx].add_time = now
+                Organization.objects.bulk_update([results[idx] for idx in to_replace + to_update], sorted(fields))
+            if to_replace:
+                clear_related(Organization, [results[idx].pk for idx in to_replace])
+
+            # 新建/重置的机构: 新增联系人、需求; 更新的机构: 合并联系人、需求
+            changed = to_create + to_replace + to_update
+            upsert_related(OrganizationContact, 'organization', 'phone', [(results[idx], items[idx][1]) for idx in changed])
+            upsert_related(OrganizationDemand, 'organization', 'name', [(results[idx], items[idx][2]) for idx in changed])
+
+            # 批量写入不发送信号: 统一失效缓存(事务提交后一次), 更新搜索索引
+            for model in (Organization, OrganizationContact, OrganizationDemand):
+                invalidate_model(model)
+            search.index_instances(Organization, [results[idx] for idx in changed])
+        return results
+
+class OrganizationSerializer(SparseFieldsMixin, serializers.HyperlinkedModelSerializer):
     contacts = OrganizationContactSerializer(source='organizationcontact_set', many=True)
     demands = OrganizationDemandSerializer(source='organizationdemand_set', many=True)
 
     class Meta:
         model = Organization
         fields = ['url', 'id', 'contacts', 'demands', 'province', 'city', 'name', 'address', 'source', 'verified', 'add_time', 'is_manual', 'inspector', 'emergency']
+        list_serializer_class = OrganizationListSerializer
+        cache_key_prefix = 'organization' # 片段缓存前缀
+        expandable_fields = {'contacts': 'organizationcontact_set', 'demands': 'organizationdemand_set'} # 嵌套字段: 预取的关联对象
         extra_kwargs = {
             'id': {'required': False},
             'url': {'required': False, 'read_only': True},
@@ -112,6 +338,7 @@ class OrganizationSerializer(serializers.HyperlinkedModelSerializer):
             'is_manual': {'required': False, 'default': True},
         }
 
+    @transaction.atomic
     def create(self, validated_data):
         contacts_data = validated_data.pop('organizationcontact_set', [])
         demands_data = validated_data.pop('organizationdemand_set', [])
@@ -121,105 +348,40 @@ class OrganizationSerializer(serializers.HyperlinkedModelSerializer):
         validated_data['inspector'] = user
         validated_data['is_manual'] = True
         validated_data['verified'] = False
-        province = validated_data.pop('province', None)
-        city = validated_data.pop('city', None)
-        name = validated_data.pop('name', None)
-
-        instance, created = Organization.objects.get_or_create(
-            name=name,
-            province=province,
-            city=city,
-            defaults=validated_data
-        )
-
-        is_create_related = True
-        is_update_related = False
-        if not created:
-            # 已存在数据
-            if not instance.is_manual:
-                # 后台添加
-                instance.delete()
-            else:
-                if instance.inspector == user:
-                    # 本人创建
-                    if instance.verified:
-                        # 已验证
-                        is_create_related = False
-                        is_update_related = True
-                        # 更新
-                        for key in validated_data:
-                            setattr(instance, key, validated_data[key])
-                        instance.save()
-                    else:
-                        # 未验证
-                        instance.delete()
-                else:
-                    # 他人创建
-                    is_create_related = False
-                    pass
-        if is_create_related:
-            # 新数据-直接添加
-            if not created:
-                instance = Organization.objects.create(
-                    name=name,
-                    province=province,
-                    city=city,
-                    **validated_data
-                )
-            for contact_data in contacts_data:
-                contact_data.pop('organization', None)
-                contact = OrganizationContact.objects.create(
-                    organization=instance,
-                    **contact_data
-                )
-            for demand_data in demands_data:
-                demand_data.pop('organization', None)
-                demand = OrganizationDemand.objects.create(
-                    organization=instance,
-                    **demand_data
-                )
-        if is_update_related:
-            self.f_contacts_update(instance, contacts_data, delete_exclude=False)
-            self.f_demands_update(instance, demands_data, delete_exclude=False)
-
-        clear_by_prefix('organization')
+        key = dict((name, validated_data.pop(name, None)) for name in organization_key_fields)
+
+        instance, created = lock_or_create(Organization, key, validated_data)
+        action = 'create' if created else submit_action(instance, user)
+        if action == 'discard':
+            return instance
+        if action == 'replace':
+            # 删除, 创建: 重置字段, 删除联系人、需求(id 不变)
+            reset(instance, validated_data, keep=organization_key_fields)
+            instance.save()
+            clear_related(Organization, [instance.pk])
+        elif action == 'update':
+            # 更新: 合并联系人、需求
+            for name in validated_data:
+                setattr(instance, name, validated_data[name])
+            instance.save()
+        upsert_related(OrganizationContact, 'organization', 'phone', [(instance, contacts_data)])
+        upsert_related(OrganizationDemand, 'organization', 'name', [(instance, demands_data)])
 
         return instance
 
     def f_contacts_update(self, instance, contacts_data, delete_exclude=True):
-        contact_phones = []
-        for contact_data in contacts_data:
-            contact_data.pop('add_time', None)
-            contact_data.pop('organization', None)
-            phone = contact_data.pop('phone', None)
-            if bool(phone):
-                contact_phones.append(phone)
-                contact, contact_created = OrganizationContact.objects.update_or_create(
-                    organization=instance,
-                    phone=phone,
-                    defaults=contact_data
-                )
-        
-        if bool(contact_phones) and delete_exclude:
-            OrganizationContact.objects.filter(organization=instance).exclude(phone__in=contact_phones).delete()
+        '''
+        合并联系人(按手机), delete_exclude 时删除未提交的联系人
+        '''
+        upsert_related(OrganizationContact, 'organization', 'phone', [(instance, contacts_data)], delete_missing=delete_exclude)
 
     def f_demands_update(self, instance, demands_data, delete_exclude=True):
-        demand_names = []
-        for demand_data in demands_data:
-            demand_data.pop('add_time', None)
-            demand_data.pop('organization', None)
-            name = demand_data.pop('name', None)
-            if bool(name):
-                demand_names.append(name)
-                demand, demand_created = OrganizationDemand.objects.update_or_create(
-                    organization=instance,
-                    name=name,
-                    defaults=demand_data
-                )
-        
-        if bool(demand_names) and delete_exclude:
-            OrganizationDemand.objects.filter(organization=instance).exclude(name__in=demand_names).delete()
+        '''
+        合并需求(按物品名), delete_exclude 时删除未提交的需求
+        '''
+        upsert_related(OrganizationDemand, 'organization', 'name', [(instance, demands_data)], delete_missing=delete_exclude)
 
+    @transaction.atomic
     def update(self, instance, validated_data):
         user = self.context['request'].user
         if instance.inspector != user:
@@ -234,8 +396,6 @@ class OrganizationSerializer(serializers.HyperlinkedModelSerializer):
         self.f_contacts_update(instance, contacts_data)
         self.f_demands_update(instance, demands_data)
 
-        clear_by_prefix('organization')
-
         return instance 
 
 # -----------------------------------------------------------------------------------------------------
@@ -251,20 +411,15 @@ class TeamContactSerializer(serializers.HyperlinkedModelSerializer):
             'team': {'required': False},
         }
 
-    def create(self, validated_data):
-        clear_by_prefix('team')
-        return super(TeamContactSerializer, self).create(validated_data)
-
-    def update(self, instance, validated_data):
-        clear_by_prefix('team')
-        return super(TeamContactSerializer, self).update(instance, validated_data)
-
-class TeamSerializer(serializers.HyperlinkedModelSerializer):
+class TeamSerializer(SparseFieldsMixin, serializers.HyperlinkedModelSerializer):
     contacts = TeamContactSerializer(source='teamcontact_set', many=True)
 
     class Meta:
         model = Team
         fields = ['url', 'id', 'contacts', 'type', 'name', 'address', 'main_text', 'verified', 'inspector', 'wechat_qrcode', 'add_time',]
+        list_serializer_class = FragmentListSerializer
+        cache_key_prefix = 'team' # 片段缓存前缀
+        expandable_fields = {'contacts': 'teamcontact_set'} # 嵌套字段: 预取的关联对象
         extra_kwargs = {
             'id': {'required': False},
             'url': {'required': False, 'read_only': True},
@@ -273,78 +428,41 @@ class TeamSerializer(serializers.HyperlinkedModelSerializer):
             'wechat_qrcode': {'required': False},
         }
 
+    @transaction.atomic
     def create(self, validated_data):
         contacts_data = validated_data.pop('teamcontact_set', [])
 
         validated_data.pop('inspector', None)
         user = self.context['request'].user
         validated_data['inspector'] = user
-        name = validated_data.pop('name', None)
+        key = {'name': validated_data.pop('name', None)}
         validated_data['verified'] = False
 
-        instance, created = Team.objects.get_or_create(
-            name=name,
-            defaults=validated_data
-        )
-
-        is_create_related = True
-        is_update_related = False
-        if not created:
-            # 已存在数据
-            if instance.inspector == user:
-                # 本人创建
-                if instance.verified:
-                    # 已验证
-                    is_create_related = False
-                    is_update_related = True
-                    # 更新
-                    for key in validated_data:
-                        setattr(instance, key, validated_data[key])
-                    instance.save()
-                else:
-                    # 未验证
-                    instance.delete()
-            else:
-                # 他人创建
-                is_create_related = False
-                pass
-        
-        if is_create_related:
-            # 新数据-直接添加
-            if not created:
-                instance = Team.objects.create(
-                    name=name,
-                    **validated_data
-                )
-            for contact_data in contacts_data:
-                contact_data.pop('team', None)
-                contact = TeamContact.objects.create(
-                    team=instance,
-                    **contact_data
-                )
-        if is_update_related:
-            self.f_contacts_update(instance, contacts_data, delete_exclude=False)
-
-        clear_by_prefix('team')
+        instance, created = lock_or_create(Team, key, validated_data)
+        action = 'create' if created else submit_action(instance, user)
+        if action == 'discard':
+            return instance
+        if action == 'replace':
+            # 删除, 创建: 重置字段, 删除联系人(id 不变)
+            reset(instance, validated_data, keep=key)
+            instance.save()
+            clear_related(Team, [instance.pk])
+        elif action == 'update':
+            # 更新: 合并联系人
+            for name in validated_data:
+                setattr(instance, name, validated_data[name])
+            instance.save()
+        upsert_related(TeamContact, 'team', 'phone', [(instance, contacts_data)])
 
         return instance
 
     def f_contacts_update(self, instance, contacts_data, delete_exclude=True):
-        contact_phones = []
-        for contact_data in contacts_data:
-            contact_data.pop('team', None)
-            phone = contact_data.pop('phone', None)
-            if bool(phone):
-                contact_phones.append(phone)
-                contact, contact_created = TeamContact.objects.update_or_create(
-                    team=instance,
-                    phone=phone,
-                    defaults=contact_data
-                )
-        
-        if bool(contact_phones) and delete_exclude:
-            TeamContact.objects.filter(team=instance).exclude(phone__in=contact_phones).delete()
+        '''
+        合并联系人(按手机), delete_exclude 时删除未提交的联系人
+        '''
+        upsert_related(TeamContact, 'team', 'phone', [(instance, contacts_data)], delete_missing=delete_exclude)
 
+    @transaction.atomic
     def update(self, instance, validated_data):
         user = self.context['request'].user
         if instance.inspector != user:
@@ -357,6 +475,4 @@ class TeamSerializer(serializers.HyperlinkedModelSerializer):
 
         self.f_contacts_update(instance, contacts_data)
 
-        clear_by_prefix('team')
-
         return instance 
@@ -1,3 +1,1029 @@
-from django.test import TestCase
+import gzip
+import io
+import multiprocessing
+import os
+import re
+import shutil
+import tempfile
+import threading
+import time
+from unittest import mock
+
+from django.db import transaction
+from django.db import connection
+from django.test import TestCase, TransactionTestCase, override_settings
+from django.test.utils import CaptureQueriesContext
+from rest_framework.parsers import JSONParser
+from rest_framework.request import Request
+from rest_framework.test import APIRequestFactory
 
 # Create your tests here.
+from registration.models import User
+from .models import Organization, OrganizationContact, OrganizationDemand, Team, TeamContact
+
+
+cache_dir = tempfile.mkdtemp(prefix='api-tests-cache-')
+test_caches = {
+    'default': {
+        'BACKEND': 'api.cache_backend.TaggedDjangoCache',
+        'LOCATION': cache_dir,
+        'SHARDS': 2,
+        'LOCAL_SIZE_LIMIT': 2 ** 20,
+        'OPTIONS': {
+            'tag_index': True,
+        },
+    },
+}
+
+class CacheTestMixin(object):
+    """Tests with an empty temporary diskcache"""
+
+    @classmethod
+    def tearDownClass(cls):
+        super(CacheTestMixin, cls).tearDownClass()
+        shutil.rmtree(cache_dir, ignore_errors=True)
+
+    def setUp(self):
+        from django.core.cache import cache
+        cache.clear()
+        self.user = User.objects.create_user('inspector', phone='13000000000', password='password')
+        self.other_user = User.objects.create_user('other', phone='13000000001', password='password')
+        for idx in range(3):
+            Organization.objects.create(province='湖北省', city='武汉市', name='医院{0}'.format(idx), inspector=self.user)
+        Organization.objects.create(province='湖北省', city='武汉市', name='其他医院', inspector=self.other_user)
+
+    def count_renders(self):
+        '''
+        统计列表实际生成(未命中缓存)的次数
+        '''
+        from .views import PatchedViewSet
+
+        return mock.patch.object(PatchedViewSet, 'list', autospec=True, side_effect=PatchedViewSet.list)
+
+def node_caches(directory):
+    '''
+    使用独立缓存目录的节点
+    '''
+    return {'default': dict(test_caches['default'], LOCATION=directory)}
+
+def run_node(directory, broadcast, queue):
+    '''
+    子进程中的节点: 报告 organization 的代数, 等待其它节点的清除广播到达
+    '''
+    from .cache_helper import get_generation
+    with override_settings(CACHES=node_caches(directory), CACHE_BROADCAST=broadcast):
+        generation = get_generation('organization')
+        queue.put(('ready', os.getpid()))
+        deadline = time.time() + 10
+        while time.time() < deadline:
+            if get_generation('organization') != generation:
+                queue.put(('seen', time.time()))
+                return
+            time.sleep(0.05)
+        queue.put(('timeout', time.time()))
+
+@override_settings(CACHES=test_caches)
+class CacheTestCase(CacheTestMixin, TestCase):
+    pass
+
+@override_settings(CACHES=test_caches)
+class CacheTransactionTestCase(CacheTestMixin, TransactionTestCase):
+    """Writes are committed, so transaction.on_commit() callbacks (cache invalidation) run"""
+
+class SharedCacheVariantTest(CacheTestCase):
+    url = '/api/organizations/?scope=wuhan'
+
+    def test_anonymous_readers_share_entry(self):
+        with self.count_renders() as render:
+            for idx in range(5):
+                # 每个访问者的 csrftoken/session cookie 不同
+                self.client.cookies['csrftoken'] = 'token{0}'.format(idx)
+                response = self.client.get(self.url, HTTP_ACCEPT='*/*')
+                self.assertEqual(response.status_code, 200)
+                self.assertEqual(response.json()['count'], 4)
+        self.assertEqual(render.call_count, 1)
+
+    def test_authenticated_readers_share_public_entry(self):
+        with self.count_renders() as render:
+            self.client.get(self.url, HTTP_ACCEPT='*/*')
+            for user in (self.user, self.other_user):
+                self.client.force_login(user)
+                response = self.client.get(self.url, HTTP_ACCEPT='*/*')
+                self.assertEqual(response.json()['count'], 4)
+                self.client.logout()
+        self.assertEqual(render.call_count, 1)
+
+    def test_mine_is_keyed_by_user(self):
+        url = self.url + '&mine=true'
+        with self.count_renders() as render:
+            self.client.force_login(self.user)
+            self.assertEqual(self.client.get(url, HTTP_ACCEPT='*/*').json()['count'], 3)
+            self.assertEqual(self.client.get(url, HTTP_ACCEPT='*/*').json()['count'], 3)
+            self.client.force_login(self.other_user)
+            self.assertEqual(self.client.get(url, HTTP_ACCEPT='*/*').json()['count'], 1)
+            self.client.logout()
+            # 未登录时忽略 mine
+            self.assertEqual(self.client.get(url, HTTP_ACCEPT='*/*').json()['count'], 4)
+        self.assertEqual(render.call_count, 3)
+
+    def test_browsable_api_is_keyed_by_cookie(self):
+        with self.count_renders() as render:
+            self.client.get(self.url, HTTP_ACCEPT='*/*')
+            self.client.force_login(self.user)
+            response = self.client.get(self.url, HTTP_ACCEPT='text/html')
+            self.assertContains(response, 'inspector')
+            self.client.force_login(self.other_user)
+            response = self.client.get(self.url, HTTP_ACCEPT='text/html')
+            self.assertContains(response, 'other')
+        self.assertEqual(render.call_count, 3)
+
+class CompressionTest(CacheTestCase):
+    url = '/api/organizations/?scope=wuhan'
+
+    def test_compressed_once_for_all_clients(self):
+        with self.count_renders() as render:
+            plain = self.client.get(self.url, HTTP_ACCEPT='*/*')
+            compressed = self.client.get(self.url, HTTP_ACCEPT='*/*', HTTP_ACCEPT_ENCODING='gzip, deflate')
+            again = self.client.get(self.url, HTTP_ACCEPT='*/*')
+        self.assertEqual(render.call_count, 1)
+        self.assertFalse(plain.has_header('Content-Encoding'))
+        self.assertIn('Accept-Encoding', plain['Vary'])
+        self.assertEqual(compressed['Content-Encoding'], 'gzip')
+        self.assertEqual(compressed['ETag'], 'W/' + plain['ETag'])
+        self.assertEqual(gzip.decompress(compressed.content), plain.content)
+        self.assertEqual(again.content, plain.content)
+        self.assertEqual(again['ETag'], plain['ETag'])
+
+    def test_gzip_etag_is_not_modified(self):
+        etag = self.client.get(self.url, HTTP_ACCEPT='*/*', HTTP_ACCEPT_ENCODING='gzip')['ETag']
+        response = self.client.get(self.url, HTTP_ACCEPT='*/*', HTTP_ACCEPT_ENCODING='gzip', HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, 304)
+
+class ConditionalGetTest(CacheTestCase):
+    url = '/api/organizations/?scope=wuhan'
+
+    def test_if_none_match(self):
+        response = self.client.get(self.url, HTTP_ACCEPT='*/*')
+        etag = response['ETag']
+        self.assertTrue(response.has_header('Last-Modified'))
+        with self.count_renders() as render, self.assertNumQueries(0):
+            response = self.client.get(self.url, HTTP_ACCEPT='*/*', HTTP_IF_NONE_MATCH=etag)
+            self.assertEqual(response.status_code, 304)
+            self.assertEqual(response['ETag'], etag)
+        self.assertEqual(render.call_count, 0)
+        # 缓存命中的响应 ETag 不变
+        self.assertEqual(self.client.get(self.url, HTTP_ACCEPT='*/*')['ETag'], etag)
+        # 其它URL及格式的 ETag 不同
+        self.assertNotEqual(self.client.get(self.url + '&page=1', HTTP_ACCEPT='*/*')['ETag'], etag)
+        self.assertNotEqual(self.client.get(self.url, HTTP_ACCEPT='text/html')['ETag'], etag)
+
+    def test_write_changes_etag(self):
+        from .cache_helper import clear_by_prefix, evict_object
+        etag = self.client.get(self.url, HTTP_ACCEPT='*/*')['ETag']
+        evict_object('organization', Organization.objects.first().id)
+        response = self.client.get(self.url, HTTP_ACCEPT='*/*', HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, 200)
+        self.assertNotEqual(response['ETag'], etag)
+        etag = response['ETag']
+        clear_by_prefix('organization')
+        self.assertEqual(self.client.get(self.url, HTTP_ACCEPT='*/*', HTTP_IF_NONE_MATCH=etag).status_code, 200)
+
+    def test_if_modified_since(self):
+        last_modified = self.client.get(self.url, HTTP_ACCEPT='*/*')['Last-Modified']
+        response = self.client.get(self.url, HTTP_ACCEPT='*/*', HTTP_IF_MODIFIED_SINCE=last_modified)
+        self.assertEqual(response.status_code, 304)
+        self.assertEqual(response['Last-Modified'], last_modified)
+
+class CacheStatsTest(CacheTestCase):
+    url = '/api/organizations/?scope=wuhan'
+
+    def test_hits_and_misses(self):
+        from .cache_helper import cache_stats, clear_by_prefix, reset_cache_stats
+        reset_cache_stats()
+        for idx in range(3):
+            self.client.get(self.url, HTTP_ACCEPT='*/*')
+        clear_by_prefix('organization')
+        stats = cache_stats()['prefixes']['organization']
+        self.assertGreater(stats['misses'], 0)
+        self.assertGreater(stats['hits'] + stats['local_hits'], 0)
+        self.assertGreater(stats['sets'], 0)
+        self.assertEqual(stats['clears'], 1)
+        self.assertGreater(stats['latency']['get']['count'], 0)
+
+    def test_staff_only(self):
+        self.assertIn(self.client.get('/api/cache-stats/').status_code, (401, 403))
+        self.client.force_login(self.user)
+        self.assertEqual(self.client.get('/api/cache-stats/').status_code, 403)
+        self.user.is_staff = True
+        self.user.save()
+        response = self.client.get('/api/cache-stats/', HTTP_ACCEPT='application/json')
+        self.assertEqual(response.status_code, 200)
+        self.assertIn('shards', response.json())
+
+class FragmentCacheTest(CacheTestCase):
+    url = '/api/organizations/?scope=wuhan'
+
+    def test_only_changed_object_is_serialized(self):
+        from .cache_helper import evict_object
+        from .serializers import FragmentListSerializer
+        first, second = Organization.objects.all()[:2]
+        # 首次: 对象版本缺失, 不写入片段; 第二次(页面被逐出后)写入片段
+        self.client.get(self.url, HTTP_ACCEPT='*/*')
+        evict_object('organization', first.id)
+        expected = self.client.get(self.url, HTTP_ACCEPT='*/*').json()
+        evict_object('organization', second.id)
+        with mock.patch.object(FragmentListSerializer, 'represent', autospec=True, side_effect=FragmentListSerializer.represent) as serialize:
+            response = self.client.get(self.url, HTTP_ACCEPT='*/*')
+        self.assertEqual(serialize.call_count, 1)
+        serializer, items = serialize.call_args[0]
+        self.assertEqual([serializer.pk(item) for item in items], [second.id])
+        self.assertEqual(response.json(), expected)
+
+class QueryCountTest(CacheTestCase):
+
+    def count_queries(self, url):
+        from django.core.cache import cache
+        cache.clear()
+        with CaptureQueriesContext(connection) as queries:
+            self.assertEqual(self.client.get(url, HTTP_ACCEPT='*/*').status_code, 200)
+        return len(queries)
+
+    def add_organizations(self, count):
+        start = Organization.objects.count()
+        for idx in range(start, start + count):
+            organization = Organization.objects.create(province='湖北省', city='武汉市', name='新医院{0}'.format(idx), inspector=self.user)
+            for item in range(2):
+                OrganizationContact.objects.create(organization=organization, name='联系人', phone='1300000{0:04d}'.format(item))
+                OrganizationDemand.objects.create(organization=organization, name='口罩{0}'.format(item))
+
+    def add_teams(self, count):
+        start = Team.objects.count()
+        for idx in range(start, start + count):
+            team = Team.objects.create(name='团队{0}'.format(idx), inspector=self.user)
+            for item in range(2):
+                TeamContact.objects.create(team=team, name='联系人', phone='1300000{0:04d}'.format(item))
+
+    def test_organization_list(self):
+        self.add_organizations(1)
+        few = self.count_queries('/api/organizations/')
+        self.add_organizations(15)
+        self.assertEqual(self.count_queries('/api/organizations/'), few)
+        self.assertLessEqual(few, 4)
+
+    def test_team_list(self):
+        self.add_teams(1)
+        few = self.count_queries('/api/teams/')
+        self.add_teams(15)
+        self.assertEqual(self.count_queries('/api/teams/'), few)
+        self.assertLessEqual(few, 3)
+
+    def test_cached_fragments_are_not_prefetched(self):
+        self.add_organizations(5)
+        # 对象版本在首次请求时确定, 第二次请求写入片段
+        self.client.get('/api/organizations/', HTTP_ACCEPT='*/*')
+        self.client.get('/api/organizations/?page_size=20', HTTP_ACCEPT='*/*')
+        with CaptureQueriesContext(connection) as queries:
+            self.client.get('/api/organizations/?page=1', HTTP_ACCEPT='*/*')
+        self.assertFalse([query for query in queries if 'api_organizationcontact' in query['sql']])
+
+class HyperlinkTest(CacheTestCase):
+
+    def test_templates_match_reverse(self):
+        import api
+        from rest_framework import relations
+        OrganizationContact.objects.create(organization=Organization.objects.first(), name='联系人', phone='13000000000')
+        url = '/api/organizations/?format=json'
+        fast = self.client.get(url).json()
+        from django.core.cache import cache
+        cache.clear()
+        with mock.patch.object(relations, 'reverse', api.slow_reverse):
+            slow = self.client.get(url).json()
+        self.assertEqual(fast, slow)
+        self.assertTrue(fast['results'][0]['url'].startswith('http://testserver/api/organizations/'))
+        self.assertTrue(any(key[2] == 'api:organization-detail' and value for key, value in api.url_templates.items()))
+
+def full_scan_with_sort(plan, vendor):
+    '''
+    查询计划是否为 全表扫描 + 排序(filesort)
+    '''
+    if vendor == 'mysql':
+        return ' ALL ' in plan and 'Using filesort' in plan
+    # sqlite: 按索引顺序读取时为 "SCAN TABLE ... USING INDEX", 不需要 "USE TEMP B-TREE FOR ORDER BY"
+    return any(re.search(r'\bSCAN\b', line) and 'INDEX' not in line for line in plan.splitlines()) \
+        and 'TEMP B-TREE FOR ORDER BY' in plan
+
+class ListIndexTest(TestCase):
+    factory = APIRequestFactory()
+
+    def list_queryset(self, viewset, query=''):
+        '''
+        视图集列表查询(与 list() 相同的查询集及筛选)
+        '''
+        request = Request(self.factory.get('/?' + query), parsers=[JSONParser()])
+        request.user = self.user
+        view = viewset(request=request, format_kwarg=None, action='list', kwargs={})
+        return view.filter_queryset(view.get_queryset())
+
+    def setUp(self):
+        self.user = User.objects.create_user('inspector', phone='13000000000', password='password')
+
+    def test_list_queries_use_indexes(self):
+        from .views import OrganizationContactViewSet, OrganizationDemandViewSet, OrganizationViewSet, TeamContactViewSet, TeamViewSet
+        paths = [
+            (OrganizationViewSet, ''),
+            (OrganizationViewSet, 'scope=wuhan'),
+            (OrganizationViewSet, 'scope=china'),
+            (OrganizationViewSet, 'mine=true'),
+            (OrganizationViewSet, 'verified=true'),
+            (OrganizationViewSet, 'province=湖北省&city=武汉市'),
+            (OrganizationContactViewSet, ''),
+            (OrganizationDemandViewSet, ''),
+            (TeamViewSet, ''),
+            (TeamViewSet, 'mine=true'),
+            (TeamViewSet, 'verified=true'),
+            (TeamViewSet, 'type=student'),
+            (TeamContactViewSet, ''),
+        ]
+        for viewset, query in paths:
+            plan = self.list_queryset(viewset, query).explain()
+            self.assertFalse(full_scan_with_sort(plan, connection.vendor), '{0}?{1}: {2}'.format(viewset.__name__, query, plan))
+
+class SearchTest(CacheTestCase):
+    url = '/api/organizations/'
+
+    def names(self, query):
+        from django.core.cache import cache
+        cache.clear()
+        return [item['name'] for item in self.client.get(self.url + '?' + query, HTTP_ACCEPT='*/*').json()['results']]
+
+    def setUp(self):
+        super(SearchTest, self).setUp()
+        for name, address in (('华中科技大学同济医学院附属协和医院', '解放大道1277号'), ('协和医院', '解放大道'), ('同济医院', '航空路13号')):
+            Organization.objects.create(province='湖北省', city='武汉市', name=name, address=address, inspector=self.user)
+
+    def test_bigram_search_ranked(self):
+        self.assertEqual(self.names('fuzzy_name=协和医院'), ['协和医院', '华中科技大学同济医学院附属协和医院'])
+        self.assertEqual(set(self.names('fuzzy_name=同济')), set(['同济医院', '华中科技大学同济医学院附属协和医院']))
+        self.assertEqual(len(self.names('fuzzy_name=协')), 2)
+        self.assertEqual(self.names('fuzzy_name=协和&fuzzy_address=1277'), ['华中科技大学同济医学院附属协和医院'])
+        self.assertEqual(self.names('fuzzy_name=和同'), [])
+        # 精确查询优先
+        self.assertEqual(self.names('fuzzy_name=同济&name=协和医院'), ['协和医院'])
+
+    def test_index_follows_writes(self):
+        organization = Organization.objects.get(name='同济医院')
+        organization.name = '中南医院'
+        organization.save()
+        self.assertEqual(self.names('fuzzy_name=中南'), ['中南医院'])
+        self.assertEqual(self.names('fuzzy_name=同济'), ['华中科技大学同济医学院附属协和医院'])
+        organization.delete()
+        self.assertEqual(self.names('fuzzy_name=中南'), [])
+
+    def test_uses_search_index(self):
+        from .search import search
+        plan = search(Organization.objects.all(), {'name': '协和'}).explain()
+        self.assertIn('VIRTUAL TABLE', plan)
+
+class SparseFieldsTest(CacheTestCase):
+
+    def setUp(self):
+        super(SparseFieldsTest, self).setUp()
+        for organization in Organization.objects.all():
+            OrganizationContact.objects.create(organization=organization, name='联系人', phone='13000000000')
+            OrganizationDemand.objects.create(organization=organization, name='口罩')
+
+    def get(self, url):
+        with CaptureQueriesContext(connection) as queries:
+            data = self.client.get(url, HTTP_ACCEPT='*/*').json()
+        return data, [query['sql'] for query in queries]
+
+    def test_fields(self):
+        data, queries = self.get('/api/organizations/?fields=name,city,emergency')
+        self.assertEqual(set(data['results'][0]), set(['id', 'name', 'city', 'emergency']))
+        select = [sql for sql in queries if sql.startswith('SELECT "api_organization"."id"')][0]
+        self.assertNotIn('"address"', select)
+        self.assertFalse([sql for sql in queries if 'api_organizationcontact' in sql or 'api_organizationdemand' in sql])
+
+    def test_expand(self):
+        data, queries = self.get('/api/organizations/?expand=contacts')
+        self.assertIn('address', data['results'][0])
+        self.assertEqual(len(data['results'][0]['contacts']), 1)
+        self.assertNotIn('demands', data['results'][0])
+        self.assertFalse([sql for sql in queries if 'api_organizationdemand' in sql])
+        data, queries = self.get('/api/organizations/?fields=name&expand=demands')
+        self.assertEqual(set(data['results'][0]), set(['id', 'name', 'demands']))
+        # 默认返回全部字段
+        data, queries = self.get('/api/organizations/')
+        self.assertIn('contacts', data['results'][0])
+        self.assertIn('demands', data['results'][0])
+
+    def test_detail_and_cursor(self):
+        organization = Organization.objects.first()
+        data, queries = self.get('/api/organizations/{0}/?fields=name'.format(organization.id))
+        self.assertEqual(data, {'id': organization.id, 'name': organization.name})
+        for idx in range(25):
+            Organization.objects.create(province='湖北省', city='武汉市', name='游标医院{0}'.format(idx), inspector=self.user, emergency=idx % 3)
+        data, queries = self.get('/api/organizations/?cursor=&fields=name')
+        # 游标使用的排序字段一并查询, 没有逐个对象的补充查询
+        self.assertEqual(len(queries), 1)
+        self.assertIsNotNone(data['next'])
+        ids = [item['id'] for item in data['results']]
+        self.assertEqual(set(data['results'][0]), set(['id', 'name']))
+        data, queries = self.get(data['next'])
+        self.assertEqual(set(data['results'][0]), set(['id', 'name']))
+        ids.extend(item['id'] for item in data['results'])
+        self.assertEqual(ids, list(Organization.objects.order_by('emergency', '-add_time', 'id').values_list('id', flat=True)))
+
+class FastListTest(CacheTestCase):
+
+    def setUp(self):
+        super(FastListTest, self).setUp()
+        for idx, organization in enumerate(Organization.objects.all()):
+            organization.address = None if idx % 2 else '武汉市"江岸区"\u2028{0}号'.format(idx)
+            organization.save()
+            for item in range(idx):
+                OrganizationContact.objects.create(organization=organization, name='联系人{0}'.format(item), phone='1300000000{0}'.format(item))
+                OrganizationDemand.objects.create(organization=organization, name='口罩{0}'.format(item), remark=None if item else '备注\t', amount=item)
+        for idx, team_type in enumerate(('charity', 'student')):
+            team = Team.objects.create(name='团队{0}'.format(idx), type=team_type, inspector=self.user)
+            TeamContact.objects.create(team=team, name='联系人', phone='13000000000')
+
+    def contents(self, url):
+        """快速路径(values() + orjson) 与 常规序列化(JSONRenderer) 的响应内容"""
+        from django.core.cache import cache
+        from . import renderers
+        from .row_serializer import RowSerializer
+        from .views import OrganizationViewSet, TeamViewSet
+        cache.clear()
+        with mock.patch.object(RowSerializer, 'to_representation', autospec=True, side_effect=RowSerializer.to_representation) as rows:
+            fast = self.client.get(url, HTTP_ACCEPT='application/json').content
+        self.assertGreater(rows.call_count, 0, url)
+        cache.clear()
+        with mock.patch.object(OrganizationViewSet, 'fast_list', False), mock.patch.object(TeamViewSet, 'fast_list', False), \
+                mock.patch.object(RowSerializer, 'compile', side_effect=AssertionError), mock.patch.object(renderers, 'orjson', None):
+            slow = self.client.get(url, HTTP_ACCEPT='application/json').content
+        return fast, slow
+
+    def test_same_bytes(self):
+        first = Organization.objects.order_by('emergency', '-add_time', 'id').first()
+        for url in (
+            '/api/organizations/',
+            '/api/organizations/?scope=wuhan&page=1',
+            '/api/organizations/?fields=name,address&expand=demands',
+            '/api/organizations/?fuzzy_name=医院',
+            '/api/organizations/?cursor=',
+            '/api/organizations/?inspector={0}'.format(first.inspector_id),
+            '/api/teams/',
+            '/api/teams/?fields=type',
+        ):
+            fast, slow = self.contents(url)
+            self.assertEqual(fast, slow, url)
+        self.assertIn(b'\\u2028', fast + self.contents('/api/organizations/')[0])
+
+    def test_renderer(self):
+        import datetime
+        import decimal
+        from django.utils.translation import gettext_lazy
+        from rest_framework.renderers import JSONRenderer
+        from .renderers import FastJSONRenderer
+        data = {
+            'time': datetime.datetime(2020, 2, 1, 8, 30, 15, 123456, tzinfo=datetime.timezone.utc),
+            'date': datetime.date(2020, 2, 1),
+            'amount': decimal.Decimal('1.5'),
+            'lazy': gettext_lazy('Invalid cursor'),
+            1: ['\u2029', None, True, 2 ** 70],
+        }
+        self.assertEqual(FastJSONRenderer().render(data), JSONRenderer().render(data))
+        data[1].pop()
+        self.assertEqual(FastJSONRenderer().render(data), JSONRenderer().render(data))
+        self.assertEqual(
+            FastJSONRenderer().render(data, 'application/json; indent=4'),
+            JSONRenderer().render(data, 'application/json; indent=4'),
+        )
+
+class ExportTest(CacheTestCase):
+
+    def setUp(self):
+        super(ExportTest, self).setUp()
+        Organization.objects.create(province='广东省', city='广州市', name='广州医院', inspector=self.user)
+        for organization in Organization.objects.all():
+            OrganizationContact.objects.create(organization=organization, name='联系人', phone='13000000000')
+            OrganizationDemand.objects.create(organization=organization, name='口罩', remark='N95,"医用"')
+
+    def export(self, url, **extra):
+        response = self.client.get(url, **extra)
+        self.assertEqual(response.status_code, 200)
+        content = b''.join(response.streaming_content)
+        if response.get('Content-Encoding', None) == 'gzip':
+            content = gzip.decompress(content)
+        return response, content.decode('utf-8')
+
+    @override_settings(API_EXPORT_CHUNK_SIZE=2)
+    def test_jsonl_in_chunks(self):
+        import json
+        queries = []
+        def record(execute, sql, params, many, context):
+            queries.append(sql)
+            return execute(sql, params, many, context)
+        # 流式响应在请求结束后才读取数据, 逐条记录执行的 SQL
+        with connection.execute_wrapper(record):
+            response, content = self.export('/api/organizations/export/')
+        rows = [json.loads(line) for line in content.splitlines()]
+        self.assertEqual([row['id'] for row in rows], sorted(Organization.objects.values_list('id', flat=True)))
+        listed = dict((row['id'], row) for row in self.client.get('/api/organizations/', HTTP_ACCEPT='*/*').json()['results'])
+        self.assertEqual(rows, [listed[row['id']] for row in rows])
+        selects = [sql for sql in queries if sql.startswith('SELECT "api_organization"."id"')]
+        self.assertEqual(len(selects), 3)
+        self.assertFalse([sql for sql in selects if 'OFFSET' in sql or 'COUNT(' in sql])
+
+    def test_filters(self):
+        import datetime
+        import json
+        response, content = self.export('/api/organizations/export/?scope=china')
+        self.assertEqual([json.loads(line)['name'] for line in content.splitlines()], ['广州医院'])
+        organization = Organization.objects.first()
+        Organization.objects.filter(pk=organization.pk).update(add_time=datetime.datetime(2030, 1, 1, tzinfo=datetime.timezone.utc))
+        response, content = self.export('/api/organizations/export/?since=2029-12-31')
+        self.assertEqual([json.loads(line)['id'] for line in content.splitlines()], [organization.id])
+        # 带时区偏移: 未编码的 + (解码为空格)及 %2B 相同
+        for since in ['2030-01-01T07:59:00+08:00', '2030-01-01T07:59:00%2B08:00', '2029-12-31T23:59:00Z']:
+            response, content = self.export('/api/organizations/export/?since={0}'.format(since))
+            self.assertEqual([json.loads(line)['id'] for line in content.splitlines()], [organization.id])
+        response, content = self.export('/api/organizations/export/?since=2030-01-01T08:01:00+08:00')
+        self.assertEqual(content, '')
+        # 只修改了联系人/需求的机构也导出
+        other = Organization.objects.exclude(pk=organization.pk).order_by('pk').first()
+        OrganizationDemand.objects.filter(organization=other).update(add_time=datetime.datetime(2030, 1, 1, tzinfo=datetime.timezone.utc))
+        response, content = self.export('/api/organizations/export/?since=2029-12-31')
+        self.assertEqual([json.loads(line)['id'] for line in content.splitlines()], sorted([organization.id, other.id]))
+        team = Team.objects.create(name='团体', inspector=self.user)
+        TeamContact.objects.create(team=team, name='联系人', phone='13000000000')
+        Team.objects.filter(pk=team.pk).update(add_time=datetime.datetime(2020, 1, 1, tzinfo=datetime.timezone.utc))
+        response, content = self.export('/api/teams/export/?since=2029-12-31')
+        self.assertEqual(content, '')
+        TeamContact.objects.filter(team=team).update(add_time=datetime.datetime(2030, 1, 1, tzinfo=datetime.timezone.utc))
+        response, content = self.export('/api/teams/export/?since=2029-12-31')
+        self.assertEqual([json.loads(line)['id'] for line in content.splitlines()], [team.id])
+        self.assertEqual(self.client.get('/api/organizations/export/?since=yesterday').status_code, 400)
+        self.assertEqual(self.client.get('/api/organizations/export/?output=xml').status_code, 400)
+
+    def test_csv_gzip(self):
+        import csv
+        import json
+        response, content = self.export('/api/organizations/export/?output=csv&fields=name,address', HTTP_ACCEPT_ENCODING='gzip', HTTP_ACCEPT='text/csv')
+        self.assertEqual(response['Content-Encoding'], 'gzip')
+        self.assertTrue(response['Content-Type'].startswith('text/csv'))
+        rows = list(csv.reader(content.splitlines()))
+        self.assertEqual(rows[0], ['id', 'name', 'address'])
+        self.assertEqual(len(rows), Organization.objects.count() + 1)
+        from .serializers import TeamSerializer
+        response, content = self.export('/api/teams/export/?output=csv')
+        self.assertEqual(content.splitlines(), [','.join(TeamSerializer.Meta.fields)])
+        response, content = self.export('/api/organizations/export/?output=csv&fields=verified&expand=demands')
+        row = list(csv.DictReader(content.splitlines()))[0]
+        self.assertEqual(row['verified'], 'false')
+        self.assertEqual(json.loads(row['demands'])[0]['remark'], 'N95,"医用"')
+
+class WarmupTest(CacheTransactionTestCase):
+
+    def test_warms_entries_read_by_live_traffic(self):
+        from django.core.management import call_command
+        from django.core.management.base import CommandError
+        with self.assertRaises(CommandError):
+            call_command('cache_warmup', stdout=io.StringIO())
+        with override_settings(CACHE_WARMUP_HOST='wetogether2020.com'):
+            call_command('cache_warmup', '--pages', '1', stdout=io.StringIO())
+        with self.count_renders() as render:
+            response = self.client.get('/api/organizations/?scope=wuhan', HTTP_HOST='wetogether2020.com', HTTP_ACCEPT='*/*')
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(render.call_count, 0)
+
+class CountCacheTest(CacheTestCase):
+
+    def count_queries(self, url):
+        with CaptureQueriesContext(connection) as queries:
+            data = self.client.get(url, HTTP_ACCEPT='*/*').json()
+        return data, len([query for query in queries if 'COUNT(' in query['sql']])
+
+    def test_count_shared_by_pages_and_formats(self):
+        data, counts = self.count_queries('/api/organizations/?scope=china&fuzzy_name=x')
+        self.assertEqual((data['count'], data['count_exact'], counts), (0, True, 1))
+        data, counts = self.count_queries('/api/organizations/?scope=wuhan')
+        self.assertEqual((data['count'], counts), (4, 1))
+        # 参数顺序、页码及格式不同的请求共用同一个数量
+        data, counts = self.count_queries('/api/organizations/?format=json&page=1&scope=wuhan')
+        self.assertEqual((data['count'], counts), (4, 0))
+
+    def test_write_recounts(self):
+        from .cache_helper import clear_by_prefix
+        self.count_queries('/api/organizations/?scope=wuhan')
+        Organization.objects.create(province='湖北省', city='武汉市', name='新医院', inspector=self.user)
+        clear_by_prefix('organization')
+        data, counts = self.count_queries('/api/organizations/?scope=wuhan&page=1')
+        self.assertEqual((data['count'], counts), (5, 1))
+
+    @override_settings(API_COUNT_ESTIMATE_MIN=3)
+    def test_estimate(self):
+        with connection.cursor() as cursor:
+            cursor.execute('ANALYZE')
+        data, counts = self.count_queries('/api/organizations/?count=estimate')
+        self.assertEqual((data['count'], data['count_exact'], counts), (4, False, 0))
+        # 有筛选条件时 SQLite 无法估算, 精确计数
+        data, counts = self.count_queries('/api/organizations/?count=estimate&scope=wuhan')
+        self.assertEqual((data['count'], data['count_exact'], counts), (4, True, 1))
+
+    @override_settings(API_COUNT_ESTIMATE_MIN=3)
+    def test_stale_estimate_does_not_limit_pages(self):
+        with connection.cursor() as cursor:
+            cursor.execute('ANALYZE')
+        # 统计信息过期(估算值为 4): 仍可翻到全部数据
+        for idx in range(40):
+            Organization.objects.create(province='湖北省', city='武汉市', name='新增医院{0}'.format(idx), inspector=self.user)
+        data, counts = self.count_queries('/api/organizations/?count=estimate')
+        self.assertEqual((data['count_exact'], counts, len(data['results'])), (False, 0, 20))
+        self.assertGreaterEqual(data['count'], 21)
+        ids = [item['id'] for item in data['results']]
+        url = data['next']
+        while url:
+            data = self.client.get(url, HTTP_ACCEPT='*/*').json()
+            ids.extend(item['id'] for item in data['results'])
+            url = data['next']
+        self.assertEqual(sorted(ids), sorted(Organization.objects.values_list('id', flat=True)))
+        self.assertEqual(self.client.get('/api/organizations/?count=estimate&page=4', HTTP_ACCEPT='*/*').status_code, 404)
+
+class CursorPaginationTest(CacheTestCase):
+
+    def setUp(self):
+        super(CursorPaginationTest, self).setUp()
+        for idx in range(41):
+            Organization.objects.create(province='湖北省', city='武汉市', name='机构{0}'.format(idx), emergency=idx % 3, inspector=self.user)
+
+    def walk(self, url):
+        ids = []
+        while url:
+            data = self.client.get(url, HTTP_ACCEPT='*/*').json()
+            self.assertNotIn('count', data)
+            ids.extend(item['id'] for item in data['results'])
+            url = data['next']
+        return ids
+
+    def test_walk_matches_ordering(self):
+        expected = list(Organization.objects.order_by('emergency', '-add_time', 'id').values_list('id', flat=True))
+        with CaptureQueriesContext(connection) as queries:
+            self.assertEqual(self.walk('/api/organizations/?cursor='), expected)
+        self.assertFalse([query for query in queries if 'COUNT(' in query['sql']])
+
+    def test_rows_do_not_shift(self):
+        first = self.client.get('/api/organizations/?cursor=', HTTP_ACCEPT='*/*').json()
+        # 新增的数据排在已读取的数据之前
+        Organization.objects.create(province='湖北省', city='武汉市', name='新机构', inspector=self.user)
+        ids = [item['id'] for item in first['results']] + self.walk(first['next'])
+        self.assertEqual(len(ids), len(set(ids)))
+        self.assertEqual(len(ids), Organization.objects.count() - 1)
+
+    def test_previous(self):
+        first = self.client.get('/api/teams/?cursor=', HTTP_ACCEPT='*/*').json()
+        self.assertIsNone(first['previous'])
+        first = self.client.get('/api/organizations/?cursor=', HTTP_ACCEPT='*/*').json()
+        second = self.client.get(first['next'], HTTP_ACCEPT='*/*').json()
+        back = self.client.get(second['previous'], HTTP_ACCEPT='*/*').json()
+        self.assertEqual(back['results'], first['results'])
+        self.assertIsNone(back['previous'])
+
+    def test_invalid_cursor(self):
+        self.assertEqual(self.client.get('/api/organizations/?cursor=abc', HTTP_ACCEPT='*/*').status_code, 404)
+
+    def test_page_uses_index(self):
+        from .pagination import ListPagination
+        organization = Organization.objects.order_by('emergency', '-add_time', 'id')[20]
+        pagination = ListPagination()
+        pagination.ordering = ['emergency', '-add_time', 'id']
+        position = [organization.emergency, organization.add_time, organization.id]
+        for condition in pagination.after(pagination.ordering, position):
+            plan = Organization.objects.filter(condition).order_by(*pagination.ordering)[:21].explain()
+            self.assertIn('SEARCH', plan)
+            self.assertNotIn('TEMP B-TREE', plan)
+
+class InvalidationTest(CacheTransactionTestCase):
+    url = '/api/organizations/?scope=wuhan'
+
+    def test_child_delete_invalidates_dependent_resources(self):
+        organization = Organization.objects.first()
+        contact = OrganizationContact.objects.create(organization=organization, name='联系人', phone='13100000000')
+        self.assertEqual(self.client.get('/api/organization-contacts/', HTTP_ACCEPT='*/*').json()['count'], 1)
+        rows = self.client.get(self.url, HTTP_ACCEPT='*/*').json()['results']
+        self.assertEqual(sum(len(row['contacts']) for row in rows), 1)
+        contact.delete()
+        self.assertEqual(self.client.get('/api/organization-contacts/', HTTP_ACCEPT='*/*').json()['count'], 0)
+        rows = self.client.get(self.url, HTTP_ACCEPT='*/*').json()['results']
+        self.assertEqual(sum(len(row['contacts']) for row in rows), 0)
+
+    def test_once_per_transaction(self):
+        organization = Organization.objects.first()
+        with mock.patch('api.cache_invalidation.clear_by_prefix') as clear, mock.patch('api.cache_invalidation.evict_object') as evict:
+            with transaction.atomic():
+                for idx in range(5):
+                    OrganizationContact.objects.create(organization=organization, name='联系人', phone='1310000000{0}'.format(idx))
+                    OrganizationDemand.objects.create(organization=organization, name='口罩{0}'.format(idx))
+                self.assertEqual(clear.call_count, 0)
+        self.assertEqual(sorted(call[0][0] for call in clear.call_args_list), ['organization-contact', 'organization-demand'])
+        evict.assert_called_once_with('organization', organization.id)
+
+    def test_moved_child_evicts_both_parents(self):
+        first, second = Organization.objects.order_by('pk')[:2]
+        OrganizationContact.objects.create(organization=first, name='联系人', phone='13100000000')
+        contact = OrganizationContact.objects.get(phone='13100000000')
+        contact.organization = second
+        with mock.patch('api.cache_invalidation.evict_object') as evict, CaptureQueriesContext(connection) as queries:
+            contact.save()
+        # 原所属对象由加载时记录的值确定, 保存时只有 UPDATE
+        self.assertEqual([query['sql'].split()[0] for query in queries], ['UPDATE'])
+        self.assertEqual(sorted(call[0] for call in evict.call_args_list), [('organization', first.id), ('organization', second.id)])
+        with mock.patch('api.cache_invalidation.evict_object') as evict:
+            contact.save()
+        evict.assert_called_once_with('organization', second.id)
+
+    def test_parent_delete_clears_resource(self):
+        self.assertEqual(self.client.get(self.url, HTTP_ACCEPT='*/*').json()['count'], 4)
+        Organization.objects.filter(inspector=self.other_user).delete()
+        self.assertEqual(self.client.get(self.url, HTTP_ACCEPT='*/*').json()['count'], 3)
+
+class BulkCreateTest(CacheTransactionTestCase):
+    url = '/api/organizations/bulk/'
+
+    def fixture(self):
+        Organization.objects.all().delete()
+        make = lambda name, **kwargs: Organization.objects.create(province='湖北省', city='武汉市', name=name, **kwargs)
+        make('后台医院', inspector=self.other_user)
+        verified = make('本人已验证', inspector=self.user, is_manual=True, verified=True)
+        OrganizationContact.objects.create(organization=verified, name='旧', phone='13100000001')
+        OrganizationContact.objects.create(organization=verified, name='保留', phone='13100000009')
+        OrganizationDemand.objects.create(organization=verified, name='口罩', amount=1, receive_amount=1)
+        make('本人未验证', inspector=self.user, is_manual=True)
+        make('他人医院', inspector=self.other_user, is_manual=True, verified=True)
+
+    def payload(self, names):
+        return [{
+            'province': '湖北省', 'city': '武汉市', 'name': name, 'address': '地址', 'emergency': 1,
+            'contacts': [{'name': '新', 'phone': '13100000001'}, {'name': '另', 'phone': '13100000002'}],
+            'demands': [{'name': '口罩', 'amount': 5}, {'name': '手套', 'remark': 'L'}],
+        } for name in names]
+
+    def snapshot(self):
+        return sorted(
+            (item.name, item.address, item.emergency, item.verified, item.is_manual, item.inspector_id,
+             sorted((contact.name, contact.phone) for contact in item.organizationcontact_set.all()),
+             sorted((demand.name, demand.remark, demand.amount, demand.receive_amount) for demand in item.organizationdemand_set.all()))
+            for item in Organization.objects.all()
+        )
+
+    def post(self, url, data):
+        import json
+        return self.client.post(url, json.dumps(data), content_type='application/json', HTTP_ACCEPT='application/json')
+
+    def test_same_rules_as_single_create(self):
+        names = ['后台医院', '本人已验证', '本人未验证', '他人医院', '新医院']
+        self.client.force_login(self.user)
+        self.fixture()
+        for data in self.payload(names):
+            self.assertEqual(self.post('/api/organizations/', data).status_code, 201)
+        expected = self.snapshot()
+        self.fixture()
+        other = Organization.objects.get(name='他人医院')
+        with mock.patch('api.cache_invalidation.clear_by_prefix') as clear:
+            response = self.post(self.url, self.payload(names))
+        self.assertEqual(response.status_code, 201)
+        self.assertEqual(self.snapshot(), expected)
+        self.assertEqual([item['name'] for item in response.json()], names)
+        self.assertEqual(response.json()[3]['id'], other.id)
+        # 整批只失效一次
+        self.assertEqual(sorted(call[0][0] for call in clear.call_args_list), ['organization', 'organization-contact', 'organization-demand'])
+
+    def test_queries_do_not_grow(self):
+        self.client.force_login(self.user)
+        counts = []
+        for size in (3, 12):
+            self.fixture()
+            names = ['后台医院', '本人已验证', '本人未验证', '他人医院'] + ['新医院{0}'.format(idx) for idx in range(size)]
+            with CaptureQueriesContext(connection) as queries:
+                self.assertEqual(self.post(self.url, self.payload(names)).status_code, 201)
+            counts.append(len([query for query in queries if not query['sql'].startswith(('SAVEPOINT', 'RELEASE'))]))
+        self.assertEqual(counts[0], counts[1])
+        self.assertEqual(Organization.objects.filter(name__startswith='新医院').count(), 12)
+
+    def test_invalid(self):
+        from .search import search
+        self.client.force_login(self.user)
+        self.assertEqual(self.post(self.url, self.payload(['同名', '同名'])).status_code, 400)
+        data = self.payload(['有效', '无效'])
+        data[1]['contacts'] = [{'name': '缺少手机'}]
+        response = self.post(self.url, data)
+        self.assertEqual(response.status_code, 400)
+        self.assertIn('contacts', response.json()[1])
+        with override_settings(API_BULK_MAX_SIZE=2):
+            self.assertEqual(self.post(self.url, self.payload(['甲', '乙', '丙'])).status_code, 400)
+        self.assertFalse(Organization.objects.filter(name__in=['同名', '有效', '甲']).exists())
+        self.assertEqual(self.post(self.url, self.payload(['全文检索医院'])).status_code, 201)
+        self.assertEqual(search(Organization.objects.all(), {'name': '检索'}).count(), 1)
+        self.client.logout()
+        self.assertIn(self.post(self.url, self.payload(['未登录'])).status_code, (401, 403))
+
+class UpsertRelatedTest(CacheTestCase):
+
+    def setUp(self):
+        super(UpsertRelatedTest, self).setUp()
+        self.client.force_login(self.user)
+
+    def put(self, organization, contacts, demands):
+        import json
+        data = {'province': organization.province, 'city': organization.city, 'name': organization.name, 'contacts': contacts, 'demands': demands}
+        with CaptureQueriesContext(connection) as queries:
+            response = self.client.put('/api/organizations/{0}/'.format(organization.id), json.dumps(data), content_type='application/json', HTTP_ACCEPT='application/json')
+        self.assertEqual(response.status_code, 200)
+        return len([query for query in queries if 'api_organizationcontact' in query['sql'] or 'api_organizationdemand' in query['sql']])
+
+    def test_queries_do_not_grow(self):
+        counts = []
+        for size in (2, 10):
+            organization = Organization.objects.create(province='湖北省', city='武汉市', name='医院{0}号'.format(size), inspector=self.user, is_manual=True)
+            for idx in range(size):
+                OrganizationContact.objects.create(organization=organization, name='旧', phone='1310000{0:04d}'.format(idx))
+                OrganizationDemand.objects.create(organization=organization, name='物品{0}'.format(idx), amount=1)
+            # 保留前一半(更新), 删除后一半, 新增同样数量
+            contacts = [{'name': '新', 'phone': '1310000{0:04d}'.format(idx)} for idx in range(size // 2)]
+            contacts += [{'name': '新增', 'phone': '1320000{0:04d}'.format(idx)} for idx in range(size)]
+            demands = [{'name': '物品{0}'.format(idx), 'amount': 9} for idx in range(size // 2)]
+            demands += [{'name': '新物品{0}'.format(idx)} for idx in range(size)]
+            counts.append(self.put(organization, contacts, demands))
+            self.assertEqual(
+                sorted(organization.organizationcontact_set.values_list('phone', 'name')),
+                sorted((item['phone'], item['name']) for item in contacts),
+            )
+            self.assertEqual(
+                sorted(organization.organizationdemand_set.values_list('name', 'amount')),
+                sorted((item['name'], item.get('amount', -1)) for item in demands),
+            )
+        self.assertEqual(counts[0], counts[1])
+
+    def test_duplicates_are_merged(self):
+        import json
+        from django.db import IntegrityError
+        data = {
+            'province': '湖北省', 'city': '武汉市', 'name': '新医院',
+            'contacts': [{'name': '甲', 'phone': '13100000000'}, {'name': '乙', 'phone': '13100000000'}],
+            'demands': [{'name': '口罩', 'amount': 1}, {'name': '口罩', 'remark': 'N95'}],
+        }
+        response = self.client.post('/api/organizations/', json.dumps(data), content_type='application/json', HTTP_ACCEPT='application/json')
+        self.assertEqual(response.status_code, 201)
+        organization = Organization.objects.get(name='新医院')
+        self.assertEqual(list(organization.organizationcontact_set.values_list('name', flat=True)), ['乙'])
+        self.assertEqual(list(organization.organizationdemand_set.values_list('amount', 'remark')), [(1, 'N95')])
+        with self.assertRaises(IntegrityError), transaction.atomic():
+            OrganizationContact.objects.create(organization=organization, name='丙', phone='13100000000')
+
+class ConcurrentSubmitTest(CacheTransactionTestCase):
+
+    def post(self, client, url, data):
+        import json
+        return client.post(url, json.dumps(data), content_type='application/json', HTTP_ACCEPT='application/json')
+
+    def organization(self, name, phone='13100000001'):
+        return {'province': '湖北省', 'city': '武汉市', 'name': name, 'contacts': [{'name': '联系人', 'phone': phone}], 'demands': [{'name': '口罩'}]}
+
+    def test_replace_keeps_id(self):
+        admin = Organization.objects.create(province='湖北省', city='武汉市', name='后台医院', inspector=self.other_user, address='旧地址', emergency=3)
+        OrganizationContact.objects.create(organization=admin, name='旧', phone='13100000009')
+        self.client.force_login(self.user)
+        response = self.post(self.client, '/api/organizations/', self.organization('后台医院'))
+        self.assertEqual(response.status_code, 201)
+        self.assertEqual(response.json()['id'], admin.id)
+        admin.refresh_from_db()
+        self.assertEqual((admin.inspector, admin.is_manual, admin.address, admin.emergency), (self.user, True, None, 0))
+        self.assertEqual(list(admin.organizationcontact_set.values_list('phone', flat=True)), ['13100000001'])
+
+    def test_conflict_takes_existing_row(self):
+        from . import upsert
+        lock_existing = upsert.lock_existing
+        calls = []
+
+        def concurrent(model, key):
+            # 第一次查询之后、插入之前, 另一个请求递交了同一机构
+            calls.append(key)
+            if len(calls) == 1:
+                Organization.objects.create(inspector=self.other_user, is_manual=True, verified=True, **key)
+                return None
+            return lock_existing(model, key)
+
+        self.client.force_login(self.user)
+        with mock.patch.object(upsert, 'lock_existing', side_effect=concurrent):
+            response = self.post(self.client, '/api/organizations/', self.organization('并发医院'))
+        self.assertEqual(response.status_code, 201)
+        self.assertEqual(len(calls), 2)
+        instance = Organization.objects.get(name='并发医院')
+        # 他人已核实的数据: 丢弃提交的数据
+        self.assertEqual(response.json()['id'], instance.id)
+        self.assertEqual((instance.inspector, instance.organizationcontact_set.count()), (self.other_user, 0))
+
+    def test_threadpool_submissions(self):
+        '''
+        与 twisted-server.py 线程池同样多的线程同时递交同一批机构/团体
+        (SQLite: 递交的事务依次取得数据库的写锁; MySQL: 行锁 + 唯一约束)
+        '''
+        from concurrent.futures import ThreadPoolExecutor
+        from django.conf import settings
+        from django.test import Client
+
+        threads = settings.SERVER_MAX_THREADS
+        names = ['同时递交{0}'.format(idx) for idx in range(5)]
+        barrier = threading.Barrier(threads)
+
+        def submit(idx):
+            try:
+                client = Client()
+                client.force_login(self.user if idx % 2 else self.other_user)
+                barrier.wait(30)
+                phone = '1310000{0:04d}'.format(idx)
+                if idx % 3 == 0:
+                    data = {'name': '同时递交团体', 'type': 'other', 'contacts': [{'name': '联系人', 'phone': phone}]}
+                    return self.post(client, '/api/teams/', data).status_code
+                if idx % 3 == 1:
+                    return self.post(client, '/api/organizations/', self.organization(names[idx % len(names)], phone)).status_code
+                return self.post(client, '/api/organizations/bulk/', [self.organization(name, phone) for name in names]).status_code
+            finally:
+                connection.close()
+
+        with ThreadPoolExecutor(max_workers=threads) as pool:
+            statuses = list(pool.map(submit, range(threads)))
+        self.assertEqual(statuses, [201] * threads)
+        self.assertEqual(
+            sorted(Organization.objects.filter(name__in=names).values_list('name', flat=True)), sorted(names),
+        )
+        team = Team.objects.get(name='同时递交团体')
+        # 依次处理: 联系人只来自数据所有者的递交(手机号末位为线程序号, 奇数为 self.user)
+        owner = lambda phone: self.user if int(phone) % 2 else self.other_user
+        for instance, phones in [(team, team.teamcontact_set.values_list('phone', flat=True))] + [
+            (organization, organization.organizationcontact_set.values_list('phone', flat=True))
+            for organization in Organization.objects.filter(name__in=names)
+        ]:
+            self.assertTrue(phones)
+            self.assertEqual(set(owner(phone) for phone in phones), set([instance.inspector]))
+
+class BroadcastTest(TestCase):
+    nodes = 3
+
+    def setUp(self):
+        self.directory = tempfile.mkdtemp(prefix='api-tests-broadcast-')
+        self.broadcast = {
+            'BACKEND': 'api.cache_broadcast.SQLiteJournal',
+            'LOCATION': os.path.join(self.directory, 'journal.sqlite3'),
+            'INTERVAL': 0.2,
+        }
+
+    def tearDown(self):
+        shutil.rmtree(self.directory, ignore_errors=True)
+
+    def test_interrupted_sync_is_retried(self):
+        from diskcache import Timeout
+        import api.views  # 登记 cache_page 资源前缀
+        from .cache_broadcast import get_broadcast
+        from .cache_helper import get_generation, sync_invalidations
+        with override_settings(CACHES=node_caches(os.path.join(self.directory, 'node0')), CACHE_BROADCAST=dict(self.broadcast, INTERVAL=60)):
+            sync_invalidations(force=True)
+            generation = get_generation('organization')
+            get_broadcast().publish('other-node', 'clear', 'organization')
+            # 执行广播时中断: 日志位置不推进
+            with mock.patch('api.cache_helper.clear_by_prefix', side_effect=Timeout):
+                with self.assertRaises(Timeout):
+                    sync_invalidations(force=True)
+            self.assertEqual(get_generation('organization'), generation)
+            sync_invalidations(force=True)
+            self.assertEqual(get_generation('organization'), generation + 1)
+            # 已执行的日志不再重复执行
+            sync_invalidations(force=True)
+            self.assertEqual(get_generation('organization'), generation + 1)
+
+    def test_clear_reaches_other_nodes(self):
+        import api.views  # 登记 cache_page 资源前缀
+        from .cache_helper import clear_by_prefix, get_generation
+        context = multiprocessing.get_context('fork')
+        queue = context.Queue()
+        processes = [
+            context.Process(target=run_node, args=(os.path.join(self.directory, 'node{0}'.format(idx)), self.broadcast, queue))
+            for idx in range(1, self.nodes)
+        ]
+        with override_settings(CACHES=node_caches(os.path.join(self.directory, 'node0')), CACHE_BROADCAST=self.broadcast):
+            generation = get_generation('organization')
+            for process in processes:
+                process.start()
+            for process in processes:
+                self.assertEqual(queue.get(timeout=10)[0], 'ready')
+            start = time.time()
+            clear_by_prefix('organization')
+            results = [queue.get(timeout=15) for process in processes]
+            for process in processes:
+                process.join(5)
+            # 本节点只执行一次(不重复执行自己广播的清除)
+            self.assertEqual(get_generation('organization'), generation + 1)
+        for state, seen in results:
+            self.assertEqual(state, 'seen')
+            self.assertLess(seen - start, self.broadcast['INTERVAL'] + 2)
@@ -0,0 +1,137 @@
+'''
+关联对象(联系人/需求)的批量写入, 关联对象按 (所属对象, 区分字段) 唯一(见模型的 UniqueConstraint)
+
+upsert_related() 的查询数与对象数无关: 读取已存在的对象 + bulk_update() + bulk_create() + 删除未提交的对象(可选);
+bulk_update()/bulk_create() 不发送信号, 写入的对象由 invalidate_model() 登记缓存失效
+
+机构/团体按区分字段唯一(省 + 市 + 名称 / 名称), 递交时在事务中由 lock_or_create() 锁定(见 for_update())或创建,
+"删除, 创建" 由 reset() + clear_related() 在原数据上完成(id 不变)
+'''
+from django.db import IntegrityError, connections, models, transaction
+from django.db.models import Q
+from django.utils import timezone
+
+from .cache_invalidation import invalidate_model
+
+
+def upsert_related(model, parent_field, key_field, related, delete_missing=False):
+    '''
+    related 为 [(所属对象, [数据, ...]), ...], 区分字段为空的数据忽略; 区分字段相同的数据依次合并(同多次 update_or_create())
+    delete_missing 为 True 时删除所属对象中未提交的关联对象(该所属对象没有提交数据时不删除)
+
+    返回写入的对象
+    '''
+    parents = {}
+    wanted = {}
+    for parent, items in related:
+        for data in items:
+            data = dict(data)
+            data.pop('add_time', None)
+            data.pop(parent_field, None)
+            value = data.pop(key_field, None)
+            if bool(value):
+                parents[parent.pk] = parent
+                wanted.setdefault((parent.pk, value), {}).update(data)
+    if not wanted:
+        return []
+
+    now = timezone.now()
+    parent_attname = model._meta.get_field(parent_field).attname
+    queryset = model._default_manager.filter(**{
+        '{0}__in'.format(parent_field): set(pk for pk, value in wanted),
+        '{0}__in'.format(key_field): set(value for pk, value in wanted),
+    })
+    updated = []
+    fields = set(['add_time'])
+    for obj in queryset:
+        data = wanted.get((getattr(obj, parent_attname), getattr(obj, key_field)), None)
+        if data is None:
+            continue
+        for name, value in data.items():
+            setattr(obj, name, value)
+            fields.add(name)
+        obj.add_time = now
+        updated.append(obj)
+    if updated:
+        model._default_manager.bulk_update(updated, sorted(fields))
+    existing = set((getattr(obj, parent_attname), getattr(obj, key_field)) for obj in updated)
+    created = [
+        model(**dict(data, **{parent_field: parents[pk], key_field: value}))
+        for (pk, value), data in wanted.items() if (pk, value) not in existing
+    ]
+    if created:
+        model._default_manager.bulk_create(created)
+
+    if delete_missing:
+        keep = {}
+        for pk, value in wanted:
+            keep.setdefault(pk, []).append(value)
+        condition = Q()
+        for pk, values in keep.items():
+            condition |= Q(**{parent_field: pk}) & ~Q(**{'{0}__in'.format(key_field): values})
+        model._default_manager.filter(condition).delete()
+
+    invalidate_model(model, updated + created)
+    return updated + created
+
+def for_update(queryset):
+    '''
+    加锁读取, 须在事务中调用: 支持行锁的数据库为 SELECT ... FOR UPDATE;
+    SQLite 先执行不修改数据的 UPDATE 开始写事务(取得数据库的写锁, 其它写事务等待至 timeout), 之后的读取及写入与其它递交依次进行
+    (事务中首个语句即取得写锁, 不会出现 读锁升级为写锁 的死锁)
+    '''
+    connection = connections[queryset.db]
+    if not connection.features.has_select_for_update and connection.vendor == 'sqlite':
+        opts = queryset.model._meta
+        with connection.cursor() as cursor:
+            cursor.execute('UPDATE {0} SET {1} = {1} WHERE 0'.format(
+                connection.ops.quote_name(opts.db_table), connection.ops.quote_name(opts.pk.column)
+            ))
+    return queryset.select_for_update()
+
+def lock_existing(model, key):
+    '''
+    锁定区分字段对应的已存在数据(见 for_update()), 不存在时为 None
+    '''
+    return for_update(model._default_manager.filter(**key)).first()
+
+def lock_or_create(model, key, defaults):
+    '''
+    按区分字段(唯一约束)锁定已存在数据, 不存在时创建, 须在事务中调用; 返回 (对象, 是否新建)
+    并发递交同一数据时后插入的一方违反唯一约束, 回滚到保存点后锁定先插入的数据(加锁读取可以看到已提交的数据)
+    '''
+    instance = lock_existing(model, key)
+    if instance is not None:
+        return instance, False
+    try:
+        with transaction.atomic():
+            return model._default_manager.create(**dict(defaults, **key)), True
+    except IntegrityError:
+        instance = lock_existing(model, key)
+        if instance is None:
+            raise
+        return instance, False
+
+def reset(instance, data, keep=()):
+    '''
+    "删除, 创建" 的字段部分: 字段设为 data 中的值, data 中没有的设为默认值(keep 中的字段及 id 不变), 不保存
+    返回修改的字段名
+    '''
+    fields = []
+    for field in instance._meta.concrete_fields:
+        if field.primary_key or field.name in keep:
+            continue
+        if field.name in data:
+            setattr(instance, field.name, data[field.name])
+        else:
+            setattr(instance, field.attname, field.get_default())
+        fields.append(field.name)
+    return fields
+
+def clear_related(model, pks):
+    '''
+    "删除, 创建" 的关联对象部分: 删除级联删除的关联对象(联系人/需求)
+    '''
+    for rel in model._meta.related_objects:
+        if rel.one_to_many and rel.on_delete is models.CASCADE:
+            rel.related_model._default_manager.filter(**{'{0}__in'.format(rel.field.name): pks}).delete()
@@ -1,18 +1,26 @@
+import hashlib
+import math
+
+from django.conf import settings
 from django.shortcuts import render
 
 # Create your views here.
 from django.db.models import Q
+from django.http import StreamingHttpResponse
 from django.utils.decorators import classonlymethod, method_decorator
-from django.views.decorators.cache import cache_page
-from django.views.decorators.vary import vary_on_cookie
-from rest_framework import viewsets
+from django.utils.http import http_date, parse_etags, parse_http_date_safe, quote_etag
+from rest_framework import status, viewsets
 from rest_framework.reverse import reverse
+from rest_framework.decorators import action, api_view, permission_classes
 from rest_framework.permissions import (
+    SAFE_METHODS,
+    IsAdminUser,
     IsAuthenticated, 
     DjangoModelPermissionsOrAnonReadOnly,
     AllowAny
 )
-from rest_framework.exceptions import PermissionDenied
+from rest_framework.exceptions import PermissionDenied, ValidationError
+from rest_framework.response import Response
 from filer.models.imagemodels import Image
 
 from registration.models import User
@@ -28,11 +36,39 @@ from .serializers import (
 )
 
 from .permissions import AuthenticatedFullPermission
-
+from .cache_helper import accepts_gzip, cache_page, cache_stats, cache_variant, get_modified
+from .export import export_formats, gzip_stream, parse_since, stream
+from .pagination import ListPagination
+from .search import search
+
+
+def search_terms(request):
+    '''
+    模糊查询参数: {字段: 查询文本}, 同时有精确查询(name/address)时忽略对应的模糊查询
+    '''
+    terms = {}
+    for field in ('name', 'address'):
+        if not bool(request.query_params.get(field, None)):
+            text = request.query_params.get('fuzzy_' + field, None)
+            if bool(text):
+                terms[field] = text
+    return terms
+
+class NotModified(Exception):
+    '''
+    条件请求命中(资源未修改), 由 PatchedViewSet.handle_exception() 返回 304
+    '''
+    def __init__(self, headers):
+        super(NotModified, self).__init__()
+        self.headers = headers
 
 class PatchedViewSet(viewsets.ModelViewSet):
     rewrite_app_name = None
     permission_classes = (AuthenticatedFullPermission,)
+    cache_key_prefix = None # 资源前缀(缓存及最后修改时间), None 时不支持条件请求
+    pagination_class = ListPagination
+    cursor_ordering = None # 游标分页的排序(唯一, 末尾为 id), None 时不支持游标分页
+    fast_list = False # 列表由 values() 行直接序列化(见 api.row_serializer), 结果与常规序列化相同
 
     @classonlymethod
     def as_view(cls, actions=None, **initkwargs):
@@ -48,15 +84,152 @@ class PatchedViewSet(viewsets.ModelViewSet):
             request.resolver_match.namespace = self.rewrite_app_name
         return super(PatchedViewSet, self).initialize_request(request, *args, **kwargs)
 
+    def is_conditional(self, request):
+        '''
+        是否支持条件请求(ETag / Last-Modified)
+        '''
+        return self.cache_key_prefix is not None and self.action in ('list', 'retrieve') and request.method in ('GET', 'HEAD')
+
+    def resource_modified(self, request):
+        '''
+        资源最后修改时间, 每个请求只取一次且在读取数据之前(cache_page 未命中时由缓存中间件取得)
+        '''
+        if getattr(request, '_cache_modified', None) is None:
+            request._cache_modified = get_modified(self.cache_key_prefix)
+        return request._cache_modified
+
+    def validators(self, request):
+        '''
+        ETag 及 Last-Modified 响应头: ETag 由最后修改时间、完整URL、缓存变体及响应格式确定
+        '''
+        modified = self.resource_modified(request)
+        info = '{0}|{1}|{2}|{3}'.format(modified, request.get_full_path(), cache_variant(request), request.accepted_media_type)
+        return {
+            'ETag': quote_etag(hashlib.md5(info.encode('utf-8')).hexdigest()),
+            'Last-Modified': http_date(math.ceil(modified)),
+        }
+
+    def check_not_modified(self, request):
+        '''
+        If-None-Match / If-Modified-Since 命中时抛出 NotModified, 不再执行查询及序列化
+        '''
+        if_none_match = request.META.get('HTTP_IF_NONE_MATCH', None)
+        if_modified_since = parse_http_date_safe(request.META.get('HTTP_IF_MODIFIED_SINCE', ''))
+        if if_none_match is None and if_modified_since is None:
+            if not hasattr(self, 'cache_expire'):
+                # 无 cache_page 的资源在此取定最后修改时间
+                self.resource_modified(request)
+            return
+        headers = self.validators(request)
+        if if_none_match is not None:
+            # 有 If-None-Match 时忽略 If-Modified-Since(RFC 7232), 弱比较
+            etags = [etag[2:] if etag.startswith('W/') else etag for etag in parse_etags(if_none_match)]
+            if headers['ETag'] in etags:
+                raise NotModified(headers)
+        elif math.ceil(self.resource_modified(request)) <= if_modified_since:
+            raise NotModified(headers)
+
+    def filter_queryset(self, queryset):
+        queryset = super(PatchedViewSet, self).filter_queryset(queryset)
+        serializer_class = self.get_serializer_class()
+        if self.request.method in SAFE_METHODS and hasattr(serializer_class, 'sparse_queryset'):
+            # 只查询返回的字段(fields/expand 参数)
+            queryset = serializer_class.sparse_queryset(queryset, self.request, extra=self.cursor_ordering or ())
+        return queryset
+
+    def list(self, request, *args, **kwargs):
+        '''
+        fast_list 时列表查询 values() 行, 不创建模型对象(序列化器不支持时使用常规序列化)
+        '''
+        serializer = self.get_serializer(many=True) if self.fast_list else None
+        row_serializer = getattr(serializer, 'row_serializer', None)
+        if row_serializer is None:
+            return super(PatchedViewSet, self).list(request, *args, **kwargs)
+        # 游标分页的排序字段一并查询(position() 使用), 序列化时只输出返回的字段
+        columns = list(row_serializer.columns)
+        columns.extend(name.lstrip('-') for name in self.cursor_ordering or () if name.lstrip('-') not in columns)
+        queryset = self.filter_queryset(self.get_queryset()).values(*columns)
+        page = self.paginate_queryset(queryset)
+        if page is not None:
+            return self.get_paginated_response(serializer.to_representation(page))
+        return Response(serializer.to_representation(list(queryset)))
+
+    def initial(self, request, *args, **kwargs):
+        super(PatchedViewSet, self).initial(request, *args, **kwargs)
+        if self.is_conditional(request):
+            self.check_not_modified(request)
+
+    def handle_exception(self, exc):
+        if isinstance(exc, NotModified):
+            return Response(status=status.HTTP_304_NOT_MODIFIED, headers=exc.headers)
+        return super(PatchedViewSet, self).handle_exception(exc)
+
     def finalize_response(self, request, response, *args, **kwargs):
         final_response = super(PatchedViewSet, self).finalize_response(request, response, *args, **kwargs)
         print('response hook')
+        # 缓存命中的响应保留写入缓存时的 ETag
+        if final_response.status_code == 200 and not final_response.has_header('ETag') and self.is_conditional(request):
+            for header, value in self.validators(request).items():
+                final_response[header] = value
         return final_response
 
     # ModelViewSet default actions:
     # `create()`, `update()`, `partial_update()`, `destroy()`
     # `retrieve()`, `list()`
 
+class ExportMixin(object):
+    '''
+    全量导出 GET <列表>/export/(流式, 见 api.export), 筛选参数与列表相同(不分页), 另有:
+    - output: jsonl(默认) / csv
+    - since: 只导出 add_time(最后修改时间) 不早于该时间的数据, 用于增量同步;
+      联系人/需求(嵌套输出的关联对象)可以单独修改, 其 add_time 不早于该时间的数据一并导出
+    '''
+    export_since_field = 'add_time'
+
+    def since_filter(self, model, since):
+        '''
+        对象或其关联对象(一对多, 有 export_since_field 字段)在 since 之后修改: 关联对象以 id IN (子查询) 判断, 不产生重复行
+        '''
+        lookup = '{0}__gte'.format(self.export_since_field)
+        condition = Q(**{lookup: since})
+        for rel in model._meta.related_objects:
+            if not rel.one_to_many:
+                continue
+            related_fields = set(field.name for field in rel.related_model._meta.concrete_fields)
+            if self.export_since_field in related_fields:
+                changed = rel.related_model._default_manager.filter(**{lookup: since}).values(rel.field.attname)
+                condition |= Q(pk__in=changed)
+        return condition
+
+    def perform_content_negotiation(self, request, force=False):
+        # 导出的响应不经过渲染器, 不按 Accept 拒绝请求
+        return super(ExportMixin, self).perform_content_negotiation(request, force=force or self.action == 'export')
+
+    @action(detail=False, methods=['get'], url_path='export')
+    def export(self, request, format=None):
+        kind = request.query_params.get('output', 'jsonl')
+        if kind not in export_formats:
+            raise ValidationError({'output': 'Supported: {0}'.format(', '.join(sorted(export_formats)))})
+        queryset = self.filter_queryset(self.get_queryset())
+        since = request.query_params.get('since', None)
+        if bool(since):
+            queryset = queryset.filter(self.since_filter(queryset.model, parse_since(since)))
+        serializer = self.get_serializer(many=True)
+        if serializer.row_serializer is not None:
+            queryset = queryset.values(*serializer.row_serializer.columns)
+        names = [name for name, field in serializer.child.fields.items() if not field.write_only]
+
+        content_type, extension = export_formats[kind]
+        pieces = stream(queryset, serializer, names, kind, getattr(settings, 'API_EXPORT_CHUNK_SIZE', 500))
+        response = StreamingHttpResponse(content_type=content_type)
+        if accepts_gzip(request):
+            pieces = gzip_stream(pieces)
+            response['Content-Encoding'] = 'gzip'
+        response.streaming_content = pieces
+        response['Vary'] = 'Accept-Encoding'
+        response['Content-Disposition'] = 'attachment; filename="{0}.{1}"'.format(queryset.model._meta.model_name, extension)
+        return response
+
 class ImageViewSet(PatchedViewSet):
     """
     API endpoint that allows Image to be viewed or edited.
@@ -65,6 +238,15 @@ class ImageViewSet(PatchedViewSet):
 
     queryset = Image.objects.all().order_by('-uploaded_at')
     serializer_class = ImageSerializer
+
+    cache_key_prefix='image' # 最后修改时间前缀(不缓存, 由 ApiConfig.ready() 中的信号更新)
+
+    def is_conditional(self, request):
+        # 未登录时由 list() 拒绝访问
+        if self.action == 'list' and not request.user.is_authenticated:
+            return False
+        return super(ImageViewSet, self).is_conditional(request)
+
     def list(self, request, format=None):
         if request.user.is_authenticated:
             return super(ImageViewSet, self).list(request, format=format)
@@ -84,6 +266,12 @@ class UserViewSet(PatchedViewSet):
     queryset = User.objects.all().order_by('phone')
     serializer_class = UserSerializer
 
+    cache_key_prefix='user' # 最后修改时间前缀(不缓存, 由 ApiConfig.ready() 中的信号更新)
+
+    def is_conditional(self, request):
+        # 未登录时由 list()/retrieve() 拒绝访问
+        return request.user.is_authenticated and super(UserViewSet, self).is_conditional(request)
+
     def list(self, request, format=None):
         if request.user.is_authenticated:
             return super(UserViewSet, self).list(request, format=format)
@@ -100,19 +288,18 @@ class OrganizationContactViewSet(PatchedViewSet):
     """
     # queryset = OrganizationContact.objects.all()
     queryset = OrganizationContact.objects.all().order_by('-add_time')
+    cursor_ordering = ['-add_time', 'id'] # 游标分页
     serializer_class = OrganizationContactSerializer
 
     cache_key_prefix='organization-contact' # 缓存前缀
     cache_expire = 60 * 60 * 2 # 缓存时长: 2小时
 
     @method_decorator(cache_page(cache_expire, key_prefix=cache_key_prefix))
-    @method_decorator(vary_on_cookie)
     def list(self, request, format=None):
         print('list hook')
         return super(OrganizationContactViewSet, self).list(request, format=format)
 
     @method_decorator(cache_page(cache_expire, key_prefix=cache_key_prefix))
-    @method_decorator(vary_on_cookie)
     def retrieve(self, request, *args, **kwargs):
         print('retrieve hook')
         return super(OrganizationContactViewSet, self).retrieve( request, *args, **kwargs)
@@ -123,24 +310,23 @@ class OrganizationDemandViewSet(PatchedViewSet):
     """
     # queryset = OrganizationDemand.objects.all()
     queryset = OrganizationDemand.objects.all().order_by('-add_time')
+    cursor_ordering = ['-add_time', 'id'] # 游标分页
     serializer_class = OrganizationDemandSerializer
 
     cache_key_prefix='organization-demand' # 缓存前缀
     cache_expire = 60 * 60 * 2 # 缓存时长: 2小时
 
     @method_decorator(cache_page(cache_expire, key_prefix=cache_key_prefix))
-    @method_decorator(vary_on_cookie)
     def list(self, request, format=None):
         print('list hook')
         return super(OrganizationDemandViewSet, self).list(request, format=format)
 
     @method_decorator(cache_page(cache_expire, key_prefix=cache_key_prefix))
-    @method_decorator(vary_on_cookie)
     def retrieve(self, request, *args, **kwargs):
         print('retrieve hook')
         return super(OrganizationDemandViewSet, self).retrieve( request, *args, **kwargs)
 
-class OrganizationViewSet(PatchedViewSet):
+class OrganizationViewSet(ExportMixin, PatchedViewSet):
     """
     API endpoint that allows Organization to be viewed or edited.
     """
@@ -148,6 +334,7 @@ class OrganizationViewSet(PatchedViewSet):
 
     # 默认查询集
     queryset = Organization.objects.all()
+    cursor_ordering = ['emergency', '-add_time', 'id'] # 游标分页(与默认排序一致)
 
     def get_queryset(self):
         '''
@@ -173,32 +360,41 @@ class OrganizationViewSet(PatchedViewSet):
         if self.request.user.is_authenticated:
             if self.request.query_params.get('mine', 'false') == 'true':
                 queryset = queryset.filter(inspector=self.request.user)
-        # 按名称-模糊查询
-        if not bool(self.request.query_params.get('name', None)):
-            fuzzy_name = self.request.query_params.get('fuzzy_name', None)
-            if bool(fuzzy_name):
-                queryset = queryset.filter(name__icontains=fuzzy_name)
-        # 按地址-模糊查询
-        if not bool(self.request.query_params.get('address', None)):
-            fuzzy_address = self.request.query_params.get('fuzzy_address', None)
-            if bool(fuzzy_address):
-                queryset = queryset.filter(address__icontains=fuzzy_address)
+        # 按名称、地址-模糊查询(全文索引), 按相关度排序
+        terms = search_terms(self.request)
+        if terms:
+            # 按相关度排序时只支持页码分页
+            self.cursor_ordering = None
+            queryset = search(queryset, terms)
+            return queryset.order_by('-search_relevance', 'emergency', '-add_time')
         # 按紧急程度正序, 时间倒序
         return queryset.order_by('emergency', '-add_time')
 
     serializer_class = OrganizationSerializer
+    fast_list = True # 公开列表: values() 快速序列化
+
+    @action(detail=False, methods=['post'], url_path='bulk')
+    def bulk(self, request, format=None):
+        '''
+        批量递交机构: 请求数据为列表(每项同 POST organizations/), 最多 API_BULK_MAX_SIZE 项, 见 OrganizationListSerializer
+        '''
+        max_size = getattr(settings, 'API_BULK_MAX_SIZE', 100)
+        if isinstance(request.data, list) and len(request.data) > max_size:
+            raise ValidationError({'non_field_errors': ['Ensure this list has no more than {0} items.'.format(max_size)]})
+        serializer = self.get_serializer(data=request.data, many=True)
+        serializer.is_valid(raise_exception=True)
+        serializer.save()
+        return Response(serializer.data, status=status.HTTP_201_CREATED)
 
     cache_key_prefix='organization' # 缓存前缀
     cache_expire = 60 * 60 * 2 # 缓存时长: 2小时
 
     @method_decorator(cache_page(cache_expire, key_prefix=cache_key_prefix))
-    @method_decorator(vary_on_cookie)
     def list(self, request, format=None):
         print('list hook')
         return super(OrganizationViewSet, self).list(request, format=format)
 
     @method_decorator(cache_page(cache_expire, key_prefix=cache_key_prefix))
-    @method_decorator(vary_on_cookie)
     def retrieve(self, request, *args, **kwargs):
         print('retrieve hook')
         return super(OrganizationViewSet, self).retrieve( request, *args, **kwargs)
@@ -211,24 +407,23 @@ class TeamContactViewSet(PatchedViewSet):
     """
     # queryset = TeamContact.objects.all()
     queryset = TeamContact.objects.all().order_by('-add_time')
+    cursor_ordering = ['-add_time', 'id'] # 游标分页
     serializer_class = TeamContactSerializer
 
     cache_key_prefix='team-contact' # 缓存前缀
     cache_expire = 60 * 60 * 2 # 缓存时长: 2小时
 
     @method_decorator(cache_page(cache_expire, key_prefix=cache_key_prefix))
-    @method_decorator(vary_on_cookie)
     def list(self, request, format=None):
         print('list hook')
         return super(TeamContactViewSet, self).list(request, format=format)
 
     @method_decorator(cache_page(cache_expire, key_prefix=cache_key_prefix))
-    @method_decorator(vary_on_cookie)
     def retrieve(self, request, *args, **kwargs):
         print('retrieve hook')
         return super(TeamContactViewSet, self).retrieve( request, *args, **kwargs)
 
-class TeamViewSet(PatchedViewSet):
+class TeamViewSet(ExportMixin, PatchedViewSet):
     """
     API endpoint that allows Team to be viewed or edited.
     """
@@ -236,6 +431,7 @@ class TeamViewSet(PatchedViewSet):
 
     # 默认查询集
     queryset = Team.objects.all()
+    cursor_ordering = ['-add_time', 'id'] # 游标分页(与默认排序一致)
 
     def get_queryset(self):
         '''
@@ -246,32 +442,38 @@ class TeamViewSet(PatchedViewSet):
         if self.request.user.is_authenticated:
             if self.request.query_params.get('mine', 'false') == 'true':
                 queryset = queryset.filter(inspector=self.request.user)
-        # 按名称-模糊查询
-        if not bool(self.request.query_params.get('name', None)):
-            fuzzy_name = self.request.query_params.get('fuzzy_name', None)
-            if bool(fuzzy_name):
-                queryset = queryset.filter(name__icontains=fuzzy_name)
-        # 按地址-模糊查询
-        if not bool(self.request.query_params.get('address', None)):
-            fuzzy_address = self.request.query_params.get('fuzzy_address', None)
-            if bool(fuzzy_address):
-                queryset = queryset.filter(address__icontains=fuzzy_address)
+        # 按名称、地址-模糊查询(全文索引), 按相关度排序
+        terms = search_terms(self.request)
+        if terms:
+            # 按相关度排序时只支持页码分页
+            self.cursor_ordering = None
+            queryset = search(queryset, terms)
+            return queryset.order_by('-search_relevance', '-add_time')
         # 按时间倒序
         return queryset.order_by('-add_time')
 
     serializer_class = TeamSerializer
+    fast_list = True # 公开列表: values() 快速序列化
 
     cache_key_prefix='team' # 缓存前缀
     cache_expire = 60 * 60 * 2 # 缓存时长: 2小时
 
     @method_decorator(cache_page(cache_expire, key_prefix=cache_key_prefix))
-    @method_decorator(vary_on_cookie)
     def list(self, request, format=None):
         print('list hook')
         return super(TeamViewSet, self).list(request, format=format)
 
     @method_decorator(cache_page(cache_expire, key_prefix=cache_key_prefix))
-    @method_decorator(vary_on_cookie)
     def retrieve(self, request, *args, **kwargs):
         print('retrieve hook')
         return super(TeamViewSet, self).retrieve( request, *args, **kwargs)
+
+# ----------------------------------------------------------------
+
+@api_view(['GET'])
+@permission_classes((IsAdminUser,))
+def cache_stats_view(request, format=None):
+    '''
+    缓存指标(仅管理员): 各前缀的命中/未命中/写入/清除/逐出/超时次数, 读写耗时直方图, 各分片大小
+    '''
+    return Response(cache_stats())
@@ -105,6 +105,14 @@ DATABASES = {
     'default': { # default/sqlite
         'ENGINE': 'django.db.backends.sqlite3',
         'NAME': os.path.join(BASE_DIR, 'db.sqlite3'),
+        'OPTIONS': {
+            # 同时只有一个写事务(递交时加锁见 api.upsert.for_update()), 其它写事务最多等待的秒数; 线程池满载时写事务依次排队
+            'timeout': 30,
+        },
+        'TEST': {
+            # 测试数据库使用文件(内存数据库的共享缓存不等待写锁, 多线程的测试直接报错)
+            'NAME': os.path.join(BASE_DIR, 'test_db.sqlite3'),
+        },
     },
     'mysql': { # default/mysql
         'ENGINE': 'django.db.backends.mysql',
@@ -115,6 +123,8 @@ DATABASES = {
         'HOST': '127.0.0.1',  # IP
         'OPTIONS': {
             'charset': 'utf8mb4',
+            # 读已提交: 锁定不存在的数据(递交新机构/团体)时不加间隙锁, 并发插入同一数据时由唯一约束报错而不是死锁
+            'isolation_level': 'read committed',
         },
         'TEST': {
             'CHARSET': 'utf8mb4',
@@ -199,6 +209,11 @@ REST_FRAMEWORK = {
     'DEFAULT_FILTER_BACKENDS': [
         'django_filters.rest_framework.DjangoFilterBackend',
     ],
+    # JSON 使用 orjson 编码(未安装时同 JSONRenderer)
+    'DEFAULT_RENDERER_CLASSES': [
+        'api.renderers.FastJSONRenderer',
+        'rest_framework.renderers.BrowsableAPIRenderer',
+    ],
 }
 
 LOGOUT_ON_PASSWORD_CHANGE = False
@@ -212,20 +227,48 @@ HENDRIX_CHILD_RESOURCES = (
     'hendrix.contrib.concurrency.resources.MessageResource',
     'hendrix.contrib.resources.static.DjangoStaticsFinder'
 )
+# hendrix(twisted-server.py)处理请求的线程池大小, 同时处理的请求数最多为 SERVER_MAX_THREADS
+SERVER_MIN_THREADS = 25
+SERVER_MAX_THREADS = 81
 
 CACHE_DIR = os.path.join(BASE_DIR, 'cache')
 CACHES = {
     'default': {
-        'BACKEND': 'diskcache.DjangoCache',
+        'BACKEND': 'api.cache_backend.TaggedDjangoCache',
         'LOCATION': CACHE_DIR,
         'TIMEOUT': 300,
         'SHARDS': 8,
         'DATABASE_TIMEOUT': 0.010,  # 10 milliseconds
+        'LOCAL_SIZE_LIMIT': 2 ** 26,  # 进程内 LRU 缓存 64 megabytes, 0 表示不启用
+        'LOCAL_CHECK_INTERVAL': 1,    # 检查其它进程清除缓存的间隔(秒)
+        'METRICS_FLUSH_INTERVAL': 10,  # 缓存指标写入 diskcache 的间隔(秒), 见 api.cache_metrics
         'OPTIONS': {
-            'size_limit': 2 ** 30   # 1 gigabyte
+            'size_limit': 2 ** 30,  # 1 gigabyte
+            'tag_index': True,      # cache_page 条目按资源前缀打标签, 按标签索引清除
         },
     },
 }
+# cache_page 防击穿: 同一页面同时只有一个请求重建缓存
+CACHE_LOCK_EXPIRE = 30  # 重建锁超时(秒)
+CACHE_WAIT_TIMEOUT = 5  # 未取得重建锁且没有过期副本时, 等待重建完成的最长时间(秒)
+CACHE_STALE_GRACE = 60  # 过期副本比缓存多保留的宽限期(秒), 重建期间其余请求使用过期副本, 0 表示不保留
+CACHE_COMPRESS_MIN_LENGTH = 200  # 缓存响应 gzip 压缩的最小长度(字节), 更短的响应不压缩
+# 机构/团体序列化片段(列表页由片段组成)的缓存时长(秒)
+CACHE_FRAGMENT_TIMEOUT = 60 * 60 * 2
+# 列表结果数量(分页的 count)的缓存时长(秒), 写入后按资源前缀失效
+CACHE_COUNT_TIMEOUT = 60 * 60 * 2
+# count=estimate 时, 估算的数量不小于该值才返回估算值(count_exact 为 false), 否则精确计数
+API_COUNT_ESTIMATE_MIN = 100000
+# 全量导出(<列表>/export/)每次查询读取的数据条数
+API_EXPORT_CHUNK_SIZE = 500
+# 批量递交(organizations/bulk/)每次最多的数据条数
+API_BULK_MAX_SIZE = 100
+# 多节点缓存失效广播(各节点使用本地 diskcache), None 表示单节点, 配置方式见 api.cache_broadcast
+CACHE_BROADCAST = None
+# cache_warmup 预热使用的 Host 请求头(线上访问的域名, 缓存键的一部分), 如 'wetogether2020.com'; None 时须以 --host 指定
+CACHE_WARMUP_HOST = None
+# cache_warmup 预热 https 的页面(与线上访问的协议一致, 缓存键的一部分)
+CACHE_WARMUP_HTTPS = False
 
 # Maximum Upload Image
 # 2.5MB - 2621440
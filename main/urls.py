@@ -46,6 +46,7 @@ urlpatterns = [
     re_path(r'^robots\.txt$', robots_view, name='robots_txt'),
     path('admin/', admin.site.urls),
     # path('api/', include(router.urls)),
+    path('api/cache-stats/', api_views.cache_stats_view, name='cache_stats'),
     path('api/', include((router.urls, 'api'), namespace='api')),
     path('api-auth/', include('rest_framework.urls', namespace='rest_framework')),
     path('rest-auth/', include('rest_auth.urls')),
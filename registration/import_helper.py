@@ -7,7 +7,10 @@ import chardet
 import numpy as np
 import pandas as pd
 
+from django.db import transaction
+
 from api.models import Organization, OrganizationContact, OrganizationDemand, User
+from api.upsert import clear_related, lock_or_create, reset, upsert_related
 
 
 # 需求列表
@@ -257,47 +260,24 @@ def parse_dataframe(df, user):
         # 写入数据到数据库
         import_row(organization, contact_list, demand_list)
 
+@transaction.atomic
 def import_row(organization, contact_list, demand_list):
-    province = organization.pop('province', None)
-    city = organization.pop('city', None)
-    name = organization.pop('name', None)
-    instance, created = Organization.objects.get_or_create(
-        name=name,
-        province=province,
-        city=city,
-        defaults=organization
-    )
-    need_create = False
-    if not created:
-        # 如果已经存在了后台添加的, 则删除
-        if not instance.is_manual:
-            instance.delete()
-            need_create = True
-    else:
+    key = dict((name, organization.pop(name, None)) for name in ('province', 'city', 'name'))
+    instance, created = lock_or_create(Organization, key, organization)
+    need_create = created
+    if not created and not instance.is_manual:
+        # 如果已经存在了后台添加的, 则删除, 创建(重置字段及联系人、需求, id 不变)
+        reset(instance, organization, keep=key)
+        instance.save()
+        clear_related(Organization, [instance.pk])
         need_create = True
     if need_create:
-        if not created:
-            instance = Organization.objects.create(
-                name=name,
-                province=province,
-                city=city,
-                **organization
-            )
-        for contact_data in contact_list:
-            contact_data.pop('organization', None)
-            contact = OrganizationContact.objects.create(
-                organization=instance,
-                **contact_data
-            )
-        for demand_data in demand_list:
-            demand_data.pop('organization', None)
-            demand = OrganizationDemand.objects.create(
-                organization=instance,
-                **demand_data
-            )
-        print('added [{0}][{1}][{2}]'.format(province, city, name))
+        # 重复的电话/物品名合并为一条(联系人、需求按机构唯一)
+        upsert_related(OrganizationContact, 'organization', 'phone', [(instance, contact_list)])
+        upsert_related(OrganizationDemand, 'organization', 'name', [(instance, demand_list)])
+        print('added [{province}][{city}][{name}]'.format(**key))
     else:
-        print('skiped [{0}][{1}][{2}]'.format(province, city, name))
+        print('skiped [{province}][{city}][{name}]'.format(**key))
 
 if __name__ == '__main__':
     # print(get_file_encoding(__file__))
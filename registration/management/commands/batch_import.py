@@ -1,7 +1,10 @@
 import os
 
-from django.core.management.base import BaseCommand
+from django.conf import settings
+from django.core.management import call_command
+from django.core.management.base import BaseCommand, CommandError
 
+from api.cache_invalidation import deferred_invalidation
 from registration.import_helper import parse_excel_file
 
 
@@ -10,11 +13,19 @@ class Command(BaseCommand):
 
     def add_arguments(self, parser):
         parser.add_argument('excel', type=str, help='Excel file path')
+        parser.add_argument('--warmup', action='store_true', help='warm up cached list pages after import')
 
     def handle(self, *args, **kwargs):
+        if kwargs['warmup'] and not getattr(settings, 'CACHE_WARMUP_HOST', None):
+            # 预热须使用线上访问的 Host(见 cache_warmup)
+            raise CommandError('--warmup requires CACHE_WARMUP_HOST')
         excel_path = os.path.realpath(kwargs['excel'])
         if os.path.exists(excel_path):
-            parse_excel_file(excel_path)
+            # 导入结束后统一失效缓存
+            with deferred_invalidation():
+                parse_excel_file(excel_path)
             self.stdout.write('excel [{0}] import completed'.format(excel_path))
+            if kwargs['warmup']:
+                call_command('cache_warmup', stdout=self.stdout)
         else:
             self.stdout.write('excel [{0}] not exist'.format(excel_path))
\ No newline at end of file
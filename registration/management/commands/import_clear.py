@@ -1,17 +1,30 @@
-from django.core.management.base import BaseCommand
+from django.conf import settings
+from django.core.management import call_command
+from django.core.management.base import BaseCommand, CommandError
 
+from api.cache_invalidation import deferred_invalidation
 from api.models import Organization, User
 
 
 class Command(BaseCommand):
     help = 'clear imported Organization data'
 
+    def add_arguments(self, parser):
+        parser.add_argument('--warmup', action='store_true', help='warm up cached list pages after clear')
+
     def handle(self, *args, **kwargs):
+        if kwargs['warmup'] and not getattr(settings, 'CACHE_WARMUP_HOST', None):
+            # 预热须使用线上访问的 Host(见 cache_warmup)
+            raise CommandError('--warmup requires CACHE_WARMUP_HOST')
         user = User.objects.filter(is_superuser=True).first()
-        deleted, rows_count = Organization.objects.filter(inspector=user).delete()
+        # 删除结束后统一失效缓存
+        with deferred_invalidation():
+            deleted, rows_count = Organization.objects.filter(inspector=user).delete()
         if deleted > 0:
             self.stdout.write('operation completed, deleted rows count as below:')
             for model_name in rows_count:
                 self.stdout.write('{0}: {1}'.format(model_name, rows_count[model_name]))
         else:
-            self.stdout.write('operation completed, no data to delete')
\ No newline at end of file
+            self.stdout.write('operation completed, no data to delete')
+        if kwargs['warmup']:
+            call_command('cache_warmup', stdout=self.stdout)
\ No newline at end of file
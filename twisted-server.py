@@ -17,7 +17,7 @@ execute_from_command_line(['manage.py', 'collectstatic', '--no-input'])
 
 from twisted.python import threadpool
 from twisted.internet import reactor
-thpool = threadpool.ThreadPool(minthreads=25, maxthreads=81)
+thpool = threadpool.ThreadPool(minthreads=settings.SERVER_MIN_THREADS, maxthreads=settings.SERVER_MAX_THREADS)
 
 from zope.interface import provider
 from twisted.logger import (